@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# analyse-session.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This program analyses sessions recorded by messiah-ptz-controller.py with
+# RECORD_DIR set. Recordings are loaded into NumPy arrays and every statistic
+# is computed with array operations, so hours of use are analysed in seconds.
+# It reports axis histograms, time spent in the deadzone, MOVE_UPDATE rates and
+# VAPIX request latency / jitter, and replays the joystick mapping with each
+# --deadzone parameter set in one pass to compare them. NumPy is only needed
+# by this program, not by the controller, so it is listed separately in
+# requirements-analysis.txt. For example:
+#
+#   python analyse-session.py sessions/*.ptzrec --deadzone 0.05,0.05,0.1
+################################################################################
+
+import sys
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit('analyse-session.py needs NumPy: python -m pip install -r requirements-analysis.txt')
+
+from lib.SessionRecorder import COMMANDS, KIND_REPORT, KIND_COMMAND
+from config import JOYSTICK_DEADZONE
+
+# Matches lib.SessionRecorder.RECORD
+RECORD_DTYPE = np.dtype([ ('time', '<f8'), ('duration', '<f4'), ('kind', 'u1'), ('command', 'u1'),
+                          ('status', '<u2'), ('report', 'u1', (4,)), ('pad', 'V4') ])
+
+AXES = ('pan', 'tilt', 'zoom')
+BUTTON_L = 1 << 4
+
+
+def load(paths):
+    # Returns (reports, report durations, commands). A report lasts until the
+    # next one in the same file, so gaps between files are not counted.
+    reports = []
+    durations = []
+    commands = []
+    for path in paths:
+        records = np.fromfile(path, dtype=RECORD_DTYPE)
+        file_reports = records[records['kind'] == KIND_REPORT]
+        reports.append(file_reports)
+        durations.append(np.append(np.diff(file_reports['time']), 0.0))
+        commands.append(records[records['kind'] == KIND_COMMAND])
+    return np.concatenate(reports), np.concatenate(durations), np.concatenate(commands)
+
+def map_joystick(raw, deadzones):
+    """
+    Vectorised PtzController._map_joystick: raw is (N, 3) uint8 and deadzones
+    is (P, 3), giving (P, N, 3) mapped values for every parameter set.
+    """
+    value = (raw.astype(np.float64) / 255.0) * 2.0 - 1.0
+    value[:, 1] = -value[:, 1]
+    value = np.broadcast_to(value, (len(deadzones),) + value.shape)
+    return np.where(np.abs(value) < deadzones[:, None, :], 0.0, value)
+
+def joystick_events(mapped, modifier):
+    # Counts the joystick events PtzController would generate for each
+    # parameter set, as (starts, updates, focus updates) arrays of length P
+    previous = np.concatenate([ np.zeros_like(mapped[:, :1]), mapped[:, :-1] ], axis=1)
+    changed = np.any(mapped != previous, axis=2)
+    idle = np.all(mapped == 0.0, axis=2)
+    was_idle = np.all(previous == 0.0, axis=2)
+
+    update = changed & ~idle & ~was_idle
+    starts = np.count_nonzero(changed & was_idle, axis=1)
+    move_updates = np.count_nonzero(update & ~modifier, axis=1)
+    focus_updates = np.count_nonzero(update & modifier, axis=1)
+    return starts, move_updates, focus_updates, idle
+
+def print_histograms(raw, bins=16):
+    print('Axis histograms (%d bins of the raw 0-255 value, %% of reports)' % bins)
+    for axis, name in enumerate(AXES):
+        counts = np.bincount(raw[:, axis].astype(np.intp) * bins // 256, minlength=bins)
+        print('  %-5s %s' % (name, ' '.join('%4.1f' % p for p in 100.0 * counts / max(len(raw), 1))))
+
+def print_deadzones(raw, durations, modifier, deadzones):
+    total = durations.sum()
+    mapped = map_joystick(raw, deadzones)
+    starts, move_updates, focus_updates, idle = joystick_events(mapped, modifier)
+
+    # The stick is deflected when it is off the centre value it rests at
+    deflected = np.abs(raw.astype(np.int16) - 128) > 1
+    in_deadzone = mapped == 0.0
+
+    print('Deadzone parameter sets over %.0f s of reports' % total)
+    print('  %-17s %-26s %-26s %7s %8s %9s' % ('deadzone', 'in deadzone % (p/t/z)',
+          'deflected but ignored %', 'moves', 'updates', 'updates/s'))
+    for i, deadzone in enumerate(deadzones):
+        dz_time = (durations[:, None] * in_deadzone[i]).sum(axis=0)
+        ignored = (durations[:, None] * (in_deadzone[i] & deflected)).sum(axis=0)
+        moving = durations[~idle[i] & ~modifier].sum()
+        print('  %-17s %-26s %-26s %7d %8d %9.1f' % (','.join('%g' % d for d in deadzone),
+              '/'.join('%.1f' % (100.0 * t / total) for t in dz_time),
+              '/'.join('%.1f' % (100.0 * t / total) for t in ignored),
+              starts[i], move_updates[i], move_updates[i] / moving if moving > 0 else 0.0))
+    print('  focus updates with the first set: %d' % focus_updates[0])
+
+def print_latency(commands):
+    if len(commands) == 0:
+        print('No camera commands recorded')
+        return
+
+    latency = commands['duration'].astype(np.float64) * 1000.0
+    order = np.argsort(commands['command'], kind='stable')
+    codes, starts = np.unique(commands['command'][order], return_index=True)
+
+    print('VAPIX request latency (ms)')
+    print('  %-22s %7s %7s %7s %7s %7s %7s %7s %6s' % ('command', 'count', 'p50', 'p90', 'p99', 'max',
+          'stddev', 'jitter', 'errors'))
+    for code, group in zip(codes, np.split(order, starts[1:])):
+        values = latency[group]
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        # Jitter as the mean difference between consecutive requests
+        jitter = np.abs(np.diff(values)).mean() if len(values) > 1 else 0.0
+        errors = np.count_nonzero((commands['status'][group] < 200) | (commands['status'][group] > 299))
+        name = COMMANDS[code] if code < len(COMMANDS) else 'other'
+        print('  %-22s %7d %7.2f %7.2f %7.2f %7.2f %7.2f %7.2f %6d' % (name, len(values), p50, p90, p99,
+              values.max(), values.std(), jitter, errors))
+
+    span = commands['time'].max() - commands['time'].min()
+    if span > 0:
+        print('  %d requests over %.0f s, %.1f requests/s' % (len(commands), span, len(commands) / span))
+
+def parse_deadzone(text):
+    values = [ float(v) for v in text.split(',') ]
+    if len(values) != 3:
+        raise argparse.ArgumentTypeError('deadzone must be pan,tilt,zoom')
+    return values
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse recorded joystick and camera command sessions')
+    parser.add_argument('recordings', nargs='+', help='session files written with RECORD_DIR set')
+    parser.add_argument('--deadzone', type=parse_deadzone, action='append',
+                        help='pan,tilt,zoom deadzone to replay, may be repeated (default: config)')
+    parser.add_argument('--bins', type=int, default=16, help='histogram bins')
+    args = parser.parse_args()
+
+    reports, durations, commands = load(args.recordings)
+    print('%d reports, %d camera commands' % (len(reports), len(commands)))
+
+    if len(reports) != 0:
+        raw = reports['report'][:, :3]
+        modifier = (reports['report'][:, 3] & BUTTON_L) != 0
+        deadzones = np.array(args.deadzone or [ JOYSTICK_DEADZONE ], dtype=np.float64)
+        print_histograms(raw, args.bins)
+        print_deadzones(raw, durations, modifier, deadzones)
+
+    print_latency(commands)
+
+
+if __name__ == '__main__':
+    main()
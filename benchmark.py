@@ -0,0 +1,1240 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# benchmark.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This program benchmarks parts of the camera control path against the local
+# camera simulator in lib/CameraSimulator.py, so no camera or joystick is
+# needed. Pass the name of a benchmark to run, e.g.
+#
+#   python benchmark.py first-command
+#
+# The soak mode runs the whole controller for hours at an accelerated report
+# rate and fails when memory, file descriptors, threads or live objects grow
+# beyond the given budgets, e.g.
+#
+#   python benchmark.py soak --duration 14400 --rss-budget 16
+#
+# The watchdog mode injects stalls and fails when recovery takes longer than
+# the watchdog's timeout and grace time.
+################################################################################
+
+import os
+import gc
+import sys
+import signal
+import json
+import time
+import select
+import asyncio
+import resource
+import ctypes
+import random
+import struct
+import logging
+import platform
+import threading
+import tempfile
+import functools
+import contextlib
+import argparse
+import statistics
+import multiprocessing
+
+from urllib.parse import urlencode
+
+from lib import transport
+from lib.vapix import CameraControl
+from lib.visca import ViscaControl
+from lib.CameraGroup import CameraGroup
+from lib.HIDProcess import HIDProcess
+from lib.PtzCamera import PtzCamera
+from lib.PtzController import PtzController, Buttons, Events, Event
+from lib.CommandDispatcher import CommandClass, CommandDispatcher
+from lib.CameraSession import CameraSession
+from lib.EventBus import EventBus
+from lib.hidraw import HIDException
+from lib.metrics import metrics
+from lib.Watchdog import watchdog, EXIT_STATUS, HEARTBEAT_INTERVAL
+from lib.SessionRecorder import RECORD, KIND_REPORT
+
+from ping3 import ping
+from lib.CameraSimulator import VapixSimulator, ViscaSimulator, MAX_RATE
+from lib.log import LogAggregator, start_logging
+
+import config
+from config import HID_VID, HID_PID, BUTTON_HOLD_TIME, JOYSTICK_DEADZONE
+
+
+def _ms(seconds):
+    return '%7.2f ms' % (seconds * 1000.0)
+
+def _us(seconds):
+    return '%8.2f us' % (seconds * 1000000.0)
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def _simulator_process(conn, simulator, kwargs):
+    with simulator(**kwargs) as sim:
+        conn.send(sim.address)
+        conn.recv()
+
+class SimulatorProcess(object):
+    # Runs a simulator in a child process so its CPU time is not counted. The
+    # child is spawned rather than forked so it holds none of our file
+    # descriptors, such as the write end of a joystick pipe.
+    _context = multiprocessing.get_context('spawn')
+
+    def __init__(self, simulator=VapixSimulator, **kwargs):
+        self._conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(target=_simulator_process,
+                                                args=(child_conn, simulator, kwargs), daemon=True)
+
+    def __enter__(self):
+        self._process.start()
+        self.address = self._conn.recv()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._conn.send(None)
+        self._process.join()
+
+
+################################################################################
+# Latency of the first command after the camera connection has gone idle
+################################################################################
+def bench_first_command(args):
+    for keepalive in [None, args.idle / 4]:
+        with VapixSimulator(latency=args.latency, idle_timeout=args.idle,
+                            nonce_lifetime=args.idle * 1.5) as sim:
+            camera = CameraControl(sim.address, sim.user, sim.password, keepalive)
+
+            steady = []
+            first = []
+            for _ in range(args.rounds):
+                steady.extend(_timed(camera.continuous_move, 10, 10, 0) for _ in range(args.count))
+                time.sleep(args.idle * 2)
+                first.append(_timed(camera.continuous_move, 10, 10, 0))
+
+            camera.close()
+
+        print('keepalive=%-5s steady median %s, first after idle median %s max %s '
+              '(connections=%d, challenges=%d)' % (keepalive, _ms(statistics.median(steady)),
+              _ms(statistics.median(first)), _ms(max(first)), sim.stats['connections'],
+              sim.stats['challenges']))
+
+
+################################################################################
+# Per-request client CPU time and latency of each HTTP transport
+################################################################################
+def bench_transport(args):
+    with SimulatorProcess(latency=args.latency, user='root', password='pass') as sim:
+        for transport in ['requests', 'socket']:
+            camera = CameraControl(sim.address, 'root', 'pass', transport=transport)
+
+            latency = []
+            cpu_start = time.process_time()
+            for i in range(args.count):
+                latency.append(_timed(camera.continuous_move, i % 100, -(i % 100), 0))
+            cpu = (time.process_time() - cpu_start) / args.count
+
+            camera.close()
+
+            print('transport=%-8s cpu/request %s, latency median %s p99 %s' % (transport, _ms(cpu),
+                  _ms(statistics.median(latency)), _ms(statistics.quantiles(latency, n=100)[98])))
+
+
+################################################################################
+# Continuous move latency of each camera protocol backend
+################################################################################
+def bench_backends(args):
+    with SimulatorProcess(VapixSimulator, latency=args.latency) as vapix_sim, \
+         SimulatorProcess(ViscaSimulator, latency=args.latency) as visca_sim:
+        backends = [
+            ('vapix/requests', lambda: CameraControl(vapix_sim.address, 'root', 'pass')),
+            ('vapix/socket', lambda: CameraControl(vapix_sim.address, 'root', 'pass', transport='socket')),
+            ('visca', lambda: ViscaControl(visca_sim.address)),
+        ]
+
+        for name, open_backend in backends:
+            camera = open_backend()
+
+            latency = []
+            cpu_start = time.process_time()
+            for i in range(args.count):
+                latency.append(_timed(camera.continuous_move, i % 100, -(i % 100), None))
+            cpu = (time.process_time() - cpu_start) / args.count
+
+            latency.append(_timed(camera.stop_move))
+            camera.close()
+
+            print('backend=%-14s cpu/request %s, latency median %s p99 %s' % (name, _ms(cpu),
+                  _ms(statistics.median(latency)), _ms(statistics.quantiles(latency, n=100)[98])))
+
+
+################################################################################
+# Preset recall latency of a camera group, sequential versus concurrent
+################################################################################
+def bench_group(args):
+    with contextlib.ExitStack() as stack:
+        sims = [ stack.enter_context(SimulatorProcess(latency=args.latency)) for _ in range(args.size) ]
+        for size in [ n for n in [1, 2, 4, 8, 16] if n <= args.size ]:
+            group = CameraGroup.open([ sim.address for sim in sims[:size] ],
+                                     lambda address: CameraControl(address, 'root', 'pass'))
+            group.set_server_preset_name('J1')
+
+            sequential = []
+            concurrent = []
+            for _ in range(args.count):
+                sequential.append(_timed(lambda: [ camera.go_to_server_preset_name('J1', 50)
+                                                   for camera in group.members.values() ]))
+                concurrent.append(_timed(group.go_to_server_preset_name, 'J1', 50))
+
+            group.close()
+
+            print('cameras=%-2d preset recall sequential median %s, concurrent median %s p99 %s' % (size,
+                  _ms(statistics.median(sequential)), _ms(statistics.median(concurrent)),
+                  _ms(statistics.quantiles(concurrent, n=100)[98])))
+
+
+################################################################################
+# Joystick report timing with the camera network code loading the process
+################################################################################
+class FakeJoystick(object):
+    # Stands in for the T8311, producing a report numbered k at start + k * period
+    def __init__(self, vid, pid, start=0.0, period=0.008):
+        self._start = start
+        self._period = period
+        self._tick = 0
+
+    def read(self, size, timeout=None):
+        self._tick += 1
+        delay = self._start + self._tick * self._period - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return struct.pack('>I', self._tick)[:size]
+
+    def close(self):
+        pass
+
+def bench_hid(args):
+    period = 0.008
+    with SimulatorProcess(latency=args.latency) as sim:
+        stop = threading.Event()
+
+        def network_load():
+            camera = CameraControl(sim.address, 'root', 'pass')
+            while not stop.is_set():
+                camera.get_ptz()
+            camera.close()
+
+        def cpu_load():
+            while not stop.is_set():
+                sum(i * i for i in range(10000))
+
+        load = [ threading.Thread(target=network_load) for _ in range(2) ]
+        load.append(threading.Thread(target=cpu_load))
+        for thread in load:
+            thread.start()
+
+        for mode in ['thread', 'process']:
+            # The reader process is spawned, so give it time to start up
+            start = time.monotonic() + (0.5 if mode == 'thread' else 3.0)
+            joystick = functools.partial(FakeJoystick, start=start, period=period)
+            device = joystick(0, 0) if mode == 'thread' else HIDProcess(0, 0, joystick)
+
+            stamp_error = []
+            delivery = []
+            for _ in range(args.count * 10):
+                report = device.read(4)
+                now = time.monotonic()
+                scheduled = start + struct.unpack('>I', report)[0] * period
+                stamp_error.append((getattr(device, 'report_time', None) or now) - scheduled)
+                delivery.append(now - scheduled)
+            device.close()
+
+            print('hid=%-7s timestamp error median %s p99 %s, delivery median %s p99 %s' % (mode,
+                  _ms(statistics.median(stamp_error)), _ms(statistics.quantiles(stamp_error, n=100)[98]),
+                  _ms(statistics.median(delivery)), _ms(statistics.quantiles(delivery, n=100)[98])))
+
+        stop.set()
+        for thread in load:
+            thread.join()
+
+
+################################################################################
+# Per-report overhead of the hidapi ctypes backend
+################################################################################
+def bench_hid_read(args):
+    # Needs libhidapi and the joystick. Reads are nonblocking so only the
+    # cost of the read path is measured, not the wait for a report.
+    try:
+        from lib import hid
+        device = hid.Device(HID_VID, HID_PID)
+    except Exception as e:
+        print('hid-read needs libhidapi and the joystick connected: %s' % e)
+        return
+
+    device.nonblocking = 1
+    handle = device._Device__dev
+    buffer = bytearray(4)
+
+    def read_allocating():
+        # The previous read(): a new buffer and two copies per report
+        data = ctypes.create_string_buffer(4)
+        size = hid.hidapi.hid_read(handle, data, 4)
+        return data.raw[:size]
+
+    variants = [
+        ('allocating read', read_allocating),
+        ('read()', lambda: device.read(4)),
+        ('readinto()', lambda: device.readinto(buffer)),
+        ('enumerate()', lambda: hid.enumerate(HID_VID, HID_PID, max_age=0)),
+        ('enumerate() cached', lambda: hid.enumerate(HID_VID, HID_PID)),
+    ]
+    for name, fn in variants:
+        samples = [ _timed(fn) for _ in range(args.count * 20) ]
+        print('%-20s per call median %s p99 %s' % (name, _us(statistics.median(samples)),
+              _us(statistics.quantiles(samples, n=100)[98])))
+
+    device.close()
+
+
+################################################################################
+# Time added to the command path by logging each camera command
+################################################################################
+def bench_logging(args):
+    payload = { 'continuouspantiltmove' : '10,-10', 'continuouszoommove' : 0 }
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def log_direct():
+            logging.info('camera_command(%s)', payload)
+
+        aggregator = LogAggregator('camera_commands')
+        def log_aggregated():
+            aggregator.count(next(iter(payload)))
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug('camera_command(%s)', payload)
+
+        variants = [
+            ('direct handler, per command', log_direct, False),
+            ('queue listener, per command', log_direct, True),
+            ('queue listener, aggregated', log_aggregated, True),
+        ]
+        for name, log_command, queued in variants:
+            stream = open(os.path.join(tmpdir, 'bench.log'), 'w')
+            if queued:
+                listener = start_logging('INFO', stream)
+            else:
+                for handler in list(root.handlers):
+                    root.removeHandler(handler)
+                logging.basicConfig(level=logging.DEBUG, stream=stream)
+
+            samples = [ _timed(log_command) for _ in range(args.count) ]
+
+            if queued:
+                listener.stop()
+            stream.close()
+
+            print('%-28s per call median %s p99 %s' % (name, _us(statistics.median(samples)),
+                  _us(statistics.quantiles(samples, n=100)[98])))
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+
+
+################################################################################
+# CPU cost of the controller state machine and camera command path, with no
+# joystick, camera or network. Inputs come from a seeded generator so runs are
+# comparable, and --baseline saves or compares the results as JSON.
+################################################################################
+REPORT_PERIOD = 0.008
+
+def generate_reports(seed, count):
+    # Joystick reports shaped like real use: idle stretches with a centred
+    # stick that flickers by one count, stick gestures that ramp out, hold
+    # with some noise and return (with L held for focus), and button presses
+    # of varying length with and without a modifier
+    rng = random.Random(seed)
+    centre = (128, 128, 128)
+    reports = []
+    while len(reports) < count:
+        kind = rng.random()
+        if kind < 0.3:
+            for _ in range(rng.randint(10, 100)):
+                reports.append(bytes([ c + rng.choice((-1, 0, 0, 1)) for c in centre ] + [0]))
+        elif kind < 0.85:
+            target = [ rng.randint(0, 255) for _ in centre ]
+            buttons = Buttons.L.value if rng.random() < 0.2 else 0
+            ramp = rng.randint(3, 15)
+            path = [ [ c + (t - c) * i // ramp for c, t in zip(centre, target) ] for i in range(1, ramp + 1) ]
+            path += [ [ min(255, max(0, t + rng.randint(-2, 2))) for t in target ]
+                      for _ in range(rng.randint(10, 150)) ]
+            path += path[ramp - 1::-1]
+            reports.extend(bytes(p + [buttons]) for p in path)
+        else:
+            button = rng.choice((Buttons.J1, Buttons.J2, Buttons.J3, Buttons.J4)).value
+            modifier = rng.choice((0, 0, Buttons.L.value, Buttons.R.value))
+            hold = rng.choice((rng.randint(2, 30), int(BUTTON_HOLD_TIME / REPORT_PERIOD) + 5))
+            if modifier:
+                reports.extend(bytes(centre + (modifier,)) for _ in range(rng.randint(2, 10)))
+            reports.extend(bytes(centre + (button | modifier,)) for _ in range(hold))
+            reports.extend(bytes(centre + (0,)) for _ in range(rng.randint(2, 10)))
+    return reports[:count]
+
+def generate_events(seed, count):
+    # Event sequences as the controller emits them, so PtzCamera is always in
+    # the state each event is handled in
+    rng = random.Random(seed)
+    def stick():
+        return tuple(rng.uniform(-1.0, 1.0) for _ in range(3))
+
+    events = []
+    while len(events) < count:
+        events.append(Event(Events.MOVE_START, None, None, stick(), 0.0))
+        events.extend(Event(Events.MOVE_UPDATE, None, None, stick(), 0.0) for _ in range(rng.randint(5, 50)))
+        events.append(Event(Events.MOVE_END, None, None, (0.0, 0.0, 0.0), 0.0))
+        events.append(Event(Events.FOCUS_START, None, None, stick(), 0.0))
+        events.extend(Event(Events.FOCUS_UPDATE, None, None, stick(), 0.0) for _ in range(rng.randint(5, 50)))
+        events.append(Event(Events.FOCUS_END, None, None, (0.0, 0.0, 0.0), 0.0))
+        # Only button actions that do not wait for the camera to stop moving
+        button = rng.choice((Buttons.J1, Buttons.J2, Buttons.J3, Buttons.J4))
+        events.append(Event(Events.BTN_PRESS, button, None, None, 0.0))
+        events.append(Event(Events.BTN_PRESS_WITH_MODIFIER, button, Buttons.L, None, 0.0))
+        events.append(Event(Events.BTN_HOLD, Buttons.L, None, None, 0.0))
+    return events[:count]
+
+class ReplayJoystick(object):
+    # HID device returning a fixed list of reports, stamped REPORT_PERIOD apart
+    reports = []
+
+    def __init__(self, vid, pid):
+        self._index = 0
+        self.report_time = None
+
+    def readinto(self, buffer, timeout=None):
+        report = self.reports[self._index % len(self.reports)]
+        self._index += 1
+        self.report_time = self._index * REPORT_PERIOD
+        buffer[:len(report)] = report
+        return len(report)
+
+    def read(self, size, timeout=None):
+        report = bytearray(size)
+        return bytes(report[:self.readinto(report, timeout)])
+
+    def close(self):
+        pass
+
+class NullTransport(object):
+    # Encodes the query string like a real transport but sends nothing
+    REPLIES = { 'speed' : b'speed=50\r\n', 'position' : b'pan=0.0\r\ntilt=0.0\r\nzoom=1\r\n' }
+
+    def __init__(self, user, password):
+        self.last_url = None
+
+    def get(self, url, params, timeout):
+        self.last_url = url + '?' + urlencode({ key : value for key, value in params.items() if value is not None })
+        reply = self.REPLIES.get(params.get('query'))
+        return transport.Response(200 if reply else 204, {}, reply or b'')
+
+    def close(self):
+        pass
+
+@contextlib.contextmanager
+def _in_tmpdir():
+    # Setting the speed with a modifier press writes PtzCameraSettings.json
+    # to the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+def _time_batch(benchmarks, inputs, rounds):
+    # Nanoseconds per input in the best round of each benchmark. Rounds are
+    # interleaved so a burst of load from elsewhere is spread over all of them
+    # rather than landing on one benchmark, and the collector is paused as
+    # timeit does.
+    samples = { name : [] for name, _ in benchmarks }
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for name, fn in benchmarks:
+                start = time.perf_counter_ns()
+                fn(inputs)
+                samples[name].append((time.perf_counter_ns() - start) / len(inputs))
+    finally:
+        gc.enable()
+    return { name : min(values) for name, values in samples.items() }
+
+def _bench_controller(reports, rounds):
+    ReplayJoystick.reports = reports
+    controller = PtzController(0, 0, BUTTON_HOLD_TIME, deadzone=JOYSTICK_DEADZONE, device=ReplayJoystick)
+
+    def process_buttons(reports):
+        for i, report in enumerate(reports):
+            controller.now = i * REPORT_PERIOD
+            controller._process_buttons(report[3])
+
+    def process_joystick(reports):
+        for report in reports:
+            controller._process_joystick(report[:3])
+
+    def update(reports):
+        for _ in reports:
+            controller.update()
+
+    results = _time_batch([('controller._process_buttons', process_buttons),
+                           ('controller._process_joystick', process_joystick),
+                           ('controller.update', update)], reports, rounds)
+    controller.close()
+    return results
+
+def _bench_camera(events, rounds):
+    # Times each handle_event call and takes the median per event type, as a
+    # single call is too short for its best time to mean much. The dispatcher
+    # and scheduler threads still run, so their work on the null backend
+    # competes for the CPU as it does in the controller.
+    camera = PtzCamera('null', '', '', protocol='null')
+    per_type = { event_type : [] for event_type in Events }
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for event in events:
+                start = time.perf_counter_ns()
+                camera.handle_event(event)
+                per_type[event.type].append(time.perf_counter_ns() - start)
+            camera.poll()
+    finally:
+        gc.enable()
+    camera.close()
+    return { 'camera.handle_event.%s' % event_type.name : statistics.median(samples)
+             for event_type, samples in per_type.items() }
+
+def _bench_vapix(count, rounds):
+    transport.TRANSPORTS['null'] = NullTransport
+    camera = CameraControl('camera.invalid', 'root', 'pass', transport='null')
+    commands = [
+        ('continuous_move', lambda i: camera.continuous_move(i % 100, -(i % 100), i % 7)),
+        ('stop_move', lambda i: camera.stop_move()),
+        ('continuous_focus', lambda i: camera.continuous_focus(i % 100)),
+        ('go_to_server_preset_name', lambda i: camera.go_to_server_preset_name('J1', 50)),
+        ('get_ptz', lambda i: camera.get_ptz()),
+    ]
+    def run(command):
+        def run_inputs(inputs):
+            for i in inputs:
+                command(i)
+        return run_inputs
+
+    results = _time_batch([ ('vapix.%s' % name, run(command)) for name, command in commands ],
+                          range(count), rounds)
+    camera.close()
+    return results
+
+def bench_cpu(args):
+    # Many short rounds, so the best round is a stable measure of the code
+    # rather than of whatever else the machine was doing
+    count = args.count * 20
+    rounds = args.rounds * 10
+    results = {}
+    with _in_tmpdir():
+        results.update(_bench_controller(generate_reports(args.seed, count), rounds))
+        results.update(_bench_camera(generate_events(args.seed, count), rounds))
+        results.update(_bench_vapix(count, rounds))
+
+    baseline = None
+    if args.baseline and not args.save and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != platform.machine():
+            print('warning: baseline was recorded on %s, this is %s' % (baseline.get('machine'),
+                  platform.machine()))
+        if (baseline.get('seed'), baseline.get('count')) != (args.seed, count):
+            print('warning: baseline was recorded with different --seed or --count')
+
+    regressions = []
+    for name, result in results.items():
+        line = '%-45s %10.0f ns' % (name, result)
+        previous = baseline['results'].get(name) if baseline else None
+        if previous:
+            change = (result - previous) / previous * 100.0
+            line += '  %+7.1f%%' % change
+            if change > args.threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    if args.baseline and (args.save or baseline is None):
+        with open(args.baseline, 'w') as f:
+            json.dump({ 'machine' : platform.machine(), 'python' : platform.python_version(),
+                        'seed' : args.seed, 'count' : count, 'rounds' : rounds,
+                        'results' : results }, f, sort_keys=True, indent=4)
+        print('saved baseline to "%s"' % args.baseline)
+
+    if regressions:
+        print('%d benchmarks slower than the baseline by more than %.0f%%' % (len(regressions), args.threshold))
+        sys.exit(1)
+
+
+################################################################################
+# Threads, CPU time and context switches of a thread per camera, as the
+# controller used to run, against all cameras on one asyncio event loop. Each
+# camera's joystick is a pipe fed from another process, and the cameras use the
+# null protocol so only the runtime itself is measured. The thread per camera
+# loop pinged the camera after every report, it is measured with the ping to
+# localhost and without it.
+################################################################################
+class PipeJoystick(object):
+    # HID device reading reports from the next pipe in fds
+    fds = []
+
+    def __init__(self, vid, pid):
+        self.fd = PipeJoystick.fds.pop(0)
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, size, timeout=None):
+        if timeout is not None and not select.select([self.fd], [], [], timeout / 1000.0)[0]:
+            return b''
+        report = os.read(self.fd, size)
+        if not report:
+            raise HIDException('joystick pipe closed')
+        return report
+
+    def close(self):
+        os.close(self.fd)
+
+def _feed_joysticks(fds, reports, period, duration):
+    end = time.monotonic() + duration
+    tick = 0
+    while time.monotonic() < end:
+        for fd in fds:
+            os.write(fd, reports[tick % len(reports)])
+        tick += 1
+        time.sleep(max(0.0, tick * period - (duration - (end - time.monotonic()))))
+    for fd in fds:
+        os.close(fd)
+
+def _runtime_settings():
+    settings = { key : getattr(config, key) for key in config.__all__
+                 if key not in ['CONFIG_FILE', 'OPTIONAL_SETTINGS', 'POSITIVE_SETTINGS'] }
+    settings['CAM_PROTOCOL'] = 'null'
+    settings['CAM_GROUP'] = []
+    settings['HID_PROCESS'] = False
+    return settings
+
+def _run_threads(cameras, settings, measure, ping_camera=True):
+    # The old CameraThread loop
+    def camera_thread(ip):
+        controller = PtzController(0, 0, settings['BUTTON_HOLD_TIME'], deadzone=settings['JOYSTICK_DEADZONE'],
+                                   device=PipeJoystick)
+        camera = PtzCamera(ip, '', '', protocol='null')
+        try:
+            while True:
+                for event in controller.update():
+                    camera.handle_event(event)
+                camera.poll()
+                if ping_camera:
+                    ping('127.0.0.1', timeout=1)
+        except HIDException:
+            pass
+        controller.close()
+        camera.close()
+
+    threads = [ threading.Thread(target=camera_thread, args=('camera%d' % i,), name='CameraThread')
+                for i in range(cameras) ]
+    for thread in threads:
+        thread.start()
+    result = measure()
+    for thread in threads:
+        thread.join()
+    return result
+
+def _run_asyncio(cameras, settings, measure):
+    async def run():
+        loop = asyncio.get_running_loop()
+        sessions = [ CameraSession('camera%d' % i, settings, EventBus(), None, device=PipeJoystick)
+                     for i in range(cameras) ]
+        tasks = [ asyncio.ensure_future(session.run()) for session in sessions ]
+        # measure runs on, and is counted as, one of the asyncio threads
+        result = await loop.run_in_executor(None, measure)
+        for session in sessions:
+            session.shutdown()
+        await asyncio.gather(*tasks)
+        return result
+    return asyncio.run(run())
+
+def bench_runtime(args):
+    period = 0.008
+    duration = max(2.0, args.count / 10.0)
+    reports = generate_reports(args.seed, int(duration / period))
+    settings = _runtime_settings()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    runtimes = [
+        ('threads', _run_threads),
+        ('threads, no ping', functools.partial(_run_threads, ping_camera=False)),
+        ('asyncio', _run_asyncio),
+    ]
+    for cameras in [1, args.size]:
+        for name, runtime in runtimes:
+            pipes = [ os.pipe() for _ in range(cameras) ]
+            PipeJoystick.fds = [ r for r, _ in pipes ]
+            feeder = multiprocessing.Process(target=_feed_joysticks, args=([ w for _, w in pipes ], reports,
+                                                                          period, duration + 0.5))
+            feeder.start()
+            for _, w in pipes:
+                os.close(w)
+
+            def measure():
+                # Skips start-up, then samples over the steady state
+                time.sleep(0.5)
+                threads = {}
+                for thread in threading.enumerate():
+                    # e.g. asyncio_0 and CameraGroup_1 are counted as one kind
+                    kind = thread.name.split('-')[0].rstrip('0123456789_')
+                    threads[kind] = threads.get(kind, 0) + 1
+                start = resource.getrusage(resource.RUSAGE_SELF)
+                time.sleep(duration - 0.5)
+                end = resource.getrusage(resource.RUSAGE_SELF)
+                cpu = (end.ru_utime + end.ru_stime) - (start.ru_utime + start.ru_stime)
+                switches = (end.ru_nvcsw + end.ru_nivcsw) - (start.ru_nvcsw + start.ru_nivcsw)
+                return threads, cpu / (duration - 0.5), switches / (duration - 0.5)
+
+            with _in_tmpdir():
+                threads, cpu, switches = runtime(cameras, settings, measure)
+            feeder.join()
+            print('cameras=%d runtime=%-16s cpu %5.1f%%, context switches %6.0f/s, threads %3d (%s)' % (
+                  cameras, name, cpu * 100.0, switches, sum(threads.values()),
+                  ', '.join('%s %d' % item for item in sorted(threads.items()))))
+
+
+################################################################################
+# Request timeouts under packet loss: joystick gestures of motion updates at
+# 20 Hz ending in a stop go through the CommandDispatcher to a simulator that
+# stalls a fraction of requests, once with the old fixed 2 s timeout and once
+# with timeouts adapted to the measured round trip time.
+################################################################################
+def _percentile(values, percent):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+def _drive_gestures(camera, dispatcher, gestures, rng):
+    motion = []
+    outcome = { 'superseded' : 0, 'failed' : 0, 'stop_failed' : 0, 'escalated' : 0 }
+
+    def motion_done(submitted, future):
+        if future.cancelled():
+            outcome['superseded'] += 1
+        elif future.exception() is not None:
+            outcome['failed'] += 1
+        else:
+            motion.append(time.monotonic() - submitted)
+
+    stops = []
+    for _ in range(gestures):
+        for _ in range(20):
+            future = dispatcher.submit(CommandClass.MOTION, 'move', camera.continuous_move,
+                                       rng.randint(-100, 100), rng.randint(-100, 100), 0)
+            future.add_done_callback(functools.partial(motion_done, time.monotonic()))
+            time.sleep(0.05)
+
+        start = time.monotonic()
+        try:
+            dispatcher.submit(CommandClass.STOP, 'move', camera.stop_move).result()
+            stops.append(time.monotonic() - start)
+        except Exception:
+            outcome['stop_failed'] += 1
+        try:
+            dispatcher.check()
+        except Exception:
+            # CameraSession would reconnect to the camera here
+            outcome['escalated'] += 1
+    return motion, stops, outcome
+
+def bench_loss(args):
+    gestures = max(5, args.count // 5)
+    print('%d gestures of 20 motion updates and a stop, lost requests stall for 1 s' % gestures)
+    for loss in [0.0, 0.02, 0.1]:
+        for name, timeout in [('fixed 2s', 2.0), ('adaptive', None)]:
+            with SimulatorProcess(latency=args.latency, loss=loss, loss_delay=1.0) as sim:
+                camera = CameraControl(sim.address, 'root', 'pass', transport=config.CAM_TRANSPORT,
+                                       request_timeout=timeout)
+                dispatcher = CommandDispatcher(config.COMMAND_RETRY_DEADLINE)
+                dispatcher.start()
+                motion, stops, outcome = _drive_gestures(camera, dispatcher, gestures, random.Random(args.seed))
+                dispatcher.shutdown()
+                dispatcher.join()
+                camera.close()
+
+            updates = gestures * 20
+            print('loss=%4.1f%% %-9s motion p50 %s p99 %s failed %4.1f%% superseded %4.1f%% | '
+                  'stop p50 %s p99 %s max %s failed %d | escalated %d' % (loss * 100.0, name,
+                  _ms(_percentile(motion, 50)), _ms(_percentile(motion, 99)),
+                  100.0 * outcome['failed'] / updates, 100.0 * outcome['superseded'] / updates,
+                  _ms(_percentile(stops, 50)), _ms(_percentile(stops, 99)), _ms(max(stops, default=float('nan'))),
+                  outcome['stop_failed'], outcome['escalated']))
+
+
+################################################################################
+# Overshoot of the camera after the stick is centred. Pan gestures are fed to
+# PtzCamera at the joystick's report rate: out to a random deflection, held,
+# then let go (centred in 40 ms) or eased back (300 ms). The simulator
+# integrates the camera's motion, so the pan after the stick reaches centre is
+# the overshoot in degrees. Travel error compares the whole movement with a
+# camera that followed the stick instantly.
+################################################################################
+def _gesture(rng, release):
+    amplitude = rng.uniform(0.5, 1.0)
+    hold = int(rng.uniform(0.4, 0.8) / REPORT_PERIOD)
+    back = int((0.04 if release else 0.3) / REPORT_PERIOD)
+    out = [ amplitude * i / 10 for i in range(1, 11) ]
+    return out + [amplitude] * hold + [ amplitude * (1.0 - i / back) for i in range(1, back) ]
+
+def _run_gesture(camera, sim, profile, sign):
+    start = sim.get_position()[0]
+    camera.handle_event(Event(Events.MOVE_START, None, None, (0.0, 0.0, 0.0), time.monotonic()))
+    next_report = time.monotonic()
+    for value in profile:
+        camera.handle_event(Event(Events.MOVE_UPDATE, None, None, (sign * value, 0.0, 0.0), time.monotonic()))
+        next_report += REPORT_PERIOD
+        time.sleep(max(0.0, next_report - time.monotonic()))
+
+    centred = sim.get_position()[0]
+    camera.handle_event(Event(Events.MOVE_END, None, None, (0.0, 0.0, 0.0), time.monotonic()))
+    time.sleep(0.5)
+    camera.poll()
+    end = sim.get_position()[0]
+
+    ideal = sum(profile) * REPORT_PERIOD * MAX_RATE[0]
+    return sign * (end - centred), sign * (end - start) - ideal
+
+def bench_overshoot(args):
+    gestures = max(4, args.count // 5)
+    print('%d gestures per row, half let go and half eased back, degrees of pan' % (2 * gestures))
+    with _in_tmpdir():
+        for latency in [0.02, 0.05, 0.1]:
+            for lead in [0.0, config.MOTION_LEAD]:
+                with VapixSimulator(latency=latency) as sim:
+                    camera = PtzCamera(sim.address, sim.user, sim.password, transport='socket', motion_lead=lead)
+                    camera.handle_event(Event(Events.BTN_PRESS_WITH_MODIFIER, Buttons.J4, Buttons.L, None, 0.0))
+                    rng = random.Random(args.seed)
+                    results = { True : [], False : [] }
+                    for i in range(2 * gestures + 2):
+                        release = i % 2 == 0
+                        result = _run_gesture(camera, sim, _gesture(rng, release), 1 if i % 4 < 2 else -1)
+                        # The first gestures only warm up the latency estimate
+                        if i >= 2:
+                            results[release].append(result)
+                    latency_estimate = camera.dispatcher.expected_latency(CommandClass.MOTION)
+                    early_stops = camera.stats['early_stops']
+                    camera.close()
+
+                for release in [True, False]:
+                    coast = [ c for c, _ in results[release] ]
+                    error = [ e for _, e in results[release] ]
+                    print('latency %3.0f ms (measured %5.1f ms) lead %.1f %-9s overshoot mean %5.2f max %5.2f, '
+                          'travel error mean %+6.2f, early stops %d' % (latency * 1000.0, latency_estimate * 1000.0,
+                          lead, 'let go' if release else 'eased', statistics.mean(coast), max(coast),
+                          statistics.mean(error), early_stops))
+
+
+################################################################################
+# Soak test of the whole controller: a CameraSession on the event loop drives
+# the VAPIX simulator from a pipe joystick fed at an accelerated rate. The HID
+# device and the camera are failed at intervals so the sessions are rebuilt
+# over and over, and resource use is sampled after a warm-up. Growth between
+# the start and the end of the run is checked against the budgets.
+################################################################################
+class SoakJoystick(PipeJoystick):
+    # Each open gets a new pipe, fed by the running JoystickFeeder
+    feeder = None
+
+    def __init__(self, vid, pid):
+        self.fd, write_fd = os.pipe()
+        SoakJoystick.feeder.attach(write_fd)
+
+class JoystickFeeder(threading.Thread):
+    def __init__(self, reports, rate):
+        threading.Thread.__init__(self, name='JoystickFeeder', daemon=True)
+        self.reports = reports
+        self.period = 1.0 / rate
+        self.stats = { 'reports' : 0, 'dropped' : 0 }
+        self._fds = []
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+
+    def attach(self, fd):
+        os.set_blocking(fd, False)
+        with self._lock:
+            self._fds.append(fd)
+
+    def fail(self):
+        # The reading side sees the end of the pipe, as for an unplugged joystick
+        with self._lock:
+            fds, self._fds = self._fds, []
+        for fd in fds:
+            os.close(fd)
+
+    def shutdown(self):
+        self._shutdown.set()
+        self.join()
+        self.fail()
+
+    def run(self):
+        tick = 0
+        start = time.monotonic()
+        while not self._shutdown.is_set():
+            report = self.reports[tick % len(self.reports)]
+            with self._lock:
+                for fd in list(self._fds):
+                    try:
+                        os.write(fd, report)
+                        self.stats['reports'] += 1
+                    except BlockingIOError:
+                        self.stats['dropped'] += 1
+                    except OSError:
+                        # The controller closed the device
+                        self._fds.remove(fd)
+                        os.close(fd)
+            tick += 1
+            self._shutdown.wait(max(0.0, start + tick * self.period - time.monotonic()))
+
+def load_reports(path):
+    # Joystick reports from a session recorded with RECORD_DIR set
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [ record[5] for record in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size])
+             if record[2] == KIND_REPORT ]
+
+def _read_proc_status():
+    status = {}
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()
+    return status
+
+def _resources():
+    status = _read_proc_status()
+    collections = gc.get_stats()
+    return {
+        'rss' : int(status['VmRSS'][0]) / 1024.0,
+        'fds' : len(os.listdir('/proc/self/fd')) - 1,
+        'threads' : int(status['Threads'][0]),
+        'objects' : len(gc.get_objects()),
+        'collections' : sum(generation['collections'] for generation in collections),
+        'uncollectable' : sum(generation['uncollectable'] for generation in collections),
+    }
+
+def _counter(name):
+    # Sums a counter over its labels from the metrics endpoint's text
+    total = 0
+    for line in metrics.render().splitlines():
+        if line.startswith(name):
+            total += int(line.rsplit(' ', 1)[1])
+    return total
+
+SOAK_COLUMNS = ( 'rss', 'fds', 'threads', 'objects' )
+
+def bench_soak(args):
+    reports = load_reports(args.replay) if args.replay else generate_reports(args.seed, 10000)
+    if not reports:
+        sys.exit('no joystick reports in %s' % args.replay)
+
+    settings = _runtime_settings()
+    settings.update({ 'CAM_PROTOCOL' : 'vapix', 'CAM_USER' : 'root', 'CAM_PW' : 'pass',
+                      'CAM_TRANSPORT' : 'socket', 'CAM_KEEPALIVE' : 2.0 })
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    async def soak(simulator):
+        loop = asyncio.get_running_loop()
+        session = CameraSession(simulator.address, settings, EventBus(), None, device=SoakJoystick)
+        task = asyncio.ensure_future(session.run())
+
+        samples = []
+        faults = 0
+        start = time.monotonic()
+        next_fault = start + args.fault_interval
+        print('%8s %9s %5s %7s %9s %11s %8s %10s %7s' % ('time', 'rss MB', 'fds', 'threads', 'objects',
+              'gc runs', 'faults', 'reports', 'reconn'))
+        while time.monotonic() - start < args.duration and not task.done():
+            await asyncio.sleep(args.interval)
+
+            if args.fault_interval > 0 and time.monotonic() >= next_fault:
+                # Alternately unplug the joystick and take the camera away
+                if faults % 2 == 0:
+                    SoakJoystick.feeder.fail()
+                else:
+                    simulator = await loop.run_in_executor(None, _restart_simulator, simulator, args)
+                faults += 1
+                next_fault += args.fault_interval
+
+            elapsed = time.monotonic() - start
+            sample = _resources()
+            print('%8.0f %9.1f %5d %7d %9d %11d %8d %10d %7d' % (elapsed, sample['rss'], sample['fds'],
+                  sample['threads'], sample['objects'], sample['collections'], faults,
+                  _counter('ptz_hid_reports_total'), _counter('ptz_reconnects_total')))
+            if elapsed >= args.warmup:
+                samples.append(sample)
+
+        session.shutdown()
+        await task
+        return samples, simulator
+
+    SoakJoystick.feeder = JoystickFeeder(reports, args.rate)
+    SoakJoystick.feeder.start()
+    simulator = SimulatorProcess(latency=args.latency).__enter__()
+    try:
+        with _in_tmpdir():
+            samples, simulator = asyncio.run(soak(simulator))
+    finally:
+        SoakJoystick.feeder.shutdown()
+        simulator.__exit__(None, None, None)
+
+    if len(samples) < 2:
+        sys.exit('soak too short to measure growth, run past --warmup')
+
+    # Growth from the median of the first samples to the median of the last,
+    # so a collection or allocation burst at either end is not counted
+    window = min(3, len(samples) // 2)
+    budgets = { 'rss' : args.rss_budget, 'fds' : args.fd_budget, 'threads' : args.thread_budget,
+                'objects' : args.object_budget }
+    failed = False
+    print('growth over %.0f s after warm-up:' % (args.interval * (len(samples) - 1)))
+    for name in SOAK_COLUMNS:
+        growth = statistics.median(s[name] for s in samples[-window:]) - \
+                 statistics.median(s[name] for s in samples[:window])
+        over = growth > budgets[name]
+        failed = failed or over
+        print('  %-13s %+10.1f (budget %g)%s' % (name, growth, budgets[name], '  OVER BUDGET' if over else ''))
+
+    uncollectable = samples[-1]['uncollectable']
+    print('  %-13s %10d' % ('uncollectable', uncollectable))
+    if failed or uncollectable:
+        sys.exit(1)
+
+def _restart_simulator(simulator, args):
+    # The new simulator listens on the same port once the outage is over
+    port = int(simulator.address.rsplit(':', 1)[1])
+    simulator.__exit__(None, None, None)
+    time.sleep(args.outage)
+    return SimulatorProcess(latency=args.latency, port=port).__enter__()
+
+
+################################################################################
+# Recovery from stalls
+################################################################################
+# Faults are injected into a running session with a short watchdog timeout: a
+# camera reply that dribbles in too slowly for any read to time out, a HID read
+# that never returns, and a callback that blocks the event loop. The time until
+# the stall is detected and until the session works again is measured. Last, a
+# loop that cannot be interrupted must end the process within the grace time.
+################################################################################
+class StallingJoystick(object):
+    # Read on a worker thread, as it has no fileno(). stall() makes the newest
+    # device's reads hang until released.
+    latest = None
+    released = threading.Event()
+
+    def __init__(self, vid, pid):
+        self._pipe = SoakJoystick(vid, pid)
+        self._hang = False
+        StallingJoystick.latest = self
+
+    def stall(self):
+        self._hang = True
+
+    def read(self, size, timeout=None):
+        if self._hang:
+            StallingJoystick.released.wait()
+        return self._pipe.read(size, timeout)
+
+    def close(self):
+        self._pipe.close()
+
+def _moves_since(simulator, start):
+    return [ entry for entry in list(simulator.log)
+             if entry[0] > start and 'continuouspantiltmove' in entry[2] ]
+
+def _measure_recovery(inject, recovered, bound):
+    # Returns the times (s) from the fault until the watchdog saw the stall
+    # and until recovered(detection time) is true, None if it never was
+    stalls = watchdog.stats['stalls']
+    start = time.monotonic()
+    inject()
+    detected = None
+    while time.monotonic() - start < bound + 5.0:
+        time.sleep(0.01)
+        if detected is None:
+            if watchdog.stats['stalls'] > stalls:
+                detected = time.monotonic()
+                state = _counter('ptz_events_total')
+        elif recovered(detected, state):
+            return detected - start, time.monotonic() - start
+    return (None if detected is None else detected - start), None
+
+def _escalation_child(conn, timeout, grace):
+    # The stack dump goes to stderr, which is not wanted in the report
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 2)
+    logging.getLogger().setLevel(logging.CRITICAL)
+    watchdog.install_signal_handler()
+    watchdog.start(timeout, grace)
+
+    async def run():
+        asyncio.ensure_future(watchdog.watch_loop())
+        await asyncio.sleep(0.5)
+        # The watchdog's interrupt cannot get through
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGUSR2])
+        conn.send(time.monotonic())
+        time.sleep(3600)
+    asyncio.run(run())
+
+def bench_watchdog(args):
+    timeout, grace = args.watchdog_timeout, args.watchdog_grace
+    settings = _runtime_settings()
+    # A short fixed request timeout keeps the dispatcher's own stall time, as
+    # long as its slowest request may take, within a few seconds
+    settings.update({ 'CAM_PROTOCOL' : 'vapix', 'CAM_USER' : 'root', 'CAM_PW' : 'pass',
+                      'CAM_TRANSPORT' : 'socket', 'CAM_KEEPALIVE' : 2.0, 'CAM_REQUEST_TIMEOUT' : 0.25 })
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    results = []
+    def measure(loop, simulator):
+        camera = CameraControl(simulator.address, 'root', 'pass', settings['CAM_KEEPALIVE'],
+                               settings['CAM_TRANSPORT'], settings['CAM_REQUEST_TIMEOUT'])
+        request_timeout = max(timeout, camera.longest_request())
+        camera.close()
+        time.sleep(2.0)
+        faults = [
+            # A byte every 20 ms gets through the shortest read timeout
+            ('camera request', request_timeout, lambda: setattr(simulator, 'trickle', 0.02),
+             lambda detected, events: _moves_since(simulator, detected)),
+            ('HID read', timeout, lambda: StallingJoystick.latest.stall(),
+             lambda detected, events: _counter('ptz_events_total') > events),
+            ('event loop', timeout, lambda: loop.call_soon_threadsafe(time.sleep, 3600),
+             lambda detected, events: _counter('ptz_events_total') > events),
+        ]
+        for name, stall_timeout, inject, recovered in faults:
+            bound = stall_timeout + grace
+            results.append((name,) + _measure_recovery(inject, recovered, bound) + (bound,))
+            time.sleep(2.0)
+        # The loop's executor waits for the stalled reader on exit
+        StallingJoystick.released.set()
+
+    async def run(simulator):
+        loop = asyncio.get_running_loop()
+        session = CameraSession(simulator.address, settings, EventBus(), None, device=StallingJoystick)
+        task = asyncio.ensure_future(session.run())
+        heartbeat = asyncio.ensure_future(watchdog.watch_loop())
+        await loop.run_in_executor(None, measure, loop, simulator)
+        session.shutdown()
+        await task
+        heartbeat.cancel()
+
+    SoakJoystick.feeder = JoystickFeeder(generate_reports(args.seed, 10000), 1.0 / REPORT_PERIOD)
+    SoakJoystick.feeder.start()
+    watchdog.install_signal_handler()
+    watchdog.start(timeout, grace)
+    try:
+        with _in_tmpdir(), VapixSimulator(latency=args.latency) as simulator:
+            asyncio.run(run(simulator))
+    finally:
+        watchdog.stop()
+        SoakJoystick.feeder.shutdown()
+
+    # The watchdog gives up on the loop after the timeout and grace, checking
+    # every HEARTBEAT_INTERVAL at most
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    child = context.Process(target=_escalation_child, args=(child_conn, timeout, grace), daemon=True)
+    child.start()
+    blocked = conn.recv()
+    child.join(timeout + grace + 10.0)
+    exited = time.monotonic() - blocked if child.exitcode == EXIT_STATUS else None
+    if child.is_alive():
+        child.kill()
+
+    failed = False
+    print('watchdog timeout %.1f s, grace %.1f s' % (timeout, grace))
+    print('%-24s %10s %12s' % ('stall', 'detected', 'recovered'))
+    rows = list(results)
+    rows.append(('uninterruptible (exit)', None, exited, timeout + grace + HEARTBEAT_INTERVAL))
+    for name, detected, recovered, bound in rows:
+        over = recovered is None or recovered > bound
+        failed = failed or over
+        print('%-24s %10s %12s%s' % (name, '%.2f s' % detected if detected is not None else '-',
+                                    '%.2f s' % recovered if recovered is not None else 'never',
+                                    '  OVER BOUND' if over else ''))
+    if failed:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    'first-command' : bench_first_command,
+    'transport' : bench_transport,
+    'backends' : bench_backends,
+    'group' : bench_group,
+    'hid' : bench_hid,
+    'hid-read' : bench_hid_read,
+    'logging' : bench_logging,
+    'loss' : bench_loss,
+    'overshoot' : bench_overshoot,
+    'cpu' : bench_cpu,
+    'runtime' : bench_runtime,
+    'soak' : bench_soak,
+    'watchdog' : bench_watchdog,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PTZ camera control path')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--count', type=int, default=50, help='samples per measurement')
+    parser.add_argument('--rounds', type=int, default=3, help='number of repeated rounds')
+    parser.add_argument('--latency', type=float, default=0.002, help='simulated camera latency (s)')
+    parser.add_argument('--size', type=int, default=8, help='largest camera group size')
+    parser.add_argument('--idle', type=float, default=1.0, help='simulated keep-alive timeout (s)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for generated inputs')
+    parser.add_argument('--baseline', help='JSON file to compare results with, created if missing')
+    parser.add_argument('--save', action='store_true', help='overwrite the baseline with these results')
+    parser.add_argument('--threshold', type=float, default=20.0, help='slowdown (%%) reported as a regression')
+    parser.add_argument('--duration', type=float, default=3600.0, help='soak duration (s)')
+    parser.add_argument('--rate', type=float, default=1000.0, help='soak joystick reports per second')
+    parser.add_argument('--replay', help='soak with the joystick reports of a recorded session')
+    parser.add_argument('--interval', type=float, default=10.0, help='soak resource sample interval (s)')
+    parser.add_argument('--warmup', type=float, default=60.0, help='soak time before growth is measured (s)')
+    parser.add_argument('--fault-interval', type=float, default=30.0,
+                        help='time between injected HID / camera failures (s), 0 for none')
+    parser.add_argument('--outage', type=float, default=2.0, help='time the camera is away for a fault (s)')
+    parser.add_argument('--rss-budget', type=float, default=16.0, help='allowed RSS growth (MB)')
+    parser.add_argument('--fd-budget', type=int, default=4, help='allowed open file descriptor growth')
+    parser.add_argument('--thread-budget', type=int, default=2, help='allowed thread count growth')
+    parser.add_argument('--object-budget', type=int, default=20000, help='allowed live object growth')
+    parser.add_argument('--watchdog-timeout', type=float, default=1.0, help='stall detection time (s)')
+    parser.add_argument('--watchdog-grace', type=float, default=5.0, help='stall recovery time (s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    BENCHMARKS[args.benchmark](args)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
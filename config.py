@@ -8,13 +8,127 @@
 # program.
 ################################################################################
 
+# Settings below can be overridden in this JSON file, which is watched and
+# applied to the running program when it changes, e.g.
+#   { "BUTTON_HOLD_TIME" : 1.5, "JOYSTICK_DEADZONE" : [0.1, 0.1, 0.2] }
+# Settings that only take effect on restart are logged as such.
+CONFIG_FILE = 'messiah-ptz-controller.json'
+
 CAM_MAC=b'ACCC8EC13A41'
 CAM_USER='root'
 CAM_PW='Messiah'
 
+# Camera control protocol, 'vapix' (HTTP), 'visca' (VISCA over IP, UDP) or
+# 'null' (no camera, commands are discarded)
+CAM_PROTOCOL = 'vapix'
+
+# Idle time (s) after which a cheap request keeps the camera connection and
+# digest nonce warm, or None to disable
+CAM_KEEPALIVE = 4.0
+
+# Addresses of further cameras driven together with the discovered camera as
+# one group. Stops, presets and moves go to every camera concurrently.
+CAM_GROUP = []
+
+# File caching the commands and limits of each camera model / firmware, so
+# they are only requested from a camera the first time it is seen
+CAM_CAPABILITY_CACHE = 'camera-capabilities.json'
+
+# HTTP transport used for VAPIX requests, 'requests' or the leaner 'socket'
+CAM_TRANSPORT = 'requests'
+
+# Timeout (s) for every VAPIX request, or None to adapt each kind of request's
+# timeout to the measured round trip time
+CAM_REQUEST_TIMEOUT = None
+
+# Log level for the service log (DEBUG logs every camera command)
+LOG_LEVEL = 'INFO'
+
+# Where and how often (s) profiling reports are written. Profiling is enabled
+# with the PTZ_PROFILE environment variable or toggled with SIGUSR1.
+PROFILE_DIR = 'profiles'
+PROFILE_INTERVAL = 60.0
+
+# Directory to record joystick reports and camera commands to for analysis
+# with analyse-session.py, or None to disable
+RECORD_DIR = None
+
+# Localhost port serving Prometheus metrics at /metrics, or None to disable
+METRICS_PORT = 9102
+
+# Unix socket streaming controller events as JSON lines to monitoring tools
+# such as "hid-test.py --socket", or None to disable. Only the controller's
+# user can connect, so put it in a directory of that user's, e.g.
+# '/run/messiah-ptz-controller/events.sock'.
+EVENT_SOCKET = None
+
+# UDP port accepting joystick reports from a remote operator position (see
+# hid-remote.py), or None to disable. A remote sender that goes quiet for
+# REMOTE_INPUT_TIMEOUT seconds is treated as a centred stick.
+REMOTE_INPUT_PORT = None
+REMOTE_INPUT_TIMEOUT = 0.5
+
+# Address the remote input listens on. Anything but localhost needs a shared
+# REMOTE_INPUT_SECRET, which hid-remote.py must be given too, as anyone who
+# can reach the port can drive the camera. Signed packets are only accepted
+# within 2 s of the time they were sent, so both hosts' clocks must be set,
+# e.g. by NTP.
+REMOTE_INPUT_HOST = '127.0.0.1'
+REMOTE_INPUT_SECRET = None
+
 HID_VID = 0x07C0
 HID_PID = 0x1131
 BUTTON_HOLD_TIME = 2.0
 
-__all__ = ['CAM_MAC', 'CAM_USER', 'CAM_PW', 'HID_VID', 'HID_PID', 'BUTTON_HOLD_TIME']
+# Joystick deadzone (fraction of full scale) for pan, tilt and zoom
+JOYSTICK_DEADZONE = (0.1, 0.1, 0.15)
+
+# Read the joystick in its own process (Linux only), so input timing does not
+# depend on the load from camera networking in the controller process
+HID_PROCESS = False
+
+# Rate (Hz) at which continuous move / focus commands are sent to the camera,
+# the low-pass time constant (s), and limits in full-scale units per s / s^2
+MOTION_TICK_RATE = 20.0
+MOTION_SMOOTHING = 0.05
+MOTION_MAX_ACCEL = 4.0
+MOTION_MAX_JERK = 40.0
+
+# Change (in camera units of 1%) an axis must exceed before a continuous
+# command is re-sent
+MOTION_HYSTERESIS = 1
+
+# Time (s) stop and preset commands are retried until the camera acknowledges
+COMMAND_RETRY_DEADLINE = 1.0
+
+# Multiple of the measured motion command latency by which the stick's return
+# to centre is anticipated, so the camera slows and stops on time. 0 disables.
+MOTION_LEAD = 1.0
+
+# Time (s) without a heartbeat from the event loop, a camera's command
+# dispatcher or the HID reader before it is reported stalled and restarted,
+# and the further time (s) it has to recover before the process exits to be
+# restarted by supervisor. A command dispatcher is given longer if its
+# camera's requests can take longer, as worked out from their timeouts and
+# retries. None disables the watchdog.
+WATCHDOG_TIMEOUT = 8.0
+WATCHDOG_GRACE = 10.0
+
+# Settings that may be set to null in CONFIG_FILE
+OPTIONAL_SETTINGS = ('CAM_KEEPALIVE', 'CAM_REQUEST_TIMEOUT', 'RECORD_DIR', 'METRICS_PORT', 'EVENT_SOCKET', 'REMOTE_INPUT_PORT',
+                     'REMOTE_INPUT_SECRET', 'WATCHDOG_TIMEOUT')
+
+# Rates, periods and timeouts, which must be greater than zero
+POSITIVE_SETTINGS = ('CAM_KEEPALIVE', 'CAM_REQUEST_TIMEOUT', 'PROFILE_INTERVAL', 'REMOTE_INPUT_TIMEOUT',
+                     'MOTION_TICK_RATE', 'WATCHDOG_TIMEOUT', 'WATCHDOG_GRACE')
 
+__all__ = ['CONFIG_FILE', 'OPTIONAL_SETTINGS', 'POSITIVE_SETTINGS',
+           'CAM_MAC', 'CAM_USER', 'CAM_PW', 'CAM_PROTOCOL', 'CAM_KEEPALIVE', 'CAM_GROUP',
+           'CAM_CAPABILITY_CACHE', 'CAM_TRANSPORT', 'CAM_REQUEST_TIMEOUT',
+           'LOG_LEVEL', 'PROFILE_DIR', 'PROFILE_INTERVAL', 'RECORD_DIR', 'METRICS_PORT',
+           'EVENT_SOCKET', 'REMOTE_INPUT_PORT', 'REMOTE_INPUT_TIMEOUT', 'REMOTE_INPUT_HOST',
+           'REMOTE_INPUT_SECRET',
+           'HID_VID', 'HID_PID', 'BUTTON_HOLD_TIME', 'JOYSTICK_DEADZONE', 'HID_PROCESS',
+           'MOTION_TICK_RATE', 'MOTION_SMOOTHING', 'MOTION_MAX_ACCEL', 'MOTION_MAX_JERK',
+           'MOTION_HYSTERESIS', 'COMMAND_RETRY_DEADLINE', 'MOTION_LEAD',
+           'WATCHDOG_TIMEOUT', 'WATCHDOG_GRACE']
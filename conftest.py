@@ -0,0 +1,8 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# conftest.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Lets the tests under tests/ import lib and config from the repository root.
+################################################################################
@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# hid-remote.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This program forwards the reports of a locally attached AXIS T8311 joystick
+# to a messiah-ptz-controller.py running elsewhere on the network, which must
+# have REMOTE_INPUT_PORT set, with REMOTE_INPUT_HOST and REMOTE_INPUT_SECRET
+# to accept reports from another machine. Reports are resent periodically
+# while nothing changes so the controller doesn't time the remote input out.
+################################################################################
+
+import argparse
+
+from lib.PtzController import HIDDevice
+from lib.NetworkInput import NetworkInputSender
+from config import *
+
+parser = argparse.ArgumentParser(description='Forward AXIS T8311 joystick reports over UDP')
+parser.add_argument('host', help='host running messiah-ptz-controller.py')
+parser.add_argument('--port', type=int, default=REMOTE_INPUT_PORT or 52400)
+parser.add_argument('--interval', type=float, default=REMOTE_INPUT_TIMEOUT / 4,
+                    help='resend interval (s) while the report is unchanged')
+parser.add_argument('--secret', default=REMOTE_INPUT_SECRET,
+                    help='shared secret, as REMOTE_INPUT_SECRET on the controller')
+args = parser.parse_args()
+
+device = HIDDevice(HID_VID, HID_PID)
+sender = NetworkInputSender(args.host, args.port, args.secret)
+
+report = None
+while True:
+    data = device.read(4, int(args.interval * 1000))
+    if data:
+        report = data
+    if report is not None:
+        sender.send(report)
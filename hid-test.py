@@ -6,12 +6,31 @@
 #
 # This program can be used to test connectivity to the AXIS T8311 joystick. It
 # will print out joystick events as input is provided to the joystick to verify
-# functionality.
+# functionality. With --socket it instead attaches to the event socket of a
+# running messiah-ptz-controller.py and prints the events it is handling.
 ################################################################################
 
+import sys
+import socket
+import argparse
+
 from lib.PtzController import *
 from config import *
 
+parser = argparse.ArgumentParser(description='Print AXIS T8311 joystick events')
+parser.add_argument('--socket', nargs='?', const=EVENT_SOCKET or '', default=None,
+                    help='watch a running controller through its event socket (default EVENT_SOCKET)')
+args = parser.parse_args()
+if args.socket == '':
+    parser.error('EVENT_SOCKET is not set, give the path of the event socket')
+
+if args.socket is not None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(args.socket)
+    for line in sock.makefile('r'):
+        print(line, end='')
+    sys.exit(0)
+
 controller = PtzController(HID_VID, HID_PID, BUTTON_HOLD_TIME)
 
 while True:
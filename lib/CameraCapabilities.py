@@ -0,0 +1,150 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# CameraCapabilities.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the CameraCapabilities class. Backends describe the
+# commands a camera supports, the value ranges it accepts and its presets
+# when PtzCamera connects, so commands can be validated and clamped locally
+# instead of finding out from an error reply. The command list and ranges only
+# depend on the camera model and firmware, so CapabilityCache keeps them in a
+# JSON file and they are only queried from a camera the first time it is seen.
+################################################################################
+
+import os
+import re
+import json
+import logging
+import threading
+
+__all__ = [ 'CameraCapabilities', 'CapabilityCache', 'parse_ptz_info' ]
+
+_INFO_LINE = re.compile(r'^\{?(\w+)=(.*?)\}?$')
+_INFO_RANGE = re.compile(r'\[\s*(-?[\d.]+)\s*\.\.\.\s*(-?[\d.]+)\s*\]')
+
+def parse_ptz_info(text: str):
+    """
+    Parses the reply to a VAPIX ptz.cgi?info=1 request, which lists one
+    command per line such as "continuouszoommove=[-100 ... 100]". Returns the
+    set of command names and a dict of command name to a list of (min, max)
+    ranges, one per argument.
+    """
+    commands = set()
+    limits = {}
+    for line in text.splitlines():
+        match = _INFO_LINE.match(line.strip())
+        if match is None:
+            continue
+        name, description = match.groups()
+        commands.add(name)
+        ranges = [ (float(low), float(high)) for low, high in _INFO_RANGE.findall(description) ]
+        if ranges:
+            limits[name] = ranges
+    return commands, limits
+
+class CameraCapabilities(object):
+    def __init__(self, model: str = '', firmware: str = '', commands: set = None,
+                 limits: dict = None, presets: list = None, speed: int = None):
+        # commands and presets are None when the camera cannot report them,
+        # in which case everything is assumed to be supported
+        self.model = model
+        self.firmware = firmware
+        self.commands = commands
+        self.limits = limits or {}
+        self.presets = presets
+        self.speed = speed
+
+        self._reported = set()
+
+    @property
+    def key(self):
+        return '%s/%s' % (self.model, self.firmware)
+
+    def supports(self, command: str):
+        if self.commands is None or command in self.commands:
+            return True
+        if command not in self._reported:
+            logging.warning('CameraCapabilities: %s does not support "%s"', self.model, command)
+            self._reported.add(command)
+        return False
+
+    def has_preset(self, name: str):
+        return self.presets is None or name in self.presets
+
+    def add_preset(self, name: str):
+        if self.presets is not None and name not in self.presets:
+            self.presets.append(name)
+
+    def clamp(self, command: str, value, index: int = 0):
+        if value is None:
+            return None
+        ranges = self.limits.get(command)
+        if ranges is None or index >= len(ranges):
+            return value
+        low, high = ranges[index]
+        return type(value)(max(low, min(value, high)))
+
+    def to_dict(self):
+        return { 'commands' : sorted(self.commands) if self.commands is not None else None,
+                 'limits' : self.limits }
+
+    @staticmethod
+    def combine(capabilities: list):
+        # Capabilities of a camera group: the commands and ranges every member
+        # supports, and the presets any member has, as a group preset is
+        # recalled on the cameras that have it
+        capabilities = [ c for c in capabilities if c is not None ]
+        if not capabilities:
+            return None
+
+        result = CameraCapabilities(model='+'.join(sorted(set(c.model for c in capabilities))),
+                                    firmware='+'.join(sorted(set(c.firmware for c in capabilities))))
+        if all(c.presets is not None for c in capabilities):
+            result.presets = []
+            for c in capabilities:
+                result.presets.extend(p for p in c.presets if p not in result.presets)
+        for c in capabilities:
+            if c.commands is not None:
+                result.commands = set(c.commands) if result.commands is None else result.commands & c.commands
+            for command, ranges in c.limits.items():
+                current = result.limits.get(command, ranges)
+                result.limits[command] = [ (max(a[0], b[0]), min(a[1], b[1]))
+                                           for a, b in zip(current, ranges) ]
+        return result
+
+class CapabilityCache(object):
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning('CapabilityCache: ignoring "%s": %s', path, repr(e))
+
+    def get(self, key: str):
+        # Returns (commands, limits) for a model/firmware, or None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        commands = set(entry['commands']) if entry['commands'] is not None else None
+        limits = { name : [ tuple(r) for r in ranges ] for name, ranges in entry['limits'].items() }
+        return commands, limits
+
+    def put(self, capabilities: CameraCapabilities):
+        # Cameras in a group may be discovered concurrently
+        with self._lock:
+            self._entries[capabilities.key] = capabilities.to_dict()
+            if self.path is None:
+                return
+
+            try:
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(self._entries, f, sort_keys=True, indent=4)
+                os.replace(self.path + '.tmp', self.path)
+            except OSError as e:
+                logging.warning('CapabilityCache: unable to write "%s": %s', self.path, repr(e))
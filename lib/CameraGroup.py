@@ -0,0 +1,176 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# CameraGroup.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the CameraGroup class. A CameraGroup is a CameraBackend
+# made of several member backends, so one joystick can stop or recall presets
+# on a set of cameras at once. Each command is sent to every member
+# concurrently on a thread pool with one worker per camera, so a group command
+# takes about as long as the slowest member rather than the sum of all of them.
+################################################################################
+
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .backend import CameraError, CameraBackend
+from .CameraCapabilities import CameraCapabilities
+
+__all__ = [ 'CameraGroupError', 'GroupResult', 'CameraGroup' ]
+
+
+class CameraGroupError(CameraError):
+    def __init__(self, method: str, errors: dict):
+        CameraError.__init__(self, '%s failed on every camera: %s' % (method, errors))
+        self.errors = errors
+
+
+class GroupResult(dict):
+    """
+    Per camera results of a group command, keyed by camera name. Cameras that
+    raised are left out and their exceptions are kept in errors. status_code
+    is 200 only if every camera acknowledged, so the CommandDispatcher retries
+    stops and presets until all of the group has them. Cameras the command
+    was not sent to, e.g. for a preset they do not have, are in skipped with
+    the reason and do not count against status_code.
+    """
+
+    def __init__(self, results: dict, errors: dict, skipped: dict = None):
+        dict.__init__(self, results)
+        self.errors = errors
+        self.skipped = skipped or {}
+
+    @property
+    def status_code(self):
+        if self.errors:
+            return 503
+        for result in self.values():
+            status_code = getattr(result, 'status_code', None)
+            if status_code not in [None, 200, 204]:
+                return status_code
+        return 200
+
+
+class CameraGroup(CameraBackend):
+    def __init__(self, members: dict):
+        if not members:
+            raise ValueError('a camera group needs at least one camera')
+        self.members = dict(members)
+        # Capabilities of each member, once get_capabilities has been called
+        self.capabilities = {}
+        self._executor = ThreadPoolExecutor(max_workers=len(self.members),
+                                            thread_name_prefix='CameraGroup')
+
+    @classmethod
+    def open(cls, names: list, open_camera):
+        """
+        Opens a group by calling open_camera(name) for every name
+        concurrently. If any camera cannot be opened the others are closed
+        again and the first error is raised.
+        """
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            futures = { name : executor.submit(open_camera, name) for name in names }
+
+        members = {}
+        error = None
+        for name, future in futures.items():
+            try:
+                members[name] = future.result()
+            except Exception as e:
+                logging.error('CameraGroup: failed to open camera "%s": %s', name, repr(e))
+                error = error or e
+        if error is not None:
+            for camera in members.values():
+                camera.close()
+            raise error
+        return cls(members)
+
+    def _fan_out(self, method: str, *args, skip: dict = None):
+        # skip maps members the command is not sent to to the reason
+        skip = skip or {}
+        if len(skip) == len(self.members):
+            raise CameraGroupError(method, skip)
+        futures = { name : self._executor.submit(getattr(camera, method), *args)
+                    for name, camera in self.members.items() if name not in skip }
+
+        results = {}
+        errors = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+
+        if errors:
+            if not results:
+                raise CameraGroupError(method, errors)
+            logging.warning('CameraGroup: %s failed on %s', method,
+                            ', '.join('"%s" (%s)' % (name, repr(e)) for name, e in errors.items()))
+        if skip:
+            logging.warning('CameraGroup: %s skipped on %s', method,
+                            ', '.join('"%s" (%s)' % (name, reason) for name, reason in skip.items()))
+        return GroupResult(results, errors, skip)
+
+    def _without_preset(self, name):
+        return { member : 'preset "%s" is not set' % name for member, capabilities in self.capabilities.items()
+                 if not capabilities.has_preset(name) }
+
+    def continuous_move(self, pan: int = None, tilt: int = None, zoom: int = None):
+        return self._fan_out('continuous_move', pan, tilt, zoom)
+
+    def stop_move(self):
+        return self._fan_out('stop_move')
+
+    def continuous_focus(self, focus: int = None):
+        return self._fan_out('continuous_focus', focus)
+
+    def stop_focus(self):
+        return self._fan_out('stop_focus')
+
+    def auto_focus(self, focus: str = None):
+        return self._fan_out('auto_focus', focus)
+
+    def go_home_position(self, speed: int = None):
+        return self._fan_out('go_home_position', speed)
+
+    def go_to_server_preset_name(self, name: str = None, speed: int = None):
+        # Only the cameras that have the preset move to it. A preset none of
+        # them listed may have been set since, so it goes to all of them.
+        skip = self._without_preset(name)
+        if len(skip) == len(self.members):
+            skip = None
+        return self._fan_out('go_to_server_preset_name', name, speed, skip=skip)
+
+    def set_server_preset_name(self, name: str = None):
+        result = self._fan_out('set_server_preset_name', name)
+        for member in result:
+            if member in self.capabilities:
+                self.capabilities[member].add_preset(name)
+        return result
+
+    def set_speed(self, speed: int = None):
+        return self._fan_out('set_speed', speed)
+
+    def get_speed(self):
+        return self._fan_out('get_speed')
+
+    def get_ptz(self):
+        return self._fan_out('get_ptz')
+
+    def get_capabilities(self, cache=None):
+        self.capabilities = dict(self._fan_out('get_capabilities', cache))
+        return CameraCapabilities.combine(list(self.capabilities.values()))
+
+    def longest_request(self):
+        # Members are sent to concurrently, so the slowest one decides
+        longest = [ camera.longest_request() for camera in self.members.values() ]
+        return None if None in longest else max(longest)
+
+    def close(self):
+        try:
+            self._fan_out('close')
+        except CameraGroupError as e:
+            logging.warning('CameraGroup: %s', str(e))
+        self._executor.shutdown()
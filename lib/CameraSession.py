@@ -0,0 +1,321 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# CameraSession.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the CameraSession class, which drives one camera (or
+# camera group) from the joystick on an asyncio event loop. Instead of a thread
+# per camera blocking in read(), the HID device's file descriptors are watched
+# with loop.add_reader, so a single loop thread serves the input of every
+# camera. Opening the camera, the ping health check and button actions that
+# wait for the camera block, so they run on the loop's executor. The camera
+# commands themselves are still sent by PtzCamera's dispatcher and scheduler.
+#
+# run() supervises the session: when the HID device or the camera fails, that
+# half is closed and reopened after a delay until shutdown() is called. The
+# watchdog fails a half that has stalled the same way.
+################################################################################
+
+import asyncio
+import logging
+
+import requests
+from ping3 import ping
+from urllib.parse import urlsplit
+
+from .PtzController import PtzController, Events, HIDException
+from .PtzCamera import PtzCamera
+from .backend import CameraError, CameraAuthError
+from .profiling import profiler
+from .metrics import metrics
+from .Watchdog import watchdog
+
+__all__ = [ 'CameraSession', 'HID_SETTINGS', 'CAMERA_SETTINGS' ]
+
+# Settings that need the HID device or camera connection to be reopened. All
+# others are applied in place.
+HID_SETTINGS = { 'HID_VID', 'HID_PID', 'HID_PROCESS' }
+CAMERA_SETTINGS = { 'CAM_USER', 'CAM_PW', 'CAM_PROTOCOL', 'CAM_KEEPALIVE', 'CAM_TRANSPORT', 'CAM_GROUP',
+                    'CAM_CAPABILITY_CACHE', 'CAM_REQUEST_TIMEOUT' }
+
+# Time (s) before reopening after an error, and after the camera rejected the
+# credentials
+RETRY_INTERVAL = 1.0
+AUTH_RETRY_INTERVAL = 10.0
+
+# Time (s) between checks that the camera is still reachable
+HEALTH_INTERVAL = 1.0
+
+# Time (s) to wait for a button action and the camera to finish on close,
+# after which a stuck camera is left behind
+CLOSE_TIMEOUT = 5.0
+
+# Button events can block until the camera stops moving
+BLOCKING_EVENTS = { Events.BTN_PRESS, Events.BTN_PRESS_WITH_MODIFIER, Events.BTN_HOLD }
+
+
+class CameraSession(object):
+    """
+    Pairs a PtzController with a PtzCamera for the camera at ip. Create it and
+    call its methods on the event loop thread; run() returns after shutdown().
+    device replaces the platform HID device class, as for PtzController.
+    """
+
+    def __init__(self, ip: str, config: dict, event_bus, remote_input, device=None):
+        self.ip = ip
+        self._config = config
+        self._config_changed = set()
+        self._event_bus = event_bus
+        self._remote_input = remote_input
+        self._device = device
+        self._controller = None
+        self._camera = None
+        self._closing = False
+
+        self._events = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._failed = None
+        self._serving = False
+        self._action = None
+
+    def shutdown(self):
+        self._closing = True
+        self._wakeup.set()
+
+    def apply_config(self, config: dict, changed: set):
+        self._config = config
+        self._configure(config)
+
+        # Changes that reopen the device or camera interrupt the session
+        reopen = changed & (HID_SETTINGS | CAMERA_SETTINGS)
+        if reopen:
+            self._config_changed |= reopen
+            self._wakeup.set()
+
+    def _configure(self, config):
+        if self._controller is not None:
+            self._controller.min_hold_time = config['BUTTON_HOLD_TIME']
+            self._controller.deadzone = config['JOYSTICK_DEADZONE']
+        if self._camera is not None:
+            self._camera.configure(tick_rate=config['MOTION_TICK_RATE'],
+                                   smoothing=config['MOTION_SMOOTHING'],
+                                   max_accel=config['MOTION_MAX_ACCEL'],
+                                   max_jerk=config['MOTION_MAX_JERK'],
+                                   hysteresis=config['MOTION_HYSTERESIS'],
+                                   retry_deadline=config['COMMAND_RETRY_DEADLINE'],
+                                   motion_lead=config['MOTION_LEAD'])
+
+    async def _apply_config(self):
+        changed, self._config_changed = self._config_changed, set()
+        if changed & HID_SETTINGS:
+            logging.info('CameraSession: reopening HID device for new settings')
+            self._cleanup_hid()
+        if changed & CAMERA_SETTINGS:
+            logging.info('CameraSession: reconnecting to camera for new settings')
+            await self._cleanup_camera()
+
+    def _cleanup_hid(self):
+        if self._controller is not None:
+            self._controller.close()
+            metrics.inc('ptz_reconnects_total', component='hid')
+        self._controller = None
+
+    async def _cleanup_camera(self):
+        # A button action still running on the executor needs the camera's
+        # dispatcher to finish, and closing joins the camera's threads, which
+        # may be mid request
+        if self._action is not None:
+            await asyncio.wait([self._action], timeout=CLOSE_TIMEOUT)
+            self._action = None
+        if self._camera is not None:
+            camera, self._camera = self._camera, None
+            try:
+                await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, camera.close),
+                                       CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.error('CameraSession: camera did not close in time, leaving it behind')
+            metrics.inc('ptz_reconnects_total', component='camera')
+
+    def _open_controller(self, config):
+        return PtzController(config['HID_VID'], config['HID_PID'], config['BUTTON_HOLD_TIME'],
+                             self._remote_input, config['HID_PROCESS'], config['JOYSTICK_DEADZONE'],
+                             self._device)
+
+    def _open_camera(self, config):
+        return PtzCamera([self.ip] + config['CAM_GROUP'], config['CAM_USER'], config['CAM_PW'],
+                         tick_rate=config['MOTION_TICK_RATE'],
+                         smoothing=config['MOTION_SMOOTHING'],
+                         max_accel=config['MOTION_MAX_ACCEL'],
+                         max_jerk=config['MOTION_MAX_JERK'],
+                         hysteresis=config['MOTION_HYSTERESIS'],
+                         retry_deadline=config['COMMAND_RETRY_DEADLINE'],
+                         motion_lead=config['MOTION_LEAD'],
+                         keepalive=config['CAM_KEEPALIVE'],
+                         transport=config['CAM_TRANSPORT'],
+                         protocol=config['CAM_PROTOCOL'],
+                         capability_cache=config['CAM_CAPABILITY_CACHE'],
+                         request_timeout=config['CAM_REQUEST_TIMEOUT'])
+
+    async def _sleep(self, delay):
+        # Returns early on shutdown or a setting that reopens the session
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while not self._closing:
+            self._wakeup.clear()
+            await self._apply_config()
+            config = self._config
+            delay = None
+
+            try:
+                if self._controller is None:
+                    self._controller = await loop.run_in_executor(None, self._open_controller, config)
+                if self._camera is None:
+                    self._camera = await loop.run_in_executor(None, self._open_camera, config)
+                await self._serve()
+
+            except HIDException as e:
+                logging.error('Failed to open HID device: "%s"', repr(e))
+                self._cleanup_hid()
+                delay = RETRY_INTERVAL
+
+            except CameraAuthError as e:
+                # Retrying straight away will not help until the credentials change
+                logging.error('Camera authentication failed, check CAM_USER / CAM_PW: "%s"', str(e))
+                await self._cleanup_camera()
+                delay = AUTH_RETRY_INTERVAL
+
+            except (requests.RequestException, CameraError) as e:
+                logging.error('Error communicating with Camera on network: "%s"', repr(e))
+                await self._cleanup_camera()
+                delay = RETRY_INTERVAL
+
+            except Exception as e:
+                logging.exception('CameraSession: unhandled exception: "%s"', repr(e))
+                self._cleanup_hid()
+                await self._cleanup_camera()
+                delay = RETRY_INTERVAL
+
+            if delay is not None:
+                await self._sleep(delay)
+
+        logging.info('CameraSession: exiting')
+        self._cleanup_hid()
+        await self._cleanup_camera()
+
+    async def _serve(self):
+        # Runs the open session until an error, shutdown or a setting that
+        # needs something reopened
+        loop = asyncio.get_running_loop()
+        self._failed = loop.create_future()
+        self._serving = True
+
+        # Events for a camera that has since been reopened are dropped
+        while not self._events.empty():
+            self._events.get_nowait()
+        tasks = [ self._failed,
+                  asyncio.ensure_future(self._handle_events()),
+                  asyncio.ensure_future(self._check_health()),
+                  asyncio.ensure_future(self._wakeup.wait()) ]
+
+        fds = self._controller.filenos()
+        try:
+            for fd in fds:
+                loop.add_reader(fd, self._read_reports)
+        except NotImplementedError:
+            fds = []
+        if not fds:
+            # Devices without a file descriptor are read on a worker thread
+            tasks.append(loop.run_in_executor(None, self._read_blocking, loop, self._controller))
+        elif self._controller.poll_interval is not None:
+            tasks.append(asyncio.ensure_future(self._poll()))
+
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for fd in fds:
+                loop.remove_reader(fd)
+            self._serving = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def _update(self, controller, timeout):
+        profiler.sample()
+        with profiler.stage('controller_update'):
+            return controller.update(timeout)
+
+    def _read_reports(self):
+        # add_reader callback, the device has a report (or an error) waiting
+        try:
+            self._queue_events(self._update(self._controller, 0))
+        except Exception as e:
+            if not self._failed.done():
+                self._failed.set_exception(e)
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self._controller.poll_interval)
+            self._read_reports()
+
+    def _read_blocking(self, loop, controller):
+        # Reads run on the event loop otherwise, which has its own heartbeat.
+        # A reader the watchdog gave up on stops once its read returns.
+        heartbeat = watchdog.register('hid %s' % self.ip, lambda: loop.call_soon_threadsafe(self._hid_stalled))
+        try:
+            while self._serving and controller is self._controller:
+                heartbeat.beat()
+                events = self._update(controller, 100)
+                if events:
+                    loop.call_soon_threadsafe(self._queue_events, events)
+        finally:
+            watchdog.unregister(heartbeat)
+
+    def _hid_stalled(self):
+        # Watchdog restart, the HID device is reopened as after an error
+        if self._failed is not None and not self._failed.done():
+            self._failed.set_exception(HIDException('HID device stopped responding'))
+
+    def _queue_events(self, events):
+        for event in events:
+            self._events.put_nowait(event)
+
+    async def _handle_events(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await self._events.get()
+            metrics.inc('ptz_events_total', type=event.type.name)
+            with profiler.stage('handle_event'):
+                if event.type in BLOCKING_EVENTS:
+                    # Shielded, as the action runs on even if the session stops
+                    self._action = loop.run_in_executor(None, self._camera.handle_event, event)
+                    await asyncio.shield(self._action)
+                    self._action = None
+                else:
+                    self._camera.handle_event(event)
+            if self._events.empty():
+                self._camera.poll()
+
+            # Other consumers only see events once the camera has them
+            self._event_bus.publish(event)
+
+    async def _check_health(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            self._camera.poll()
+            if self._config['CAM_PROTOCOL'] == 'null':
+                continue
+            # ip may carry a port, e.g. for the camera simulator
+            host = urlsplit('//' + self.ip).hostname
+            if await loop.run_in_executor(None, ping, host, 1) is None:
+                raise CameraError('Failed to locate Camera on network')
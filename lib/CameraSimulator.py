@@ -0,0 +1,465 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# CameraSimulator.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides local stand-ins for PTZ cameras. VapixSimulator serves
+# the subset of the VAPIX ptz.cgi / ptzconfig.cgi interface used by this
+# project (plus param.cgi model / firmware and preset positions), including
+# HTTP digest authentication and idle keep-alive timeouts, with the qop
+# offered and the framing of reply bodies selectable.
+# Packet loss is simulated as TCP would see it: a request hit by loss stalls
+# until the lost segment is retransmitted. Continuous moves are integrated into
+# the position, so overshoot can be measured in degrees, and absolute moves
+# travel at the head speed rather than arriving at once.
+# ViscaSimulator answers VISCA over IP commands on a UDP socket, and can lose
+# replies or send them late. Together they
+# let the camera code be exercised and benchmarked without real hardware.
+################################################################################
+
+import os
+import re
+import time
+import struct
+import socket
+import random
+import hashlib
+import logging
+import threading
+import collections
+
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__all__ = [ 'VapixSimulator', 'ViscaSimulator' ]
+
+def _md5(text: str):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+_DIGEST_FIELD = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s,]*))')
+
+def _parse_digest(header: str):
+    return { key : value or token for key, value, token in _DIGEST_FIELD.findall(header) }
+
+# Requests kept in a simulator's log, so long runs do not grow without bound
+LOG_LENGTH = 10000
+
+# Pan / tilt (degrees/s) and zoom (steps/s) rates at a continuous move speed
+# of 100, and the range of each axis
+MAX_RATE = (60.0, 60.0, 2000.0)
+LIMITS = ((-180.0, 180.0), (-90.0, 0.0), (1.0, 9999.0))
+
+# Reply to ptz.cgi?info=1, in the format of an AXIS V5914
+PTZ_INFO = '''Available commands:
+{camera=[1 ... 1]}
+pan=[-180.0 ... 180.0]
+tilt=[-90.0 ... 0.0]
+zoom=[1 ... 9999]
+focus=[1 ... 9999]
+autofocus=on|off
+continuouspantiltmove=[-100 ... 100],[-100 ... 100]
+continuouszoommove=[-100 ... 100]
+continuousfocusmove=[-100 ... 100]
+speed=[1 ... 100]
+move=home|up|down|left|right|upleft|upright|downleft|downright|stop
+gotoserverpresetname=string
+gotoserverpresetno=int
+query=speed|position|presetposall
+'''
+
+class VapixRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # Idle keep-alive connections are closed once the socket times out
+        self.timeout = self.server.simulator.idle_timeout
+        BaseHTTPRequestHandler.setup(self)
+        self.server.simulator.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        logging.debug('VapixSimulator: ' + format, *args)
+
+    def flush_headers(self):
+        if getattr(self, '_trickle', None) is None:
+            return BaseHTTPRequestHandler.flush_headers(self)
+        data, self._headers_buffer = b''.join(self._headers_buffer), []
+        for i in range(len(data)):
+            self.wfile.write(data[i:i + 1])
+            time.sleep(self._trickle)
+
+    def _reply(self, status, body=b'', headers={}):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'text/plain')
+        framing = self.server.simulator.framing
+        if framing == 'chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            body = b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body) if body else b'0\r\n\r\n'
+        elif framing == 'close':
+            # The body runs to the end of the connection
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        try:
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting for a stalled reply
+            self.close_connection = True
+
+    def _challenge(self, stale=False):
+        simulator = self.server.simulator
+        simulator.stats['challenges'] += 1
+        nonce = simulator.new_nonce()
+        header = 'Digest realm="%s", nonce="%s", algorithm=MD5' % (simulator.realm, nonce)
+        if simulator.qop:
+            header += ', qop="%s"' % simulator.qop
+        if stale:
+            header += ', stale=TRUE'
+        self._reply(401, b'Unauthorized\n', { 'WWW-Authenticate' : header })
+
+    def _authorized(self):
+        simulator = self.server.simulator
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Digest '):
+            self._challenge()
+            return False
+
+        fields = _parse_digest(header)
+        ha1 = _md5('%s:%s:%s' % (simulator.user, simulator.realm, simulator.password))
+        ha2 = _md5('GET:%s' % fields.get('uri', ''))
+        if fields.get('qop') == 'auth-int':
+            ha2 = _md5('GET:%s:%s' % (fields.get('uri', ''), _md5('')))
+        if simulator.qop:
+            expected = _md5('%s:%s:%s:%s:%s:%s' % (ha1, fields.get('nonce', ''), fields.get('nc', ''),
+                                                   fields.get('cnonce', ''), fields.get('qop', ''), ha2))
+        else:
+            expected = _md5('%s:%s:%s' % (ha1, fields.get('nonce', ''), ha2))
+        if fields.get('username') != simulator.user or fields.get('response') != expected:
+            self._challenge()
+            return False
+
+        if not simulator.nonce_valid(fields.get('nonce', '')):
+            self._challenge(stale=True)
+            return False
+
+        return True
+
+    def do_GET(self):
+        simulator = self.server.simulator
+        simulator.stats['requests'] += 1
+        self._trickle, simulator.trickle = simulator.trickle, None
+
+        if simulator.latency > 0:
+            time.sleep(simulator.latency)
+        if simulator.loss > 0 and random.random() < simulator.loss:
+            simulator.stats['lost'] += 1
+            time.sleep(simulator.loss_delay)
+
+        if not self._authorized():
+            return
+
+        url = urlsplit(self.path)
+        args = { key : values[-1] for key, values in parse_qs(url.query).items() }
+        status, body = simulator.handle(url.path, args)
+        self._reply(status, body.encode('utf-8'))
+
+class VapixSimulator(object):
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, user: str = 'root',
+                 password: str = 'pass', latency: float = 0.0, idle_timeout: float = 5.0,
+                 nonce_lifetime: float = 300.0, loss: float = 0.0, loss_delay: float = 1.0,
+                 qop: str = 'auth', framing: str = 'length'):
+        self.realm = 'AXIS_SIMULATOR'
+        self.user = user
+        self.password = password
+        self.latency = latency
+        # Fraction of requests that stall for loss_delay (s)
+        self.loss = loss
+        self.loss_delay = loss_delay
+        # Seconds per byte for the reply to the next request, which dribbles
+        # in slowly enough that no read times out
+        self.trickle = None
+        self.idle_timeout = idle_timeout
+        self.nonce_lifetime = nonce_lifetime
+        # qop offered in digest challenges, None for none (RFC 2069), and how
+        # reply bodies are delimited: 'length', 'chunked' or 'close'
+        self.qop = qop
+        self.framing = framing
+
+        self.model = 'V5914'
+        self.firmware = '9.80.1'
+        self.speed = 50
+        self.position = [0.0, 0.0, 1.0]
+        self.velocity = [0.0, 0.0, 0.0]
+        # Destination and rate (1-100) of an absolute move under way
+        self.target = None
+        self.target_speed = 100
+        self.presets = {}
+        self.log = collections.deque(maxlen=LOG_LENGTH)
+
+        self.stats = { 'connections' : 0, 'requests' : 0, 'challenges' : 0, 'lost' : 0 }
+        self._moved = time.monotonic()
+        self._nonces = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), VapixRequestHandler)
+        self._server.daemon_threads = True
+        self._server.simulator = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='VapixSimulator',
+                                        daemon=True)
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return '%s:%d' % (host, port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def new_nonce(self):
+        nonce = os.urandom(16).hex()
+        now = time.monotonic()
+        with self._lock:
+            # Expired nonces are dropped as new ones are issued
+            self._nonces = { key : issued for key, issued in self._nonces.items()
+                             if now - issued < self.nonce_lifetime }
+            self._nonces[nonce] = now
+        return nonce
+
+    def nonce_valid(self, nonce: str):
+        with self._lock:
+            issued = self._nonces.get(nonce)
+        return issued is not None and (time.monotonic() - issued) < self.nonce_lifetime
+
+    def get_position(self):
+        # Where the camera is now, including continuous motion
+        with self._lock:
+            self._advance()
+            return tuple(self.position)
+
+    def _advance(self):
+        now = time.monotonic()
+        dt, self._moved = now - self._moved, now
+        for i, ((low, high), rate) in enumerate(zip(LIMITS, MAX_RATE)):
+            self.position[i] = min(high, max(low, self.position[i] + self.velocity[i] / 100.0 * rate * dt))
+        if self.target is not None:
+            for i, rate in enumerate(MAX_RATE):
+                step = self.target_speed / 100.0 * rate * dt
+                distance = self.target[i] - self.position[i]
+                self.position[i] = self.target[i] if abs(distance) <= step else \
+                                   self.position[i] + (step if distance > 0 else -step)
+            if self.position == self.target:
+                self.target = None
+
+    def handle(self, path: str, args: dict):
+        with self._lock:
+            self.log.append((time.monotonic(), path, args))
+            self._advance()
+
+            if path == '/axis-cgi/com/ptz.cgi':
+                return self._handle_ptz(args)
+            elif path == '/axis-cgi/com/ptzconfig.cgi':
+                return self._handle_ptzconfig(args)
+            elif path == '/axis-cgi/param.cgi':
+                return self._handle_param(args)
+
+        return (404, 'Not Found\n')
+
+    def _handle_ptz(self, args):
+        if args.get('query') == 'speed':
+            return (200, 'speed=%d\n' % self.speed)
+        elif args.get('query') == 'position':
+            return (200, 'pan=%.4f\ntilt=%.4f\nzoom=%d\n' % (self.position[0], self.position[1],
+                                                             self.position[2]))
+        elif args.get('info') == '1':
+            return (200, PTZ_INFO)
+        elif args.get('query') == 'presetposall':
+            lines = [ 'presetposno%d=%s' % (i + 1, name) for i, name in enumerate(self.presets) ]
+            return (200, 'Preset Positions for camera 1\n' + '\n'.join(lines) + '\n')
+
+        if any(key in args for key in ('continuouspantiltmove', 'continuouszoommove', 'move',
+                                       'gotoserverpresetname')):
+            self.target = None
+        if 'continuouspantiltmove' in args:
+            self.velocity[0], self.velocity[1] = (float(v) for v in args['continuouspantiltmove'].split(','))
+        if 'continuouszoommove' in args:
+            self.velocity[2] = float(args['continuouszoommove'])
+        if args.get('move') == 'stop':
+            self.velocity = [0.0, 0.0, 0.0]
+        if 'speed' in args:
+            self.speed = int(args['speed'])
+        if 'gotoserverpresetname' in args:
+            if args['gotoserverpresetname'] not in self.presets:
+                return (200, 'Error: preset not found\n')
+            self.velocity = [0.0, 0.0, 0.0]
+            self.position = list(self.presets[args['gotoserverpresetname']])
+        if args.get('move') == 'home':
+            self.velocity = [0.0, 0.0, 0.0]
+            self.position = [0.0, 0.0, 1.0]
+        if 'pan' in args or 'tilt' in args or 'zoom' in args:
+            self.velocity = [0.0, 0.0, 0.0]
+            self.target = [ min(high, max(low, float(args.get(axis, position))))
+                            for axis, position, (low, high) in zip(('pan', 'tilt', 'zoom'), self.position,
+                                                                   LIMITS) ]
+            self.target_speed = int(args.get('speed', self.speed))
+        return (204, '')
+
+    def _handle_param(self, args):
+        params = { 'root.Brand.ProdNbr' : self.model, 'root.Properties.Firmware.Version' : self.firmware }
+        for i, (name, (pan, tilt, zoom)) in enumerate(self.presets.items()):
+            prefix = 'root.PTZ.Preset.P0.Position.P%d.' % (i + 1)
+            params[prefix + 'Name'] = name
+            params[prefix + 'Data'] = 'tilt=%f:focus=%f:pan=%f:iris=%f:zoom=%f' % (tilt, 5000.0, pan, 0.0, zoom)
+        # A group lists every parameter under it
+        groups = args.get('group', '').split(',')
+        return (200, ''.join('%s=%s\n' % (name, value) for name, value in params.items()
+                             if any(name == group or name.startswith(group + '.') for group in groups)))
+
+    def _handle_ptzconfig(self, args):
+        if 'setserverpresetname' in args:
+            self.presets[args['setserverpresetname']] = tuple(self.position)
+        return (204, '')
+
+
+class ViscaSimulator(object):
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.latency = latency
+
+        self.drive = [0, 0, 0]
+        self.position = [0, 0, 0]
+        self.presets = {}
+        self.autofocus = True
+        self.log = collections.deque(maxlen=LOG_LENGTH)
+
+        # Number of requests whose replies are lost, and of requests whose
+        # replies are held back and sent late, ahead of the next request's
+        self.drop_replies = 0
+        self.hold_replies = 0
+        self._held = []
+
+        self.stats = { 'requests' : 0, 'errors' : 0, 'dropped' : 0, 'held' : 0 }
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.1)
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._serve, name='ViscaSimulator', daemon=True)
+
+    @property
+    def address(self):
+        host, port = self._sock.getsockname()[:2]
+        return '%s:%d' % (host, port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._shutdown = True
+        self._thread.join()
+        self._sock.close()
+
+    def _reply(self, peer, payload_type, seq, payload):
+        self._sock.sendto(struct.pack('>HHI', payload_type, len(payload), seq) + payload, peer)
+
+    def _serve(self):
+        while not self._shutdown:
+            try:
+                data, peer = self._sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(data) < 8:
+                continue
+
+            self.stats['requests'] += 1
+            if self.latency > 0:
+                time.sleep(self.latency)
+
+            payload_type, length, seq = struct.unpack_from('>HHI', data)
+            payload = data[8:8 + length]
+            self.log.append((time.monotonic(), payload_type, payload, seq))
+
+            if payload_type == 0x0200:
+                replies = [ (0x0201, b'\x01') ]
+            else:
+                reply = self._handle(payload_type, payload)
+                if reply is None:
+                    self.stats['errors'] += 1
+                    replies = [ (0x0111, b'\x90\x60\x02\xff') ]
+                elif payload_type == 0x0100:
+                    replies = [ (0x0111, b'\x90\x41\xff'), (0x0111, b'\x90\x51\xff') ]
+                else:
+                    replies = [ (0x0111, b'\x90\x50' + reply + b'\xff') ]
+
+            if self.drop_replies > 0:
+                self.drop_replies -= 1
+                self.stats['dropped'] += 1
+                continue
+            if self.hold_replies > 0:
+                self.hold_replies -= 1
+                self.stats['held'] += 1
+                self._held.extend((peer, seq) + reply for reply in replies)
+                continue
+
+            held, self._held = self._held, []
+            for reply_peer, reply_seq, reply_type, reply_payload in held:
+                self._reply(reply_peer, reply_type, reply_seq, reply_payload)
+            for reply_type, reply_payload in replies:
+                self._reply(peer, reply_type, seq, reply_payload)
+
+    def _handle(self, payload_type, payload):
+        command = bytes(payload[1:4])
+
+        if payload_type == 0x0110:
+            if command == b'\x09\x06\x12':
+                pan = struct.pack('>h', self.position[0])
+                tilt = struct.pack('>h', self.position[1])
+                return bytes([pan[0] >> 4, pan[0] & 0xF, pan[1] >> 4, pan[1] & 0xF,
+                              tilt[0] >> 4, tilt[0] & 0xF, tilt[1] >> 4, tilt[1] & 0xF])
+            elif command == b'\x09\x04\x47':
+                zoom = self.position[2]
+                return bytes([(zoom >> 12) & 0xF, (zoom >> 8) & 0xF, (zoom >> 4) & 0xF, zoom & 0xF])
+            return None
+
+        if command == b'\x01\x06\x01':
+            self.drive[0] = { 0x01 : -1, 0x02 : 1 }.get(payload[6], 0) * payload[4]
+            self.drive[1] = { 0x01 : 1, 0x02 : -1 }.get(payload[7], 0) * payload[5]
+        elif command == b'\x01\x04\x07':
+            value = payload[4]
+            self.drive[2] = 0 if value == 0 else (value & 0xF) * (1 if value & 0xF0 == 0x20 else -1)
+        elif command == b'\x01\x04\x08':
+            pass
+        elif command == b'\x01\x04\x38':
+            self.autofocus = payload[4] == 0x02
+        elif command == b'\x01\x06\x04':
+            self.position = [0, 0, 0]
+        elif command == b'\x01\x04\x3f':
+            if payload[4] == 0x01:
+                self.presets[payload[5]] = list(self.position)
+            elif payload[5] in self.presets:
+                self.position = list(self.presets[payload[5]])
+        else:
+            return None
+        return b''
@@ -0,0 +1,59 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# CameraState.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the CameraState class, a mirror of the mode state
+# PtzCamera has put the camera in: autofocus on or off, the default head speed
+# and the last continuous command per motion channel. A state-changing command
+# only needs to go on the wire when the mirrored value differs. A value is
+# unknown until the camera reports it or a command sets it, and becomes
+# unknown again when a command for it fails or is dropped, or the camera
+# reports an error, so the next command is always sent.
+################################################################################
+
+import threading
+
+__all__ = [ 'CameraState' ]
+
+FIELDS = ( 'autofocus', 'speed', 'pantilt', 'zoom', 'focus' )
+
+class CameraState(object):
+    def __init__(self, **known):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(FIELDS)
+        self._values.update(known)
+
+    def get(self, field: str):
+        # None when the camera's value is unknown
+        return self._values[field]
+
+    def differs(self, field: str, value):
+        current = self._values[field]
+        return current is None or current != value
+
+    def update(self, field: str, value, future=None):
+        """
+        Records value as the camera's state. future is the dispatcher's future
+        for the command that sets it; if the command fails or is dropped the
+        value is forgotten again.
+        """
+        with self._lock:
+            self._values[field] = value
+        if future is not None:
+            future.add_done_callback(lambda future: self._command_done(field, value, future))
+
+    def invalidate(self, *fields):
+        # Forgets the given fields, or all of them
+        with self._lock:
+            for field in fields or FIELDS:
+                self._values[field] = None
+
+    def _command_done(self, field, value, future):
+        if not future.cancelled() and future.exception() is None:
+            return
+        with self._lock:
+            # A newer value has been recorded since, leave it to its own command
+            if self._values[field] == value:
+                self._values[field] = None
@@ -0,0 +1,244 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# CommandDispatcher.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the CommandDispatcher class. This class owns the
+# connection to the camera and sends commands from a single worker thread in
+# priority order. Stop commands jump ahead of everything else and are retried
+# until the camera acknowledges them, while continuous motion updates are
+# superseded by newer updates for the same channel. A failed motion update is
+# dropped as the next one replaces it; only a run of failures is an error.
+# The worker beats a heartbeat while idle and between commands, so a request
+# that hangs can be detected, and the dispatcher abandoned.
+################################################################################
+
+import time
+import logging
+import threading
+
+from enum import Enum, unique
+from concurrent.futures import Future, InvalidStateError
+
+from .backend import CameraError
+from .Watchdog import HEARTBEAT_INTERVAL, StallError
+
+__all__ = [ 'CommandClass', 'CommandDispatcher' ]
+
+# Consecutive motion update failures before they are reported by check()
+MOTION_FAILURE_LIMIT = 3
+
+# Weight of each new sample in the moving average of command latency
+LATENCY_SMOOTHING = 0.125
+
+# Command classes, in priority order
+@unique
+class CommandClass(Enum):
+    STOP = 0
+    PRESET = 1
+    CONTROL = 2
+    MOTION = 3
+
+# Command classes still sent after shutdown()
+SHUTDOWN_CLASSES = ( CommandClass.STOP, CommandClass.PRESET )
+
+class Command(object):
+    def __init__(self, cmd_class: CommandClass, key: str, fn, args: tuple):
+        self.cmd_class = cmd_class
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+# Dispatcher class
+class CommandDispatcher(threading.Thread):
+    def __init__(self, retry_deadline: float = 1.0, retry_interval: float = 0.05, heartbeat=None):
+        threading.Thread.__init__(self, name='CommandDispatcher', daemon=True)
+        self.retry_deadline = retry_deadline
+        self.retry_interval = retry_interval
+        self.heartbeat = heartbeat
+
+        self._pending = { cmd_class : [] for cmd_class in CommandClass }
+        self._condition = threading.Condition()
+        self._error = None
+        self._motion_failures = 0
+        self._latency = { cmd_class : None for cmd_class in CommandClass }
+        self._shutdown = False
+        self._current = None
+
+        self.stats = { cmd_class.name : { 'count' : 0, 'errors' : 0, 'retries' : 0, 'superseded' : 0,
+                                          'latency_total' : 0.0, 'latency_max' : 0.0 }
+                       for cmd_class in CommandClass }
+
+    def _supersede(self, cmd_class, keys=None):
+        # Drop pending commands of a class, optionally only for some keys
+        keep = []
+        for command in self._pending[cmd_class]:
+            if keys is None or command.key in keys:
+                command.future.cancel()
+                self.stats[cmd_class.name]['superseded'] += 1
+            else:
+                keep.append(command)
+        self._pending[cmd_class] = keep
+
+    def submit(self, cmd_class: CommandClass, key: str, fn, *args, supersedes: tuple = ()):
+        # supersedes lists further MOTION keys a STOP replaces, e.g. the
+        # channels a single stop command halts
+        command = Command(cmd_class, key, fn, args)
+
+        with self._condition:
+            if cmd_class is CommandClass.MOTION:
+                # Only the newest update per channel is worth sending
+                self._supersede(CommandClass.MOTION, (key,))
+            elif cmd_class is CommandClass.STOP:
+                self._supersede(CommandClass.MOTION, (key,) + tuple(supersedes))
+                self._supersede(CommandClass.STOP, (key,))
+            elif cmd_class is CommandClass.PRESET:
+                self._supersede(CommandClass.MOTION)
+
+            self._pending[cmd_class].append(command)
+            self._condition.notify()
+
+        return command.future
+
+    def expected_latency(self, cmd_class: CommandClass):
+        # Moving average of the time (s) from submitting a command to the
+        # camera's reply, None until one has completed
+        return self._latency[cmd_class]
+
+    def check(self):
+        # Re-raise errors from the worker thread on the caller's thread
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+
+    def abandon(self):
+        # For a worker stuck in a request: fails the command it is running and
+        # cancels the rest, so nobody waits on it. The worker exits if the
+        # request ever returns.
+        self.shutdown()
+        self._cancel_pending()
+        command = self._current
+        if command is not None:
+            try:
+                command.future.set_exception(StallError('command dispatcher abandoned'))
+            except InvalidStateError:
+                pass
+
+    def _beat(self):
+        if self.heartbeat is not None:
+            self.heartbeat.beat()
+
+    def _next_command(self):
+        with self._condition:
+            while True:
+                self._beat()
+                for cmd_class in CommandClass:
+                    # On shutdown stops and presets already asked for still go
+                    # out, so the camera is not left moving; the rest is
+                    # cancelled
+                    if self._shutdown and cmd_class not in SHUTDOWN_CLASSES:
+                        return None
+                    if self._pending[cmd_class]:
+                        return self._pending[cmd_class].pop(0)
+                if self._shutdown:
+                    return None
+                self._condition.wait(HEARTBEAT_INTERVAL)
+
+    def _cancel_pending(self):
+        # Release anyone still waiting on a command
+        with self._condition:
+            for cmd_class in CommandClass:
+                for command in self._pending[cmd_class]:
+                    command.future.cancel()
+                self._pending[cmd_class] = []
+
+    def _acknowledged(self, result):
+        status_code = getattr(result, 'status_code', None)
+        return status_code is None or status_code in [200, 204]
+
+    def _execute(self, command):
+        stats = self.stats[command.cmd_class.name]
+
+        # Stops and presets are retried until acknowledged or out of time
+        retry = command.cmd_class in [CommandClass.STOP, CommandClass.PRESET]
+        deadline = time.monotonic() + self.retry_deadline
+
+        while True:
+            try:
+                result = command.fn(*command.args)
+                if not retry or self._acknowledged(result) or time.monotonic() >= deadline:
+                    break
+                logging.warning('CommandDispatcher: %s "%s" not acknowledged, retrying',
+                                command.cmd_class.name, command.key)
+            except Exception as e:
+                if not retry or time.monotonic() >= deadline:
+                    stats['errors'] += 1
+                    if command.cmd_class is CommandClass.MOTION:
+                        self._motion_failures += 1
+                        if self._motion_failures < MOTION_FAILURE_LIMIT:
+                            logging.debug('CommandDispatcher: dropped failed MOTION "%s": %s',
+                                          command.key, repr(e))
+                            command.future.set_exception(e)
+                            return
+                    self._error = e
+                    command.future.set_exception(e)
+                    return
+                logging.warning('CommandDispatcher: %s "%s" failed, retrying: %s',
+                                command.cmd_class.name, command.key, repr(e))
+            stats['retries'] += 1
+            self._beat()
+            time.sleep(self.retry_interval)
+
+        # Out of time without an acknowledgement: the camera never took it
+        if retry and not self._acknowledged(result):
+            stats['errors'] += 1
+            self._error = CameraError('%s "%s" not acknowledged, status %s' %
+                                      (command.cmd_class.name, command.key, result.status_code))
+            command.future.set_exception(self._error)
+            return
+
+        if command.cmd_class is CommandClass.MOTION:
+            self._motion_failures = 0
+        latency = time.monotonic() - command.submitted
+        average = self._latency[command.cmd_class]
+        self._latency[command.cmd_class] = latency if average is None else \
+            average + LATENCY_SMOOTHING * (latency - average)
+        stats['count'] += 1
+        stats['latency_total'] += latency
+        stats['latency_max'] = max(stats['latency_max'], latency)
+        command.future.set_result(result)
+
+    def run(self):
+        while True:
+            command = self._next_command()
+            if command is None:
+                break
+            if command.future.set_running_or_notify_cancel():
+                self._current = command
+                try:
+                    self._execute(command)
+                except InvalidStateError:
+                    # Abandoned while the command was running
+                    pass
+                self._current = None
+
+        self._cancel_pending()
+        logging.info('CommandDispatcher: exiting')
+
+    def log_stats(self):
+        for name, stats in self.stats.items():
+            if stats['count'] == 0:
+                continue
+            logging.info('CommandDispatcher: %s count=%d errors=%d retries=%d superseded=%d '
+                         'latency_avg=%.1fms latency_max=%.1fms', name, stats['count'],
+                         stats['errors'], stats['retries'], stats['superseded'],
+                         1000.0 * stats['latency_total'] / stats['count'],
+                         1000.0 * stats['latency_max'])
@@ -0,0 +1,186 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# ConfigWatcher.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the ConfigWatcher class. Settings from config.py can be
+# overridden in a JSON data file, which is watched with inotify (or polled
+# where inotify is not available) and validated whenever it changes. Valid
+# changes are handed to a callback with the set of settings that changed, so
+# the running program can apply them without a restart. An invalid file is
+# logged and ignored, leaving the current settings in place.
+################################################################################
+
+import os
+import json
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+
+__all__ = [ 'ConfigError', 'load_config', 'ConfigWatcher' ]
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class ConfigError(Exception):
+    pass
+
+
+def _validate(key, value, default, optional, positive=()):
+    if value is None:
+        if default is None or key in optional:
+            return None
+        raise ConfigError('%s may not be null' % key)
+
+    # JSON has no bytes or tuples, so accept the nearest JSON type
+    if isinstance(default, bytes) and isinstance(value, str):
+        return value.encode('ascii')
+    if isinstance(default, (tuple, list)):
+        if not isinstance(value, list) or (len(default) != 0 and len(value) != len(default)):
+            raise ConfigError('%s must be a list of %d values' % (key, len(default)))
+        if len(default) != 0:
+            value = [ _validate(key, v, d, ()) for v, d in zip(value, default) ]
+        return type(default)(value)
+    if isinstance(default, float) and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+
+    expected = type(default) if default is not None else (int, float, str)
+    if isinstance(value, bool) != isinstance(default, bool) or not isinstance(value, expected):
+        raise ConfigError('%s must be of type %s' % (key, type(default).__name__))
+    if isinstance(value, (int, float)) and value < 0:
+        raise ConfigError('%s must not be negative' % key)
+    if key in positive and value == 0:
+        raise ConfigError('%s must be greater than zero' % key)
+    return value
+
+def load_config(path: str, defaults: dict, optional: tuple = (), positive: tuple = ()):
+    """
+    Returns the defaults with the settings from the JSON file at path applied.
+    A missing file gives the defaults. Settings in optional may be null and
+    numbers in positive may not be zero. Raises ConfigError if the file cannot
+    be parsed or holds an unknown or invalid setting.
+    """
+    config = dict(defaults)
+    if not os.path.exists(path):
+        return config
+
+    try:
+        with open(path, 'r') as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError('unable to read "%s": %s' % (path, e))
+    if not isinstance(settings, dict):
+        raise ConfigError('"%s" must hold a JSON object' % path)
+
+    for key, value in settings.items():
+        if key not in defaults:
+            raise ConfigError('unknown setting %s' % key)
+        config[key] = _validate(key, value, defaults[key], optional, positive)
+    return config
+
+
+class ConfigWatcher(threading.Thread):
+    def __init__(self, path: str, defaults: dict, callback, optional: tuple = (),
+                 positive: tuple = (), poll_interval: float = 1.0):
+        threading.Thread.__init__(self, name='ConfigWatcher', daemon=True)
+        self.path = os.path.abspath(path)
+        self.defaults = defaults
+        self.optional = optional
+        self.positive = positive
+        self.poll_interval = poll_interval
+        self.callback = callback
+
+        try:
+            self.config = load_config(self.path, defaults, optional, positive)
+        except ConfigError as e:
+            logging.error('ConfigWatcher: using default settings: %s', str(e))
+            self.config = dict(defaults)
+
+        self._shutdownEvent = threading.Event()
+        self._inotify = self._open_inotify()
+
+    def _open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            # Watch the directory, as editors often replace the file
+            directory = os.path.dirname(self.path).encode()
+            if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+            return fd
+        except (OSError, AttributeError) as e:
+            logging.info('ConfigWatcher: inotify not available, polling "%s": %s', self.path, repr(e))
+            return None
+
+    def shutdown(self):
+        self._shutdownEvent.set()
+
+    def _file_events(self):
+        # True if an event for the config file was read
+        name = os.path.basename(self.path).encode()
+        changed = False
+        while True:
+            try:
+                data = os.read(self._inotify, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                changed = changed or data[offset:offset + length].rstrip(b'\0') == name
+                offset += length
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        try:
+            config = load_config(self.path, self.defaults, self.optional, self.positive)
+        except ConfigError as e:
+            logging.error('ConfigWatcher: keeping current settings: %s', str(e))
+            return
+
+        changed = { key for key, value in config.items() if self.config[key] != value }
+        if not changed:
+            return
+        logging.info('ConfigWatcher: settings changed: %s', ', '.join(sorted(changed)))
+        self.config = config
+        try:
+            self.callback(config, changed)
+        except Exception as e:
+            logging.error('ConfigWatcher: failed to apply settings: %s', repr(e))
+
+    def run(self):
+        mtime = self._mtime()
+        while not self._shutdownEvent.is_set():
+            if self._inotify is not None:
+                readable, _, _ = select.select([self._inotify], [], [], self.poll_interval)
+                if not readable or not self._file_events():
+                    continue
+                # Let an editor finish writing before the file is read
+                self._shutdownEvent.wait(0.1)
+                self._file_events()
+            else:
+                self._shutdownEvent.wait(self.poll_interval)
+                if self._mtime() == mtime:
+                    continue
+                mtime = self._mtime()
+            self.reload()
+
+        if self._inotify is not None:
+            os.close(self._inotify)
+        logging.info('ConfigWatcher: exiting')
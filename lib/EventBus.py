@@ -0,0 +1,156 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# EventBus.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the EventBus class. This class fans the Event stream
+# from the PtzController out to any number of subscribers (monitors, loggers,
+# tally / UI clients). Each subscriber has its own bounded queue with a drop
+# policy, so publishing never blocks and a slow subscriber only loses its own
+# events. EventSocketServer exposes the bus as JSON lines on a Unix socket
+# that only the controller's user can connect to.
+################################################################################
+
+import os
+import json
+import stat
+import socket
+import logging
+import threading
+
+from enum import Enum, unique, auto
+from collections import deque
+
+__all__ = [ 'DropPolicy', 'Subscription', 'EventBus', 'EventSocketServer', 'event_to_dict' ]
+
+@unique
+class DropPolicy(Enum):
+    DROP_OLDEST = auto()
+    DROP_NEWEST = auto()
+
+def event_to_dict(event):
+    return {
+        'type' : event.type.name,
+        'button' : event.button.name if event.button is not None else None,
+        'modifier' : event.modifier.name if event.modifier is not None else None,
+        'joystick' : event.joystick,
+        'timestamp' : event.timestamp,
+    }
+
+class Subscription(object):
+    def __init__(self, name: str, maxsize: int, policy: DropPolicy):
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+
+    def put(self, event):
+        with self._condition:
+            if len(self._queue) >= self.maxsize:
+                self.dropped += 1
+                if self.policy is DropPolicy.DROP_NEWEST:
+                    return
+                self._queue.popleft()
+            self._queue.append(event)
+            self._condition.notify()
+
+    def get(self, timeout: float = None):
+        # Returns None if no event arrived before the timeout
+        with self._condition:
+            if not self._queue:
+                self._condition.wait(timeout)
+            if not self._queue:
+                return None
+            return self._queue.popleft()
+
+class EventBus(object):
+    def __init__(self):
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+
+    def subscribe(self, name: str, maxsize: int = 256, policy: DropPolicy = DropPolicy.DROP_OLDEST):
+        subscription = Subscription(name, maxsize, policy)
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+
+    def publish(self, event):
+        # The subscription tuple is replaced, never modified, so it can be
+        # iterated without holding the bus lock
+        for subscription in self._subscriptions:
+            subscription.put(event)
+
+class EventSocketServer(threading.Thread):
+    def __init__(self, bus: EventBus, path: str, maxsize: int = 256):
+        threading.Thread.__init__(self, name='EventSocketServer', daemon=True)
+        self._bus = bus
+        self._path = path
+        self._maxsize = maxsize
+
+        # Only a socket of ours left behind by an earlier run is removed
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+                raise FileExistsError('"%s" exists and is not our event socket' % path)
+            os.unlink(path)
+
+        # Created without group or other access, so there is no window in
+        # which another user can connect
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self._sock.bind(path)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        self._sock.listen()
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def _serve_client(self, conn):
+        subscription = self._bus.subscribe('socket', self._maxsize)
+        reported_drops = 0
+        try:
+            while True:
+                event = subscription.get(timeout=1.0)
+                lines = []
+                if subscription.dropped != reported_drops:
+                    lines.append({ 'type' : 'DROPPED', 'count' : subscription.dropped - reported_drops })
+                    reported_drops = subscription.dropped
+                if event is not None:
+                    lines.append(event_to_dict(event))
+                if lines:
+                    conn.sendall(''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8'))
+        except OSError:
+            pass
+        finally:
+            self._bus.unsubscribe(subscription)
+            conn.close()
+
+    def run(self):
+        logging.info('EventSocketServer: listening on "%s"', self._path)
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(conn,), name='EventSocketClient',
+                             daemon=True).start()
+        logging.info('EventSocketServer: exiting')
@@ -0,0 +1,190 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# HIDProcess.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the HIDProcess class. It reads the joystick HID device
+# in a separate process, so reports are read and timestamped without waiting
+# on the GIL held by the camera network code, and hands them to the controller
+# process through a multiprocessing.shared_memory ring buffer. A pipe carries
+# one byte per report to wake the reader. HIDProcess has the same read()
+# interface as the HID device and is only supported on Linux.
+# The reader is spawned rather than forked, as the controller process already
+# runs threads holding locks and sockets the child must not inherit, and is
+# only given the name of the shared memory and the pipe.
+################################################################################
+
+import os
+import time
+import select
+import signal
+import struct
+import multiprocessing
+
+from multiprocessing import shared_memory
+
+from .hidraw import HIDException
+
+__all__ = [ 'HIDProcess' ]
+
+# Ring header: a generation that is odd while the count is being written,
+# the number of reports written, then a NUL terminated error message. A 64 bit
+# count is not written atomically on a 32 bit CPU, so readers check the
+# generation around it, as for a seqlock.
+GENERATION = struct.Struct('<I')
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 8
+HEADER_SIZE = COUNT_OFFSET + COUNT.size
+ERROR_SIZE = 240
+# Ring slot: sequence number (report number + 1, 0 while being written),
+# monotonic timestamp and the 4 byte report
+SLOT = struct.Struct('<Qd4s4x')
+SLOTS_OFFSET = HEADER_SIZE + ERROR_SIZE
+
+def _reader_main(device, vid, pid, shm_name, capacity, wakeup_conn):
+    # Ctrl-C is handled by the controller process, which stops this one
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    wakeup = wakeup_conn.fileno()
+    os.set_blocking(wakeup, False)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buf = shm.buf
+
+    try:
+        hid_device = device(vid, pid)
+    except Exception as e:
+        _reader_error(buf, e)
+        del buf
+        shm.close()
+        return
+
+    os.write(wakeup, b'\0')
+    count = 0
+    generation = 0
+    try:
+        while True:
+            report = hid_device.read(4)
+            timestamp = time.monotonic()
+
+            offset = SLOTS_OFFSET + (count % capacity) * SLOT.size
+            SLOT.pack_into(buf, offset, 0, timestamp, bytes(report[:4]))
+            count += 1
+            SLOT.pack_into(buf, offset, count, timestamp, bytes(report[:4]))
+            generation = (generation + 1) & 0xFFFFFFFF
+            GENERATION.pack_into(buf, 0, generation)
+            COUNT.pack_into(buf, COUNT_OFFSET, count)
+            generation = (generation + 1) & 0xFFFFFFFF
+            GENERATION.pack_into(buf, 0, generation)
+
+            try:
+                os.write(wakeup, b'\0')
+            except BlockingIOError:
+                # The reader already has more wake-ups pending than it needs
+                pass
+    except Exception as e:
+        _reader_error(buf, e)
+    finally:
+        hid_device.close()
+        del buf
+        shm.close()
+
+def _reader_error(buf, e):
+    message = repr(e).encode('utf-8', 'replace')[:ERROR_SIZE - 1]
+    buf[HEADER_SIZE:HEADER_SIZE + len(message) + 1] = message + b'\0'
+
+class HIDProcess(object):
+    def __init__(self, vid: int, pid: int, device, capacity: int = 256, start_timeout: float = 15.0):
+        self.capacity = capacity
+        self.report_time = None
+        self.stats = { 'reports' : 0, 'dropped' : 0 }
+
+        self._read_count = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=SLOTS_OFFSET + capacity * SLOT.size)
+        context = multiprocessing.get_context('spawn')
+        self._wakeup_conn, wakeup_w = context.Pipe(duplex=False)
+        self._wakeup = self._wakeup_conn.fileno()
+
+        self._process = context.Process(target=_reader_main, name='HIDProcess', daemon=True,
+                                        args=(device, vid, pid, self._shm.name, capacity, wakeup_w))
+        try:
+            self._process.start()
+        finally:
+            wakeup_w.close()
+
+        # The reader writes one byte once the device is open, or exits
+        try:
+            if not select.select([self._wakeup], [], [], start_timeout)[0]:
+                raise HIDException('HID process did not start')
+            if os.read(self._wakeup, 1) == b'':
+                raise HIDException(self._error())
+        except:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        if self._process is None:
+            return
+        self._process.terminate()
+        self._process.join()
+        self._process = None
+        self._wakeup_conn.close()
+        self._shm.close()
+        self._shm.unlink()
+
+    def fileno(self):
+        return self._wakeup
+
+    def _error(self):
+        message = bytes(self._shm.buf[HEADER_SIZE:SLOTS_OFFSET]).split(b'\0', 1)[0]
+        return message.decode('utf-8', 'replace') or 'HID process exited'
+
+    def _count(self, buf):
+        while True:
+            generation = GENERATION.unpack_from(buf, 0)[0]
+            count = COUNT.unpack_from(buf, COUNT_OFFSET)[0]
+            if generation % 2 == 0 and GENERATION.unpack_from(buf, 0)[0] == generation:
+                return count
+
+    def _next_report(self):
+        buf = self._shm.buf
+        while True:
+            count = self._count(buf)
+            if count == self._read_count:
+                return None
+            if count - self._read_count > self.capacity:
+                self.stats['dropped'] += count - self._read_count - self.capacity
+                self._read_count = count - self.capacity
+
+            offset = SLOTS_OFFSET + (self._read_count % self.capacity) * SLOT.size
+            seq, timestamp, report = SLOT.unpack_from(buf, offset)
+            # A slot overwritten while it was read has moved on to a later
+            # sequence number, so go round again and skip what was lost
+            if seq != self._read_count + 1 or SLOT.unpack_from(buf, offset)[0] != seq:
+                continue
+
+            self._read_count += 1
+            self.stats['reports'] += 1
+            self.report_time = timestamp
+            return report
+
+    def read(self, size, timeout=None):
+        # timeout is in milliseconds as for the HID device, returns b'' on
+        # timeout. Wake-ups are only consumed once the ring is empty, so the
+        # pipe stays readable while reports are waiting.
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000.0
+        while True:
+            report = self._next_report()
+            if report is not None:
+                return report[:size]
+
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self._wakeup], [], [], wait)[0]:
+                return b''
+            if os.read(self._wakeup, 4096) == b'':
+                raise HIDException(self._error())
@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# MotionScheduler.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the MotionScheduler class. This class decouples the rate
+# of joystick updates from the rate of commands sent to the camera. Targets are
+# sampled at a fixed tick, smoothed and limited in acceleration / jerk, and at
+# most one command per channel is sent each tick.
+################################################################################
+
+import math
+import time
+import functools
+import logging
+import threading
+
+__all__ = [ 'MotionScheduler' ]
+
+def _clamp(n, smallest, largest):
+    return max(smallest, min(n, largest))
+
+# State for a single group of axes sent together in one command
+class MotionChannel(object):
+    def __init__(self, name: str, axes: int, send):
+        self.name = name
+        self.send = send
+        self.active = False
+        self.target = (0.0,) * axes
+        self.filtered = [0.0] * axes
+        self.velocity = [0.0] * axes
+        self.accel = [0.0] * axes
+        self.last_sent = None
+        # Bumped by each reset, so an output computed before a stop is not sent
+        # after it
+        self.generation = 0
+        self.send_lock = threading.Lock()
+
+    def reset(self):
+        axes = len(self.target)
+        self.active = False
+        self.target = (0.0,) * axes
+        self.filtered = [0.0] * axes
+        self.velocity = [0.0] * axes
+        self.accel = [0.0] * axes
+        self.last_sent = None
+        self.generation += 1
+
+# Scheduler class
+class MotionScheduler(threading.Thread):
+    def __init__(self, rate: float = 20.0, smoothing: float = 0.05,
+                 max_accel: float = 4.0, max_jerk: float = 40.0):
+        threading.Thread.__init__(self, name='MotionScheduler', daemon=True)
+        self.period = 1.0 / rate
+        self.smoothing = smoothing
+        self.max_accel = max_accel
+        self.max_jerk = max_jerk
+
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._error = None
+        self._shutdownEvent = threading.Event()
+
+    def add_channel(self, name: str, axes: int, send):
+        # send(output) returns the futures of the commands it queued, if any,
+        # so an output whose command fails or is superseded is sent again
+        self._channels[name] = MotionChannel(name, axes, send)
+
+    def set_target(self, name: str, target: tuple):
+        with self._lock:
+            channel = self._channels[name]
+            channel.target = tuple(target)
+            channel.active = True
+
+    def stop(self, name: str):
+        # Waits for a command being sent on the channel, but not for the other
+        # channels, so nothing is sent after the caller issues its own stop
+        # command
+        with self._lock:
+            channel = self._channels[name]
+            channel.reset()
+        with channel.send_lock:
+            pass
+
+    def check(self):
+        # Re-raise errors from the scheduler thread on the caller's thread
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def shutdown(self):
+        self._shutdownEvent.set()
+
+    def _step_axis(self, channel, i, dt):
+        # Low-pass filter the raw target
+        alpha = 1.0 - math.exp(-dt / self.smoothing) if self.smoothing > 0 else 1.0
+        channel.filtered[i] += alpha * (channel.target[i] - channel.filtered[i])
+        if abs(channel.target[i] - channel.filtered[i]) < 1e-3:
+            channel.filtered[i] = channel.target[i]
+
+        # Acceleration needed to reach the filtered target this tick, eased off
+        # early enough that the acceleration can return to zero in time
+        error = channel.filtered[i] - channel.velocity[i]
+        accel = error / dt
+        if self.max_jerk > 0:
+            # Largest acceleration that ramps back to zero in steps of
+            # max_jerk * dt before covering the error
+            step = 0.5 * self.max_jerk * dt
+            brake = math.sqrt(step * step + 2.0 * self.max_jerk * abs(error)) - step
+            accel = _clamp(accel, -brake, brake)
+        if self.max_accel > 0:
+            accel = _clamp(accel, -self.max_accel, self.max_accel)
+        if self.max_jerk > 0:
+            prev = channel.accel[i]
+            accel = _clamp(accel, prev - self.max_jerk * dt, prev + self.max_jerk * dt)
+
+        velocity = channel.velocity[i] + accel * dt
+        if (channel.filtered[i] - velocity) * error < 0:
+            # Crossed the target, settle on it
+            velocity = channel.filtered[i]
+            accel = 0.0
+
+        channel.velocity[i] = _clamp(velocity, -1.0, 1.0)
+        channel.accel[i] = accel
+
+    def _tick(self, dt):
+        # Outputs are computed under the lock and sent outside it, so the
+        # joystick thread never waits on the camera to set a target
+        outputs = []
+        with self._lock:
+            for channel in self._channels.values():
+                if not channel.active:
+                    continue
+
+                for i in range(len(channel.target)):
+                    self._step_axis(channel, i, dt)
+
+                output = tuple(channel.velocity)
+                if output != channel.last_sent:
+                    outputs.append((channel, output, channel.generation))
+
+        for channel, output, generation in outputs:
+            with channel.send_lock:
+                # Stopped since the output was computed
+                if channel.generation != generation:
+                    continue
+                try:
+                    futures = channel.send(output) or ()
+                    channel.last_sent = output
+                    for future in futures:
+                        future.add_done_callback(functools.partial(self._sent, channel, output))
+                except Exception as e:
+                    logging.error('MotionScheduler: failed to send "%s": %s', channel.name, repr(e))
+                    with self._lock:
+                        channel.reset()
+                    self._error = e
+
+    def _sent(self, channel, output, future):
+        # Runs on the dispatcher thread once a command is done. If it never
+        # reached the camera, forget the output so the next tick sends it again.
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                if channel.last_sent == output:
+                    channel.last_sent = None
+
+    def run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.period
+            if self._shutdownEvent.wait(max(0.0, next_tick - time.monotonic())):
+                break
+
+            # Skip missed ticks rather than bursting to catch up
+            now = time.monotonic()
+            if now - next_tick > self.period:
+                next_tick = now
+
+            self._tick(self.period)
+
+        logging.info('MotionScheduler: exiting')
@@ -0,0 +1,279 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# NetworkInput.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module lets a remote operator position or software panel drive the
+# camera over UDP. Packets carry the same 4 byte report as the AXIS T8311
+# (pan, tilt, zoom, buttons) plus a sequence number, so stale and reordered
+# packets can be discarded and the report can go through the PtzController's
+# normal mapping and button state machine. InputArbiter merges the remote
+# reports with the local joystick.
+# The input only listens on localhost unless given a shared secret, in which
+# case every packet must carry an HMAC of its contents under the secret. A
+# signed packet also carries the sender's random session id and the time it
+# was sent, so a captured packet is only accepted while fresh and never twice.
+################################################################################
+
+import os
+import hmac
+import time
+import struct
+import select
+import socket
+import hashlib
+import logging
+import ipaddress
+
+__all__ = [ 'NetworkInput', 'NetworkInputSender', 'InputArbiter' ]
+
+PACKET = struct.Struct('>4sI4s')
+PACKET_MAGIC = b'PTZ1'
+
+# Packets signed with a shared secret: the fields of PACKET, the session id
+# and the time sent (ms since the epoch), followed by a truncated HMAC-SHA256
+SIGNED_PACKET = struct.Struct('>4sI4s8sQ')
+SIGNED_MAGIC = b'PTZ3'
+SESSION_SIZE = 8
+TAG_SIZE = 16
+
+# Time (s) either side of the local clock within which a signed packet is
+# accepted, which also bounds the clock difference between the hosts
+FRESHNESS_WINDOW = 2.0
+
+# Interval (s) at which a local device without a file descriptor is read
+# while the remote input is checked in between
+LOCAL_POLL_INTERVAL = 0.01
+
+# Report for a centred stick with no buttons pressed
+NEUTRAL_REPORT = bytes([0x80, 0x80, 0x80, 0x00])
+
+def _seq_newer(seq, last):
+    # Serial number comparison so the sequence may wrap around
+    return 0 < ((seq - last) & 0xFFFFFFFF) < 0x80000000
+
+def _tag(secret, data):
+    return hmac.new(secret, data, hashlib.sha256).digest()[:TAG_SIZE]
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+class NetworkInput(object):
+    def __init__(self, port: int, host: str = '127.0.0.1', timeout: float = 0.5, secret: str = None):
+        # Anyone who can reach the port can drive the camera, so listening
+        # beyond this machine needs a secret
+        if secret is None and not _is_loopback(host):
+            raise ValueError('remote input on %s:%d needs a shared secret' % (host, port))
+        self.timeout = timeout
+        self.secret = secret.encode('utf-8') if secret is not None else None
+        self.stats = { 'accepted' : 0, 'stale' : 0, 'invalid' : 0, 'ignored' : 0 }
+
+        self._sender = None
+        self._last_seq = None
+        self._last_time = 0.0
+        # Last sequence number and time accepted per signed session, kept
+        # while its packets could still be fresh, whichever address they
+        # come from
+        self._sessions = {}
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._sock.bind((host, port))
+
+    def close(self):
+        self._sock.close()
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    @property
+    def address(self):
+        return self._sock.getsockname()
+
+    def expired(self):
+        return time.monotonic() - self._last_time > self.timeout
+
+    def _unpack(self, data):
+        # Returns the sequence number, report and session id of a valid
+        # packet, or None. The session id is None for unsigned packets.
+        if self.secret is None:
+            if len(data) != PACKET.size or data[:4] != PACKET_MAGIC:
+                return None
+            _, seq, report = PACKET.unpack(data)
+            return seq, report, None, None
+
+        if len(data) != SIGNED_PACKET.size + TAG_SIZE or data[:4] != SIGNED_MAGIC or \
+                not hmac.compare_digest(data[SIGNED_PACKET.size:], _tag(self.secret, data[:SIGNED_PACKET.size])):
+            return None
+        _, seq, report, session, sent = SIGNED_PACKET.unpack_from(data)
+        return seq, report, session, sent / 1000.0
+
+    def _replayed(self, seq, session, sent):
+        if abs(time.time() - sent) > FRESHNESS_WINDOW:
+            return True
+        last = self._sessions.get(session)
+        return last is not None and not _seq_newer(seq, last[0])
+
+    def receive(self):
+        # Drain pending packets and return the newest valid report, or None
+        report = None
+        while True:
+            try:
+                data, sender = self._sock.recvfrom(64)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                logging.warning('NetworkInput: receive failed: %s', repr(e))
+                break
+
+            packet = self._unpack(data)
+            if packet is None:
+                self.stats['invalid'] += 1
+                continue
+            seq, packet_report, session, sent = packet
+            if session is not None and self._replayed(seq, session, sent):
+                self.stats['stale'] += 1
+                continue
+
+            # One remote sender owns the input until it goes quiet
+            if sender != self._sender:
+                if not self.expired():
+                    self.stats['ignored'] += 1
+                    continue
+                logging.info('NetworkInput: remote input from %s', sender)
+                self._sender = sender
+                self._last_seq = None
+
+            if self._last_seq is not None and not _seq_newer(seq, self._last_seq):
+                self.stats['stale'] += 1
+                continue
+
+            self.stats['accepted'] += 1
+            self._last_seq = seq
+            self._last_time = time.monotonic()
+            if session is not None:
+                self._sessions[session] = (seq, self._last_time)
+            report = packet_report
+
+        # A session's packets are all stale once it has been quiet for the
+        # window on both sides
+        now = time.monotonic()
+        for session, (_, last_time) in list(self._sessions.items()):
+            if now - last_time > 2 * FRESHNESS_WINDOW:
+                del self._sessions[session]
+        return report
+
+class NetworkInputSender(object):
+    def __init__(self, host: str, port: int, secret: str = None):
+        self._seq = 0
+        self._secret = secret.encode('utf-8') if secret is not None else None
+        self._session = os.urandom(SESSION_SIZE)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.connect((host, port))
+
+    def close(self):
+        self._sock.close()
+
+    def send(self, report: bytes):
+        if self._secret is None:
+            packet = PACKET.pack(PACKET_MAGIC, self._seq, bytes(report[:4]))
+        else:
+            packet = SIGNED_PACKET.pack(SIGNED_MAGIC, self._seq, bytes(report[:4]), self._session,
+                                        int(time.time() * 1000))
+            packet += _tag(self._secret, packet)
+        self._sock.send(packet)
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+
+class InputArbiter(object):
+    """
+    Presents the local HID device and a NetworkInput as a single device with
+    the HID read() interface. Control only changes hands while the current
+    owner is idle, so a camera move is never taken over mid-stroke, and
+    returns to the local joystick whenever both are idle. A remote owner that
+    stops sending is treated as idle.
+    """
+
+    def __init__(self, local, remote: NetworkInput, idle):
+        self.local = local
+        self.remote = remote
+        self.owner = 'local'
+
+        self._idle = idle
+        self._reports = { 'local' : NEUTRAL_REPORT, 'remote' : NEUTRAL_REPORT }
+
+    def close(self):
+        # The NetworkInput outlives the HID device, so it is not closed here
+        self.local.close()
+
+    def filenos(self):
+        if not hasattr(self.local, 'fileno'):
+            return []
+        return [self.local.fileno(), self.remote.fileno()]
+
+    @property
+    def poll_interval(self):
+        # A silent remote owner is only released when read() is called
+        return self.remote.timeout
+
+    def _select_owner(self):
+        if not self._idle(self._reports[self.owner]):
+            return
+
+        if self.owner == 'remote':
+            owner = 'local'
+        elif not self._idle(self._reports['remote']):
+            owner = 'remote'
+        else:
+            return
+
+        if not self._idle(self._reports[owner]):
+            logging.info('InputArbiter: %s input takes control', owner)
+        self.owner = owner
+
+    def _wait(self, size, wait):
+        # Returns the local report, or None, and whether the remote input is
+        # readable, waiting up to wait (s) for either
+        if hasattr(self.local, 'fileno'):
+            readable, _, _ = select.select([self.local, self.remote], [], [], wait)
+            report = self.local.read(size, 0) if self.local in readable else None
+            return report or None, self.remote in readable
+
+        # Without a descriptor to select on, the local device is read with
+        # short timeouts and the remote input checked in between
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            report = self.local.read(size, int(max(0.0, min(remaining, LOCAL_POLL_INTERVAL)) * 1000))
+            readable, _, _ = select.select([self.remote], [], [], 0)
+            if report or readable or remaining <= LOCAL_POLL_INTERVAL:
+                return report or None, bool(readable)
+
+    def read(self, size, timeout=None):
+        # Wake up at least every remote timeout so a silent remote owner can
+        # be released. Returns b'' as a HID device does on timeout if the
+        # input in control has nothing new.
+        wait = self.remote.timeout if timeout is None else min(timeout / 1000.0, self.remote.timeout)
+        local_report, remote_readable = self._wait(size, wait)
+
+        updated = set()
+        if local_report is not None:
+            self._reports['local'] = local_report
+            updated.add('local')
+        if remote_readable:
+            report = self.remote.receive()
+            if report is not None:
+                self._reports['remote'] = report
+                updated.add('remote')
+        if self.remote.expired() and self._reports['remote'] != NEUTRAL_REPORT:
+            self._reports['remote'] = NEUTRAL_REPORT
+            updated.add('remote')
+
+        owner = self.owner
+        self._select_owner()
+        if self.owner == owner and owner not in updated:
+            return b''
+        return self._reports[self.owner][:size]
@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# NullCamera.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the NullCamera class, a CameraBackend that accepts every
+# command and sends nothing. It is selected with the 'null' protocol, to run
+# the controller without a camera or to measure the CPU cost of everything up
+# to the camera protocol in benchmark.py.
+################################################################################
+
+from .backend import CameraBackend
+from .CameraCapabilities import CameraCapabilities
+
+__all__ = [ 'NullCamera' ]
+
+
+class NullCamera(CameraBackend):
+    def __init__(self, name: str = 'null'):
+        self.name = name
+        self.speed = 50
+        self.calls = 0
+
+    def continuous_move(self, pan: int = None, tilt: int = None, zoom: int = None):
+        self.calls += 1
+
+    def stop_move(self):
+        self.calls += 1
+
+    def continuous_focus(self, focus: int = None):
+        self.calls += 1
+
+    def stop_focus(self):
+        self.calls += 1
+
+    def auto_focus(self, focus: str = None):
+        self.calls += 1
+
+    def go_home_position(self, speed: int = None):
+        self.calls += 1
+
+    def go_to_server_preset_name(self, name: str = None, speed: int = None):
+        self.calls += 1
+
+    def set_server_preset_name(self, name: str = None):
+        self.calls += 1
+
+    def set_speed(self, speed: int = None):
+        self.calls += 1
+        self.speed = speed
+
+    def get_speed(self):
+        self.calls += 1
+        return self.speed
+
+    def get_ptz(self):
+        self.calls += 1
+        return (0.0, 0.0, 1.0)
+
+    def get_capabilities(self, cache=None):
+        # Everything is supported and nothing needs to be discovered
+        return CameraCapabilities('null', '', speed=self.speed)
+
+    def close(self):
+        pass
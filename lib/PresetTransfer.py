@@ -0,0 +1,214 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# PresetTransfer.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module copies server presets between AXIS cameras. A snapshot reads the
+# name and position of every preset in two requests, from the preset list and
+# the preset parameters, instead of driving the camera to each one. Restoring
+# a preset means driving the camera there and saving it, so presets already
+# stored at the same position are skipped, the rest are visited in nearest
+# neighbour order to keep the head's travel short, and arrival is polled for
+# rather than waited out. Cameras are restored concurrently on a bounded
+# thread pool, one worker per camera as a camera can only be in one place.
+################################################################################
+
+import os
+import json
+import time
+import logging
+import threading
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .backend import CameraError
+
+__all__ = [ 'Preset', 'TransferResult', 'PresetTransfer', 'snapshot', 'plan_restore', 'load_presets',
+            'save_presets' ]
+
+Preset = namedtuple('Preset', ['name', 'pan', 'tilt', 'zoom'])
+
+# written and skipped are preset names, errors maps a preset name (or None for
+# the camera as a whole) to the error message
+TransferResult = namedtuple('TransferResult', ['written', 'skipped', 'errors'])
+
+FILE_VERSION = 1
+
+# Largest difference in pan / tilt (degrees) and zoom (steps) at which two
+# positions are the same
+TOLERANCE = (0.1, 0.1, 10.0)
+
+# Interval (s) between position polls while moving to a preset, the polls
+# without movement after which the camera has stopped short, and the longest
+# time (s) a move may take
+ARRIVAL_POLL = 0.05
+SETTLE_POLLS = 3
+ARRIVAL_TIMEOUT = 30.0
+
+# Time (s) a move has to start before a camera that has not moved is taken
+# to have stopped
+START_TIME = 1.0
+
+def _same_position(a, b):
+    return all(abs(x - y) <= tolerance for x, y, tolerance in zip(a, b, TOLERANCE))
+
+def _distance(a, b):
+    # Travel time is set by the slowest axis, zoom steps are far smaller
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1]), abs(a[2] - b[2]) / 100.0)
+
+def snapshot(camera, visit: bool = False):
+    """
+    Returns the presets of a CameraControl with their positions, in the
+    camera's order. Presets missing from the preset parameters are only
+    captured with visit, which drives the camera to each of them.
+    """
+    names = [ name for _, name in camera.list_all_preset() ]
+    positions = camera.list_preset_positions()
+
+    presets = []
+    for name in names:
+        position = positions.get(name)
+        if position is None:
+            if not visit:
+                logging.warning('PresetTransfer: no position for preset "%s", skipped', name)
+                continue
+            camera.go_to_server_preset_name(name, 100)
+            position = _wait_for_move(camera)
+        presets.append(Preset(name, *position))
+    return presets
+
+def plan_restore(presets: list, existing: dict, start: tuple, force: bool = False):
+    """
+    Orders the presets to write to a camera whose presets are at existing
+    (name to position) and whose head is at start. Returns (to write, names
+    skipped as already set).
+    """
+    remaining = []
+    skipped = []
+    for preset in presets:
+        current = existing.get(preset.name)
+        if not force and current is not None and _same_position(current, preset[1:]):
+            skipped.append(preset.name)
+        else:
+            remaining.append(preset)
+
+    # Greedy nearest neighbour: far from the shortest tour in theory, but a
+    # good deal shorter than the order presets were made in
+    ordered = []
+    position = start
+    while remaining:
+        nearest = min(range(len(remaining)), key=lambda i: _distance(position, remaining[i][1:]))
+        preset = remaining.pop(nearest)
+        ordered.append(preset)
+        position = preset[1:]
+    return ordered, skipped
+
+def _wait_for_move(camera, target=None):
+    """
+    Polls the camera's position until it is at target, or with no target
+    until it has stopped, and returns the position.
+    """
+    start = time.monotonic()
+    first = last = camera.get_ptz()
+    unchanged = 0
+    while target is None or not _same_position(last, target):
+        # A move may take a moment to start
+        if unchanged >= SETTLE_POLLS and (last != first or time.monotonic() - start > START_TIME):
+            if target is None:
+                break
+            raise CameraError('stopped at %s, short of the preset' % (tuple(round(x, 2) for x in last),))
+        if time.monotonic() - start > ARRIVAL_TIMEOUT:
+            raise CameraError('still moving after %.0f s' % ARRIVAL_TIMEOUT)
+        time.sleep(ARRIVAL_POLL)
+        position = camera.get_ptz()
+        unchanged = unchanged + 1 if position == last else 0
+        last = position
+    return last
+
+def load_presets(path: str):
+    # Returns (source camera, presets) from a file written by save_presets
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if data.get('version') != FILE_VERSION:
+        raise ValueError('%s: unsupported preset file version %s' % (path, data.get('version')))
+    return data.get('camera'), [ Preset(p['name'], float(p['pan']), float(p['tilt']), float(p['zoom']))
+                                 for p in data['presets'] ]
+
+def save_presets(path: str, camera: str, presets: list):
+    data = { 'version' : FILE_VERSION, 'camera' : camera, 'presets' : [ p._asdict() for p in presets ] }
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+class PresetTransfer(object):
+    """
+    Restores presets to many cameras at once. open_camera(name) returns a
+    connected CameraControl. progress(camera, done, total, preset, error) is
+    called from the worker threads, one call at a time, after each preset, with
+    preset None for the presets skipped as already set.
+    """
+
+    def __init__(self, open_camera, jobs: int = 8, speed: int = 100, force: bool = False,
+                 progress=None):
+        self.open_camera = open_camera
+        self.jobs = jobs
+        self.speed = speed
+        self.force = force
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def restore(self, cameras: list, presets: list):
+        # Returns a dict of camera name to TransferResult
+        with ThreadPoolExecutor(max_workers=max(1, min(self.jobs, len(cameras))),
+                                thread_name_prefix='PresetTransfer') as executor:
+            futures = { name : executor.submit(self._restore_camera, name, presets) for name in cameras }
+        return { name : future.result() for name, future in futures.items() }
+
+    def _report(self, *args):
+        if self.progress is not None:
+            with self._lock:
+                self.progress(*args)
+
+    def _restore_camera(self, name, presets):
+        written = []
+        skipped = []
+        errors = {}
+        try:
+            camera = self.open_camera(name)
+        except Exception as e:
+            errors[None] = repr(e)
+            return TransferResult(written, skipped, errors)
+
+        try:
+            # Presets are clamped to what this camera can reach
+            capabilities = camera.get_capabilities()
+            presets = [ Preset(p.name, capabilities.clamp('pan', p.pan), capabilities.clamp('tilt', p.tilt),
+                               capabilities.clamp('zoom', p.zoom)) for p in presets ]
+            existing = camera.list_preset_positions()
+            ordered, skipped = plan_restore(presets, existing, camera.get_ptz(), self.force)
+
+            if skipped:
+                self._report(name, len(skipped), len(presets), None, None)
+
+            speed = capabilities.clamp('speed', self.speed)
+            for i, preset in enumerate(ordered):
+                error = None
+                try:
+                    camera.absolute_move(preset.pan, preset.tilt, preset.zoom, speed)
+                    _wait_for_move(camera, preset[1:])
+                    resp = camera.set_server_preset_name(preset.name)
+                    if resp.status_code not in [200, 204]:
+                        raise CameraError('camera replied %d' % resp.status_code)
+                    written.append(preset.name)
+                except CameraError as e:
+                    error = errors[preset.name] = str(e)
+                self._report(name, len(skipped) + i + 1, len(presets), preset.name, error)
+        except Exception as e:
+            # The camera is gone, the rest of its presets are not attempted
+            errors[None] = repr(e)
+        finally:
+            camera.close()
+        return TransferResult(written, skipped, errors)
@@ -5,8 +5,10 @@
 # Copyright (c) 2022 Mark Whiting
 #
 # This module provides the PtzCamera class. This class can consume events
-# generated by the PtzController class to control an AXIS IP camera using the
-# VAPIX API.
+# generated by the PtzController class to control an IP camera using either the
+# AXIS VAPIX API or VISCA over IP, or no camera at all with the 'null'
+# protocol. Given a list of addresses it drives all of them together as a
+# CameraGroup.
 ################################################################################
 
 import os
@@ -16,30 +18,141 @@ import json
 import logging
 
 from .vapix import CameraControl
+from .visca import ViscaControl
+from .NullCamera import NullCamera
+from .CameraGroup import CameraGroup
+from .CameraCapabilities import CapabilityCache
+from .CameraState import CameraState
 from .PtzController import Buttons, Events, Event
+from .MotionScheduler import MotionScheduler
+from .CommandDispatcher import CommandClass, CommandDispatcher
+from .backend import CameraError
+from .Watchdog import watchdog
 
 PTZ_CAMERA_SETTINGS = 'PtzCameraSettings.json'
 
+# Stick speed (full deflections/s) towards centre above which the stick is
+# taken to have been let go, rather than eased back
+RELEASE_RATE = 2.0
+
+# Time (s) to wait for the dispatcher to finish its request on close before
+# abandoning it
+CLOSE_TIMEOUT = 2.0
+
 __all__ = [ 'PtzCamera' ]
 
 # Camera class
 class PtzCamera(object):
-    def __init__(self, ip: str, user: str, password: str):
+    def __init__(self, ip: str, user: str, password: str, tick_rate: float = 20.0,
+                 smoothing: float = 0.05, max_accel: float = 4.0, max_jerk: float = 40.0,
+                 hysteresis: int = 1, retry_deadline: float = 1.0, keepalive: float = None,
+                 transport: str = 'requests', protocol: str = 'vapix', capability_cache: str = None,
+                 request_timeout: float = None, motion_lead: float = 1.0):
         self.moving = False
         self.focus = False
         self.speed = 50
 
+        # Returns of the stick to centre are anticipated by motion_lead times
+        # the measured command latency, so the camera does not coast on for a
+        # round trip after the stick is centred
+        self.motion_lead = motion_lead
+        self._last_stick = None
+        self._stopped_early = False
+
+        # Commands that would not change the camera's state are dropped, with
+        # hysteresis for the continuous motion channels
+        self.hysteresis = hysteresis
+        self.stats = { 'sent' : 0, 'suppressed' : 0, 'unchanged' : 0, 'early_stops' : 0 }
+
         self._load_settings()
 
         # Open connection to the camera
-        self.camera = CameraControl(ip, user, password)
-        self.camera.set_speed(self.speed)
+        self.camera = self._open_camera(protocol, ip, user, password, keepalive, transport, request_timeout)
+
+        # Nothing else holds the camera until the constructor returns, so a
+        # failure from here on must close it, or its keep-alive and
+        # connection run on behind every failed reconnect
+        self._heartbeat = None
+        self.dispatcher = None
+        try:
+            # Learn what the camera accepts once, so commands can be checked and
+            # clamped here rather than by the camera
+            self.capabilities = self.camera.get_capabilities(CapabilityCache(capability_cache))
+            logging.info('PtzCamera: connected to %s firmware %s with presets %s', self.capabilities.model,
+                         self.capabilities.firmware or 'unknown', self.capabilities.presets)
+
+            # Mirror of the camera's modes, a new connection starts from what the
+            # camera reported
+            self.state = CameraState(speed=self.capabilities.speed)
+            if self.state.differs('speed', self._clamp_speed(self.speed)):
+                self.camera.set_speed(self._clamp_speed(self.speed))
+                self.state.update('speed', self._clamp_speed(self.speed))
+
+            # All further commands go through the dispatcher's priority lanes. A
+            # dispatcher stuck in a request is reported by poll(), so the session
+            # reconnects the camera.
+            self._stalled = False
+            # The dispatcher cannot beat during a request, so it is given as long
+            # as the camera's slowest request may take
+            self._heartbeat = watchdog.register('dispatcher %s' % (ip if isinstance(ip, str) else ','.join(ip)),
+                                                self._dispatcher_stalled, self.camera.longest_request())
+            self.dispatcher = CommandDispatcher(retry_deadline, heartbeat=self._heartbeat)
+            self.dispatcher.start()
+
+            # Continuous commands are rate limited by the motion scheduler
+            self.scheduler = MotionScheduler(tick_rate, smoothing, max_accel, max_jerk)
+            self.scheduler.add_channel('move', 3, self._send_move)
+            self.scheduler.add_channel('focus', 1, self._send_focus)
+            self.scheduler.start()
+        except BaseException:
+            if self.dispatcher is not None:
+                self.dispatcher.shutdown()
+            if self._heartbeat is not None:
+                watchdog.unregister(self._heartbeat)
+            self.camera.close()
+            raise
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        self.camera.close()
+        self.close()
+
+    def _open_camera(self, protocol, ip, user, password, keepalive, transport, request_timeout):
+        if isinstance(ip, (list, tuple)):
+            if len(ip) > 1:
+                return CameraGroup.open(ip, lambda member_ip: self._open_camera(protocol, member_ip, user,
+                                                                                password, keepalive, transport,
+                                                                                request_timeout))
+            ip = ip[0]
+
+        if protocol == 'vapix':
+            return CameraControl(ip, user, password, keepalive, transport, request_timeout)
+        elif protocol == 'visca':
+            return ViscaControl(ip)
+        elif protocol == 'null':
+            return NullCamera(ip)
+        raise ValueError('unknown camera protocol "%s"' % protocol)
+
+    def configure(self, tick_rate: float = None, smoothing: float = None, max_accel: float = None,
+                  max_jerk: float = None, hysteresis: int = None, retry_deadline: float = None,
+                  motion_lead: float = None):
+        # Update motion and retry settings on the running camera, None leaves
+        # a setting unchanged
+        if tick_rate is not None:
+            self.scheduler.period = 1.0 / tick_rate
+        if smoothing is not None:
+            self.scheduler.smoothing = smoothing
+        if max_accel is not None:
+            self.scheduler.max_accel = max_accel
+        if max_jerk is not None:
+            self.scheduler.max_jerk = max_jerk
+        if hysteresis is not None:
+            self.hysteresis = hysteresis
+        if retry_deadline is not None:
+            self.dispatcher.retry_deadline = retry_deadline
+        if motion_lead is not None:
+            self.motion_lead = motion_lead
 
     def _load_settings(self):
         if not os.path.exists(PTZ_CAMERA_SETTINGS):
@@ -61,48 +174,172 @@ class PtzCamera(object):
         with open('PtzCameraSettings.json', 'w') as f:
             f.write(settings_str)
 
+    def _clamp_speed(self, speed):
+        return self.capabilities.clamp('speed', speed)
+
+    def _submit(self, cmd_class, key, fn, *args, **kwargs):
+        return self.dispatcher.submit(cmd_class, key, fn, *args, **kwargs)
+
+    def _call(self, fn, *args):
+        # Blocking call, kept in order with the other queued control commands
+        return self._submit(CommandClass.CONTROL, fn.__name__, fn, *args).result()
+
     def _wait_for_movement_end(self):
-        last_pos = self.camera.get_ptz()
+        last_pos = self._call(self.camera.get_ptz)
         while True:
             time.sleep(0.1)
-            cur_pos = self.camera.get_ptz()
+            cur_pos = self._call(self.camera.get_ptz)
             if (cur_pos == last_pos):
                 break
             last_pos = cur_pos
 
     def _go_home(self):
-        self.camera.go_home_position(100)
+        self._submit(CommandClass.PRESET, 'home', self.camera.go_home_position, 100).result()
         self._wait_for_movement_end()
 
     def _go_to_preset(self, name):
-        self.camera.go_to_server_preset_name(name, self.speed)
+        # The list is from connecting, the preset may have been set since on
+        # the camera's web page or by ptz-presets.py
+        if not self.capabilities.has_preset(name):
+            logging.info('Preset "%s" was not listed by the camera, recalling it anyway', name)
+        self._submit(CommandClass.PRESET, name, self.camera.go_to_server_preset_name, name,
+                     self._clamp_speed(self.speed))
         #self._wait_for_movement_end()
 
     def _set_preset(self, name):
         self._wait_for_movement_end()
-        self.camera.set_server_preset_name(name)
+        self._submit(CommandClass.PRESET, name, self.camera.set_server_preset_name, name).result()
+        self.capabilities.add_preset(name)
+
+    def _set_mode(self, field, value, key, fn, *args):
+        # Sends a CONTROL command that puts the camera in a mode, unless the
+        # mirror says it is already in it
+        if not self.state.differs(field, value):
+            self.stats['unchanged'] += 1
+            return
+        self.state.update(field, value, self._submit(CommandClass.CONTROL, key, fn, *args))
+
+    def _set_speed(self, speed):
+        self.speed = speed
+        self._save_settings()
+        speed = self._clamp_speed(speed)
+        self._set_mode('speed', speed, 'speed', self.camera.set_speed, speed)
+
+    def _command_changed(self, channel, value):
+        last = self.state.get(channel)
+        if last is None:
+            return True
+
+        for new, old in zip(value, last):
+            if new == old:
+                continue
+            # Always honour stopping an axis or reversing its direction, but
+            # ignore flicker of a single quantization step
+            if new == 0 or (new > 0) != (old > 0) or abs(new - old) > self.hysteresis:
+                return True
+        return False
 
     def _stop_move(self):
-        self.camera.stop_move()
-
-    def _update_move(self, joystick_data):
-        pan  = int(joystick_data[0] * 100)
-        tilt = int(joystick_data[1] * 100)
-        zoom = int(joystick_data[2] * 100)
-        self.camera.continuous_move(pan, tilt, zoom)
+        self.scheduler.stop('move')
+        future = self._submit(CommandClass.STOP, 'move', self.camera.stop_move, supersedes=('pantilt', 'zoom'))
+        self.state.update('pantilt', (0, 0), future)
+        self.state.update('zoom', (0,), future)
+
+    def _send_move(self, velocity):
+        pan  = self.capabilities.clamp('continuouspantiltmove', int(velocity[0] * 100), 0)
+        tilt = self.capabilities.clamp('continuouspantiltmove', int(velocity[1] * 100), 1)
+        zoom = self.capabilities.clamp('continuouszoommove', int(velocity[2] * 100))
+
+        send_pantilt = self._command_changed('pantilt', (pan, tilt))
+        send_zoom = self._command_changed('zoom', (zoom,))
+        if not (send_pantilt or send_zoom):
+            self.stats['suppressed'] += 1
+            return []
+
+        # Pan / tilt and zoom go in separate commands, so an update to one
+        # never supersedes a pending update to the other
+        futures = []
+        if send_pantilt:
+            future = self._submit(CommandClass.MOTION, 'pantilt', self.camera.continuous_move, pan, tilt, None)
+            self.stats['sent'] += 1
+            self.state.update('pantilt', (pan, tilt), future)
+            futures.append(future)
+        if send_zoom:
+            future = self._submit(CommandClass.MOTION, 'zoom', self.camera.continuous_move, None, None, zoom)
+            self.stats['sent'] += 1
+            self.state.update('zoom', (zoom,), future)
+            futures.append(future)
+        return futures
+
+    def _anticipate(self, joystick_data, timestamp):
+        # Projects axes heading back to centre forward by the time a command
+        # takes to reach the camera. Returns None once the stick is being let
+        # go and every axis will be centred by then, and after that for as
+        # long as the stick keeps returning.
+        last, self._last_stick = self._last_stick, (timestamp, joystick_data)
+        latency = self.dispatcher.expected_latency(CommandClass.MOTION)
+        if last is None or latency is None or self.motion_lead <= 0 or timestamp <= last[0]:
+            return joystick_data
+
+        lead = self.motion_lead * latency
+        dt = timestamp - last[0]
+        target = []
+        returning = True
+        released = True
+        for new, old in zip(joystick_data, last[1]):
+            rate = (new - old) / dt
+            if new * rate < 0:
+                projected = new + rate * lead
+                target.append(projected if projected * new > 0 else 0.0)
+                released = released and target[-1] == 0.0 and abs(rate) >= RELEASE_RATE
+            else:
+                target.append(new)
+                returning = returning and new == 0.0
+                released = released and new == 0.0
+        if released or (self._stopped_early and returning):
+            return None
+        return tuple(target)
+
+    def _update_move(self, joystick_data, timestamp):
+        target = self._anticipate(joystick_data, timestamp)
+        if target is None:
+            if not self._stopped_early:
+                self._stopped_early = True
+                self.stats['early_stops'] += 1
+                self._stop_move()
+            return
+        self._stopped_early = False
+        self.scheduler.set_target('move', target)
 
     def _start_focus(self):
-        self.camera.auto_focus('off')
+        if not self.capabilities.supports('autofocus'):
+            return
+        self._set_mode('autofocus', 'off', 'autofocus', self.camera.auto_focus, 'off')
 
     def _stop_focus(self):
-        self.camera.stop_focus()
+        self.scheduler.stop('focus')
+        future = self._submit(CommandClass.STOP, 'focus', self.camera.stop_focus)
+        self.state.update('focus', (0,), future)
 
     def _reset_focus(self):
-        self.camera.auto_focus('on')
+        if not self.capabilities.supports('autofocus'):
+            return
+        self._set_mode('autofocus', 'on', 'autofocus', self.camera.auto_focus, 'on')
+
+    def _send_focus(self, velocity):
+        focus = self.capabilities.clamp('continuousfocusmove', int(velocity[0] * 100))
+        if not self._command_changed('focus', (focus,)):
+            self.stats['suppressed'] += 1
+            return []
+
+        future = self._submit(CommandClass.MOTION, 'focus', self.camera.continuous_focus, focus)
+        self.stats['sent'] += 1
+        self.state.update('focus', (focus,), future)
+        return [future]
 
     def _update_focus(self, joystick_data):
-        focus = int(joystick_data[2] * joystick_data[2] * joystick_data[2] * 100)
-        self.camera.continuous_focus(focus)
+        focus = joystick_data[2] * joystick_data[2] * joystick_data[2]
+        self.scheduler.set_target('focus', (focus,))
 
     def _handle_button_press(self, event: Event):
         if event.button is Buttons.J1:
@@ -127,20 +364,16 @@ class PtzCamera(object):
 
         if   value == (Buttons.J1, Buttons.L):
             logging.info('Settings camera speed to 25%')
-            self.speed = 25
-            self._save_settings()
+            self._set_speed(25)
         elif value == (Buttons.J2, Buttons.L):
             logging.info('Settings camera speed to 50%')
-            self.speed = 50
-            self._save_settings()
+            self._set_speed(50)
         elif value == (Buttons.J3, Buttons.L):
             logging.info('Settings camera speed to 75%')
-            self.speed = 75
-            self._save_settings()
+            self._set_speed(75)
         elif value == (Buttons.J4, Buttons.L):
             logging.info('Settings camera speed to 100%')
-            self.speed = 100
-            self._save_settings()
+            self._set_speed(100)
         elif value == (Buttons.J1, Buttons.R):
             logging.info('Setting preset "J1"')
             self._set_preset('J1')
@@ -178,16 +411,49 @@ class PtzCamera(object):
         elif event.type is Events.BTN_HOLD:
             self._handle_button_hold(event)
 
+    def _dispatcher_stalled(self):
+        # Watchdog restart, on its thread
+        self._stalled = True
+
     def close(self):
+        watchdog.unregister(self._heartbeat)
+        self.scheduler.shutdown()
+        self.scheduler.join()
+        self.dispatcher.shutdown()
+        self.dispatcher.join(0 if self._stalled else CLOSE_TIMEOUT)
+        if self.dispatcher.is_alive():
+            logging.error('PtzCamera: command dispatcher is stuck in a request, abandoning it')
+            self.dispatcher.abandon()
         self.camera.close()
+        logging.info('PtzCamera: sent %d continuous commands, suppressed %d, skipped %d unchanged modes',
+                     self.stats['sent'], self.stats['suppressed'], self.stats['unchanged'])
+        self.dispatcher.log_stats()
+
+    def poll(self):
+        # Surface errors raised while sending scheduled or queued commands.
+        # After an error the camera's state is not known any more.
+        try:
+            if self._stalled:
+                raise CameraError('command dispatcher stalled')
+            self.scheduler.check()
+            self.dispatcher.check()
+        except Exception:
+            self.state.invalidate()
+            raise
 
     def handle_event(self, event: Event):
         # Check for camera pan/tilt/zoom
         if event.type is Events.MOVE_START:
             self.moving = True
+            self._last_stick = None
+            self._stopped_early = False
         elif event.type is Events.MOVE_END:
             self.moving = False
-            self._stop_move()
+            # Nothing to do if the camera was stopped early and the stop went
+            # through, the mirror forgets the stop if it failed
+            if not (self._stopped_early and not self.state.differs('pantilt', (0, 0)) and
+                    not self.state.differs('zoom', (0,))):
+                self._stop_move()
 
         # Check for camera focus
         if event.type is Events.FOCUS_START:
@@ -199,7 +465,7 @@ class PtzCamera(object):
 
         if self.moving:
             if event.type is Events.MOVE_UPDATE:
-                self._update_move(event.joystick)
+                self._update_move(event.joystick, event.timestamp)
         elif self.focus:
             if event.type is Events.FOCUS_UPDATE:
                 self._update_focus(event.joystick)
@@ -5,7 +5,8 @@
 # Copyright (c) 2022 Mark Whiting
 #
 # This module provides the PtzController class. This class reads the state of
-# an AXIS T8311 Joystick and generates events for the PtzCamera class.
+# an AXIS T8311 Joystick and generates events for the PtzCamera class. The
+# joystick can optionally be read in a separate process (see HIDProcess.py).
 ################################################################################
 
 import os
@@ -15,6 +16,12 @@ from enum import Enum, unique, auto
 from dataclasses import dataclass
 from collections import namedtuple
 
+from .profiling import profiler
+from .metrics import metrics
+from .SessionRecorder import recorder
+from .NetworkInput import InputArbiter
+from .HIDProcess import HIDProcess
+
 if os.name == 'nt':
     from .hid import Device as HIDDevice
     from .hid import HIDException
@@ -66,7 +73,8 @@ Event = namedtuple('Event', ['type', 'button', 'modifier', 'joystick', 'timestam
 
 # Controller class
 class PtzController(object):
-    def __init__(self, vid : int, pid : int, hold_time : float = 2.0):
+    def __init__(self, vid : int, pid : int, hold_time : float = 2.0, remote = None,
+                 hid_process : bool = False, deadzone : tuple = (0.1, 0.1, 0.15), device = None):
         # Define the button / modifier relationships
         self.buttons = {
             Buttons.J1 : ButtonData(Buttons.J1, [Buttons.L, Buttons.R], ButtonState.IDLE, None, 0.0),
@@ -77,13 +85,29 @@ class PtzController(object):
             Buttons.R  : ButtonData(Buttons.R, [], ButtonState.IDLE, None, 0.0)
         }
 
-        # Open the controller HID device
-        self.hid_device = HIDDevice(vid, pid)
+        # Open the controller HID device, merged with any remote input. device
+        # replaces the platform's HID device class, e.g. to replay reports.
+        device = device or HIDDevice
+        if hid_process:
+            self.hid_device = HIDProcess(vid, pid, device)
+        else:
+            self.hid_device = device(vid, pid)
+        if remote is not None:
+            self.hid_device = InputArbiter(self.hid_device, remote, self._report_idle)
+
+        # Reports are read into one buffer where the device supports it
+        self._report = bytearray(4)
+        self._readinto = getattr(self.hid_device, 'readinto', None)
 
         # Set initial joystick state
         self.min_hold_time = hold_time
+        self.deadzone = deadzone
         self.last_joystick_data = (0.0, 0.0, 0.0)
 
+        # Time of the report being processed. A HIDProcess stamps reports as
+        # they are read, otherwise they are stamped here.
+        self.now = time.monotonic()
+
     def __enter__(self):
         return self
 
@@ -94,8 +118,11 @@ class PtzController(object):
         self.hid_device.close()
 
     # Button Handling
-    def _read_hid_data(self):
-        return self.hid_device.read(4)
+    def _read_hid_data(self, timeout=None):
+        if self._readinto is None:
+            return self.hid_device.read(4, timeout)
+        size = self._readinto(self._report, timeout)
+        return self._report if size == len(self._report) else bytes(self._report[:size])
 
     def _btn_reset_state(self, button):
         button.state = ButtonState.IDLE
@@ -105,7 +132,7 @@ class PtzController(object):
     def _btn_idle_state(self, button, data):
         if (data & button.type.value):
             button.state = ButtonState.PRESSED
-            button.pressed_timestamp = time.monotonic()
+            button.pressed_timestamp = self.now
             for modifier in button.modifiers:
                 if self.buttons[modifier].state in [ButtonState.PRESSED, ButtonState.MODIFIER]:
                     button.active_modifier = modifier
@@ -114,13 +141,13 @@ class PtzController(object):
 
     def _btn_pressed_state(self, button, data):
         if (data & button.type.value):
-            hold_time = time.monotonic() - button.pressed_timestamp
+            hold_time = self.now - button.pressed_timestamp
             if hold_time >= self.min_hold_time:
                 button.state = ButtonState.INACTIVE
-                return [Event(Events.BTN_HOLD, button.type, button.active_modifier, None, time.monotonic())]
+                return [Event(Events.BTN_HOLD, button.type, button.active_modifier, None, self.now)]
         else:
             event_type = Events.BTN_PRESS if button.active_modifier is None else Events.BTN_PRESS_WITH_MODIFIER
-            ret = Event(event_type, button.type, button.active_modifier, None, time.monotonic())
+            ret = Event(event_type, button.type, button.active_modifier, None, self.now)
             self._btn_reset_state(button)
             return [ret]
         return []
@@ -173,11 +200,14 @@ class PtzController(object):
         return value
 
     def _map_joystick(self, data):
-        pan = self._map_range(data[0], 0, 255, 0.1, False)
-        tilt = self._map_range(data[1], 0, 255, 0.1, True)
-        zoom = self._map_range(data[2], 0, 255, 0.15, False)
+        pan = self._map_range(data[0], 0, 255, self.deadzone[0], False)
+        tilt = self._map_range(data[1], 0, 255, self.deadzone[1], True)
+        zoom = self._map_range(data[2], 0, 255, self.deadzone[2], False)
         return (pan, tilt, zoom)
 
+    def _report_idle(self, report):
+        return report[3] == 0 and self._map_joystick(report[:3]) == (0.0, 0.0, 0.0)
+
     def _process_joystick(self, data):
         joystick_data = self._map_joystick(data)
 
@@ -192,18 +222,40 @@ class PtzController(object):
 
             if start:
                 event_type = Events.FOCUS_START if modifier else Events.MOVE_START
-                return [Event(event_type, None, None, self.last_joystick_data, time.monotonic())]
+                return [Event(event_type, None, None, self.last_joystick_data, self.now)]
             elif stop:
                 event_type = Events.FOCUS_END if modifier else Events.MOVE_END
-                return [Event(event_type, None, None, self.last_joystick_data, time.monotonic())]
+                return [Event(event_type, None, None, self.last_joystick_data, self.now)]
             else:
                 event_type = Events.FOCUS_UPDATE if modifier else Events.MOVE_UPDATE
-                return [Event(event_type, None, None, self.last_joystick_data, time.monotonic())]
+                return [Event(event_type, None, None, self.last_joystick_data, self.now)]
+
+        return []
 
+    def filenos(self):
+        # File descriptors that become readable when update() has a report to
+        # process, or an empty list if the device can only be read blocking
+        if hasattr(self.hid_device, 'filenos'):
+            return self.hid_device.filenos()
+        if hasattr(self.hid_device, 'fileno'):
+            return [self.hid_device.fileno()]
         return []
 
-    def update(self):
-        hid_data = self._read_hid_data()
+    @property
+    def poll_interval(self):
+        # Longest time update() may go uncalled while no report arrives
+        return getattr(self.hid_device, 'poll_interval', None)
+
+    def update(self, timeout=None):
+        # timeout is in milliseconds as for the HID device, no events are
+        # returned if no report arrived in time
+        with profiler.stage('hid_read'):
+            hid_data = self._read_hid_data(timeout)
+        if not hid_data:
+            return []
+        self.now = getattr(self.hid_device, 'report_time', None) or time.monotonic()
+        metrics.inc('ptz_hid_reports_total')
+        recorder.report(self.now, hid_data)
 
         events = []
         events.extend(self._process_buttons(hid_data[3]))
@@ -0,0 +1,63 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# RttEstimator.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the RttEstimator class, which keeps a running estimate
+# of a camera's request round trip time the way TCP does (RFC 6298): a smoothed
+# RTT and its mean deviation give a retransmission timeout (RTO), which is
+# doubled after each timeout until a new round trip is measured. A
+# RequestPolicy turns the RTO into the timeout for one kind of request, so a
+# motion update that will soon be superseded gives up quickly while saving a
+# preset is allowed far longer.
+################################################################################
+
+import threading
+
+from collections import namedtuple
+
+__all__ = [ 'RequestPolicy', 'RttEstimator' ]
+
+# factor: the timeout is factor * RTO, within min_timeout and max_timeout (s)
+# retries: times a request is repeated after a timeout or connection error,
+#          only for requests that are safe to repeat
+# measure: whether the reply time is a round trip sample, false for requests
+#          the camera takes a while to carry out
+RequestPolicy = namedtuple('RequestPolicy', ['name', 'factor', 'min_timeout', 'max_timeout', 'retries',
+                                             'measure'])
+
+class RttEstimator(object):
+    ALPHA = 1.0 / 8.0
+    BETA = 1.0 / 4.0
+    K = 4.0
+    MAX_BACKOFF = 8
+
+    def __init__(self, initial_rto: float = 1.0, fixed: float = None):
+        # fixed replaces the estimate with a constant timeout for every request
+        self.fixed = fixed
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self._backoff = 1
+        self._lock = threading.Lock()
+
+    def sample(self, rtt: float):
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2.0
+            else:
+                self.rttvar = (1.0 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+                self.srtt = (1.0 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+            self.rto = self.srtt + self.K * self.rttvar
+            self._backoff = 1
+
+    def timed_out(self):
+        with self._lock:
+            self._backoff = min(self._backoff * 2, self.MAX_BACKOFF)
+
+    def timeout(self, policy: RequestPolicy):
+        if self.fixed is not None:
+            return self.fixed
+        return min(policy.max_timeout, max(policy.min_timeout, policy.factor * self.rto * self._backoff))
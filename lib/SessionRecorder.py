@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# SessionRecorder.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module records joystick reports and VAPIX camera commands to a session
+# file for offline analysis with analyse-session.py. Every entry is a fixed
+# size little-endian record, so a recording can be loaded straight into a
+# NumPy structured array:
+#
+#   time      f8   monotonic time of the report / when the request was sent
+#   duration  f4   request to response time (s), 0 for reports
+#   kind      u1   KIND_REPORT or KIND_COMMAND
+#   command   u1   index into COMMANDS (COMMAND_OTHER if not listed)
+#   status    u2   HTTP status, 0 if the request raised
+#   report    4u1  T8311 report (pan, tilt, zoom, buttons)
+#
+# Recording is off until start() is called. The module-level recorder is
+# shared by the joystick and camera code.
+################################################################################
+
+import os
+import time
+import struct
+import logging
+import threading
+
+__all__ = [ 'SessionRecorder', 'recorder', 'RECORD', 'COMMANDS', 'KIND_REPORT', 'KIND_COMMAND' ]
+
+RECORD = struct.Struct('<dfBBH4s4x')
+KIND_REPORT = 0
+KIND_COMMAND = 1
+
+# New names go at the end, so recordings keep their meaning
+COMMANDS = ( 'continuouspantiltmove', 'continuouszoommove', 'continuousfocusmove', 'move',
+             'autofocus', 'gotoserverpresetname', 'setserverpresetname', 'speed', 'query',
+             'info', 'action', 'stopmove', 'stopfocus' )
+COMMAND_OTHER = 255
+_COMMAND_CODES = { name : code for code, name in enumerate(COMMANDS) }
+
+_NO_REPORT = bytes(4)
+
+class SessionRecorder(object):
+    def __init__(self):
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def start(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, time.strftime('session-%Y%m%d-%H%M%S.ptzrec'))
+        with self._lock:
+            self._file = open(path, 'ab')
+            self.path = path
+        logging.info('SessionRecorder: recording to "%s"', path)
+
+    def stop(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                logging.info('SessionRecorder: closed "%s"', self.path)
+            self._file = None
+
+    def _write(self, record):
+        # Writes from the joystick and dispatcher threads share the file
+        with self._lock:
+            if self._file is not None:
+                self._file.write(record)
+
+    def report(self, timestamp: float, report):
+        if self._file is None:
+            return
+        self._write(RECORD.pack(timestamp, 0.0, KIND_REPORT, 0, 0, bytes(report[:4])))
+
+    def command(self, name: str, start: float, duration: float, status: int):
+        if self._file is None:
+            return
+        self._write(RECORD.pack(start, duration, KIND_COMMAND, _COMMAND_CODES.get(name, COMMAND_OTHER),
+                                status, _NO_REPORT))
+
+recorder = SessionRecorder()
@@ -0,0 +1,201 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# Watchdog.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the stall watchdog. Components that must keep running
+# (the event loop, each camera's command dispatcher, a blocking HID reader)
+# register with it and beat their Heartbeat at least every
+# HEARTBEAT_INTERVAL, idle or not. A component that has not beaten for the
+# timeout is stalled: the stacks of every thread are logged and the
+# component's restart callback is called. If it has still not beaten after the
+# grace time the process exits, so the supervisor starts it again, rather than
+# running on with a dead joystick.
+#
+# A stalled event loop cannot be restarted from outside, so its restart
+# interrupts the main thread with a signal whose handler raises StallError in
+# whatever callback is blocking it.
+################################################################################
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import threading
+import traceback
+import faulthandler
+
+from .metrics import metrics
+
+__all__ = [ 'StallError', 'Heartbeat', 'Watchdog', 'watchdog', 'HEARTBEAT_INTERVAL' ]
+
+# Longest time (s) a healthy component may go between beats
+HEARTBEAT_INTERVAL = 0.5
+
+# Exit status when a stalled component did not recover, and the time (s)
+# allowed for flushing the log first
+EXIT_STATUS = 70
+EXIT_FLUSH_TIMEOUT = 2.0
+
+class StallError(Exception):
+    pass
+
+class Heartbeat(object):
+    # Returned by Watchdog.register, the component calls beat()
+    def __init__(self, watchdog, name, restart, stalled_at=None, timeout=None):
+        self.name = name
+        self.restart = restart
+        self.timeout = timeout
+        self.last_beat = time.monotonic()
+        self.stalled_at = stalled_at
+        self._watchdog = watchdog
+
+    def beat(self):
+        self.last_beat = time.monotonic()
+        if self.stalled_at is not None:
+            self._watchdog._recovered(self)
+
+class Watchdog(object):
+    def __init__(self):
+        self.timeout = None
+        self.grace = None
+        self.stats = { 'stalls' : 0, 'recoveries' : 0 }
+        # Called before the process exits, e.g. to flush the log
+        self.before_exit = None
+
+        self._components = {}
+        self._restarting = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._shutdown = threading.Event()
+        self._signum = None
+        self._main_thread = None
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self, timeout: float, grace: float):
+        self.timeout = timeout
+        self.grace = grace
+        self._shutdown.clear()
+        self._thread = threading.Thread(target=self._run, name='Watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._shutdown.set()
+            self._thread.join()
+            self._thread = None
+
+    def register(self, name: str, restart=None, timeout: float = None):
+        """
+        Watches the component called name until unregistered. restart is
+        called on the watchdog thread when the component stalls, None goes
+        straight to exiting. timeout is the time (s) the component may
+        legitimately go without beating, e.g. in a slow camera request, and
+        only applies if it is longer than the watchdog's. A component
+        registered again while being restarted, e.g. a reconnected camera's
+        new dispatcher, must beat within the grace time of the stall.
+        """
+        with self._lock:
+            previous = self._components.get(name)
+            stalled_at = self._restarting.pop(name, previous.stalled_at if previous is not None else None)
+            heartbeat = Heartbeat(self, name, restart, stalled_at, timeout)
+            self._components[name] = heartbeat
+        return heartbeat
+
+    def unregister(self, heartbeat: Heartbeat):
+        with self._lock:
+            # A replaced component leaves its successor alone
+            if self._components.get(heartbeat.name) is not heartbeat:
+                return
+            del self._components[heartbeat.name]
+            # The stall passes to its replacement, the beats of a stuck thread
+            # that returns later do not count
+            if heartbeat.stalled_at is not None:
+                self._restarting[heartbeat.name], heartbeat.stalled_at = heartbeat.stalled_at, None
+
+    def _recovered(self, heartbeat):
+        with self._lock:
+            stalled_at, heartbeat.stalled_at = heartbeat.stalled_at, None
+        if stalled_at is None:
+            return
+        self.stats['recoveries'] += 1
+        metrics.inc('ptz_watchdog_recoveries_total', component=heartbeat.name)
+        logging.warning('Watchdog: %s recovered %.1f s after the stall was detected', heartbeat.name,
+                        heartbeat.last_beat - stalled_at)
+
+    def install_signal_handler(self, signum=signal.SIGUSR2):
+        # Must be called on the main thread, which runs the event loop
+        self._signum = signum
+        self._main_thread = threading.main_thread().ident
+        signal.signal(signum, self._raise_stall)
+
+    def interrupt_main_thread(self):
+        # A restart callback for components running on the main thread
+        signal.pthread_kill(self._main_thread, self._signum)
+
+    def _raise_stall(self, signum, frame):
+        raise StallError('interrupted by the watchdog')
+
+    async def watch_loop(self, name: str = 'event loop'):
+        # Task beating for the event loop on the main thread until cancelled
+        heartbeat = self.register(name, self.interrupt_main_thread)
+        try:
+            while True:
+                heartbeat.beat()
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+        finally:
+            self.unregister(heartbeat)
+
+    def _run(self):
+        while not self._shutdown.wait(min(HEARTBEAT_INTERVAL, self.timeout / 4.0)):
+            now = time.monotonic()
+            with self._lock:
+                components = list(self._components.values())
+            for heartbeat in components:
+                stalled_at = heartbeat.stalled_at
+                if stalled_at is None:
+                    if now - heartbeat.last_beat > max(self.timeout, heartbeat.timeout or 0.0):
+                        self._stalled(heartbeat, now)
+                elif now - stalled_at > self.grace or heartbeat.restart is None:
+                    self._escalate(heartbeat)
+
+    def _stalled(self, heartbeat, now):
+        heartbeat.stalled_at = now
+        self.stats['stalls'] += 1
+        metrics.inc('ptz_watchdog_stalls_total', component=heartbeat.name)
+        logging.error('Watchdog: %s stalled, no heartbeat for %.1f s', heartbeat.name, now - heartbeat.last_beat)
+        self._log_stacks()
+        if heartbeat.restart is None:
+            return
+
+        logging.warning('Watchdog: restarting %s', heartbeat.name)
+        try:
+            heartbeat.restart()
+        except Exception as e:
+            logging.exception('Watchdog: restarting %s failed: %s', heartbeat.name, repr(e))
+
+    def _log_stacks(self):
+        names = { thread.ident : thread.name for thread in threading.enumerate() }
+        for ident, frame in sys._current_frames().items():
+            stack = ''.join(traceback.format_stack(frame)).rstrip()
+            logging.error('Watchdog: stack of thread "%s":\n%s', names.get(ident, ident), stack)
+
+    def _escalate(self, heartbeat):
+        logging.critical('Watchdog: %s did not recover, exiting', heartbeat.name)
+        if self.before_exit is not None:
+            # On a thread, as whatever is stuck may hold up the flush too
+            flush = threading.Thread(target=self.before_exit, name='WatchdogFlush', daemon=True)
+            flush.start()
+            flush.join(EXIT_FLUSH_TIMEOUT)
+        # The log may be the thing that is stuck, so also write the stacks
+        # straight to stderr
+        faulthandler.dump_traceback(all_threads=True)
+        os._exit(EXIT_STATUS)
+
+watchdog = Watchdog()
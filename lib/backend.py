@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# backend.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module defines the interface PtzCamera uses to drive a camera. Each
+# camera control protocol (VAPIX over HTTP, VISCA over IP) implements it.
+################################################################################
+
+from abc import ABC, abstractmethod
+
+__all__ = [ 'CameraError', 'CameraAuthError', 'CameraBackend' ]
+
+
+class CameraError(Exception):
+    pass
+
+
+class CameraAuthError(CameraError):
+    pass
+
+
+class CameraBackend(ABC):
+    """
+    Camera control operations used by PtzCamera. Speeds are integers in the
+    range -100 to 100, and None leaves that channel unchanged.
+    """
+
+    @abstractmethod
+    def continuous_move(self, pan: int = None, tilt: int = None, zoom: int = None):
+        pass
+
+    @abstractmethod
+    def stop_move(self):
+        pass
+
+    @abstractmethod
+    def continuous_focus(self, focus: int = None):
+        pass
+
+    @abstractmethod
+    def stop_focus(self):
+        pass
+
+    @abstractmethod
+    def auto_focus(self, focus: str = None):
+        pass
+
+    @abstractmethod
+    def go_home_position(self, speed: int = None):
+        pass
+
+    @abstractmethod
+    def go_to_server_preset_name(self, name: str = None, speed: int = None):
+        pass
+
+    @abstractmethod
+    def set_server_preset_name(self, name: str = None):
+        pass
+
+    @abstractmethod
+    def set_speed(self, speed: int = None):
+        pass
+
+    @abstractmethod
+    def get_speed(self):
+        pass
+
+    @abstractmethod
+    def get_ptz(self):
+        pass
+
+    @abstractmethod
+    def get_capabilities(self, cache=None):
+        """
+        Returns the CameraCapabilities of the camera, using and filling the
+        CapabilityCache for anything that only depends on the model.
+        """
+        pass
+
+    def longest_request(self):
+        """
+        Returns the longest time (s) one operation can legitimately block its
+        caller, from the backend's timeouts and retries, or None if unknown.
+        """
+        return None
+
+    @abstractmethod
+    def close(self):
+        pass
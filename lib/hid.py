@@ -9,6 +9,7 @@
 # https://github.com/apmorton/pyhidapi
 ################################################################################
 import os
+import time
 import ctypes
 import atexit
 
@@ -110,7 +111,16 @@ hidapi.hid_error.argtypes = [ctypes.c_void_p]
 hidapi.hid_error.restype = ctypes.c_wchar_p
 
 
-def enumerate(vid=0, pid=0):
+# Enumeration results by (vid, pid), as (time, list of device dicts)
+_enumerate_cache = {}
+
+def enumerate(vid=0, pid=0, max_age=1.0):
+    # Enumerating walks the whole bus, so results are reused for max_age
+    # seconds. Pass max_age=0 to force a fresh enumeration.
+    cached = _enumerate_cache.get((vid, pid))
+    if cached is not None and time.monotonic() - cached[0] < max_age:
+        return list(cached[1])
+
     ret = []
     info = hidapi.hid_enumerate(vid, pid)
     c = info
@@ -121,7 +131,8 @@ def enumerate(vid=0, pid=0):
 
     hidapi.hid_free_enumeration(info)
 
-    return ret
+    _enumerate_cache[(vid, pid)] = (time.monotonic(), ret)
+    return list(ret)
 
 
 class Device(object):
@@ -139,6 +150,12 @@ class Device(object):
         if not self.__dev:
             raise HIDException('unable to open device')
 
+        # Reused by read() and readinto() so reading a report allocates as
+        # little as possible
+        self.__read_buffer = ctypes.create_string_buffer(64)
+        self.__target = None
+        self.__target_buffer = None
+
     def __enter__(self):
         return self
 
@@ -164,16 +181,37 @@ class Device(object):
     def write(self, data):
         return self.__hidcall(hidapi.hid_write, self.__dev, data, len(data))
 
-    def read(self, size, timeout=None):
-        data = ctypes.create_string_buffer(size)
+    def __read(self, data, size, timeout):
+        if not self.__dev:
+            raise HIDException('device closed')
 
+        # timeout is in milliseconds; hid_read() honours the nonblocking flag
         if timeout is None:
-            size = self.__hidcall(hidapi.hid_read, self.__dev, data, size)
+            ret = hidapi.hid_read(self.__dev, data, size)
         else:
-            size = self.__hidcall(
-                hidapi.hid_read_timeout, self.__dev, data, size, timeout)
+            ret = hidapi.hid_read_timeout(self.__dev, data, size, timeout)
 
-        return data.raw[:size]
+        if ret == -1:
+            raise HIDException(hidapi.hid_error(self.__dev))
+        return ret
+
+    def read(self, size, timeout=None):
+        # Returns b'' on timeout or when nonblocking and no report is waiting
+        if size > len(self.__read_buffer):
+            self.__read_buffer = ctypes.create_string_buffer(size)
+        size = self.__read(self.__read_buffer, size, timeout)
+        return ctypes.string_at(self.__read_buffer, size)
+
+    def readinto(self, buffer, timeout=None):
+        """
+        Reads a report into a writable buffer such as a bytearray and returns
+        the number of bytes read (0 on timeout). Reading repeatedly into the
+        same buffer does not allocate.
+        """
+        if buffer is not self.__target:
+            self.__target_buffer = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+            self.__target = buffer
+        return self.__read(self.__target_buffer, len(buffer), timeout)
 
     def send_feature_report(self, data):
         return self.__hidcall(hidapi.hid_send_feature_report,
@@ -193,6 +231,8 @@ class Device(object):
         if self.__dev:
             hidapi.hid_close(self.__dev)
             self.__dev = None
+        self.__target = None
+        self.__target_buffer = None
 
     @property
     def nonblocking(self):
@@ -9,6 +9,8 @@
 # It has been tested on a Raspberry Pi.
 ################################################################################
 
+import os
+import select
 import pathlib
 
 sysfs_base = pathlib.Path('/', 'sys', 'class', 'hidraw')
@@ -49,7 +51,8 @@ def parse_instance(uevent_data):
 
 def match_device(path, vid, pid, instance):
     uevent_path = pathlib.Path(path, 'device', 'uevent')
-    uevent_data = open(uevent_path, 'r').read()
+    with open(uevent_path, 'r') as f:
+        uevent_data = f.read()
 
     if (vid, pid) != parse_vid_pid(uevent_data):
         return False
@@ -74,19 +77,68 @@ class Device(object):
         else:
             raise HIDException('must specify vid/pid')
 
+        if self.hid_path is None:
+            raise HIDException('unable to find device')
+
+        try:
+            self.fd = os.open(self.hid_path, os.O_RDONLY)
+        except OSError:
+            raise HIDException('unable to open device')
+        self._nonblocking = 0
+
     def __enter__(self):
         return self
 
-    def __exit__(self):
-        pass
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
 
     def close(self):
-        pass
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def nonblocking(self):
+        return self._nonblocking
+
+    @nonblocking.setter
+    def nonblocking(self, value):
+        os.set_blocking(self.fd, not value)
+        self._nonblocking = value
+
+    def _wait(self, timeout):
+        # timeout is in milliseconds as in pyhidapi
+        if self.fd is None:
+            raise HIDException('device closed')
+        if timeout is None:
+            return True
+        readable, _, _ = select.select([self.fd], [], [], timeout / 1000.0)
+        return bool(readable)
 
     def read(self, size, timeout=None):
+        # Returns b'' on timeout or when nonblocking and no report is waiting
         try:
-            data = open(self.hid_path, 'rb').read(size)
-        except:
+            if not self._wait(timeout):
+                return b''
+            data = os.read(self.fd, size)
+        except BlockingIOError:
+            return b''
+        except OSError:
             raise HIDException('error reading hid device')
         return data
 
+    def readinto(self, buffer, timeout=None):
+        # Reads a report into a writable buffer, returns the number of bytes
+        # read (0 on timeout)
+        try:
+            if not self._wait(timeout):
+                return 0
+            return os.readv(self.fd, [buffer])
+        except BlockingIOError:
+            return 0
+        except OSError:
+            raise HIDException('error reading hid device')
+
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# log.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module sets up logging for the messiah-ptz-controller.py program. Log
+# records are handed to a queue and formatted / written by a listener thread,
+# so logging costs the camera control path only a queue put. It also provides
+# LogAggregator for summarising high-rate messages such as camera commands.
+################################################################################
+
+import sys
+import time
+import queue
+import logging
+import threading
+
+from logging.handlers import QueueHandler, QueueListener
+
+__all__ = [ 'CompactFormatter', 'LogAggregator', 'start_logging' ]
+
+class ThreadQueueHandler(QueueHandler):
+    # The listener runs in this process, so records can be queued as-is and
+    # message formatting left to the listener thread
+    def prepare(self, record):
+        return record
+
+_ESCAPES = str.maketrans({ '\\' : '\\\\', '"' : '\\"', '\n' : '\\n', '\r' : '\\r' })
+
+def _quote(text: str):
+    # A logfmt value, so quotes and line breaks in it cannot end the field or
+    # the line
+    return '"%s"' % text.translate(_ESCAPES)
+
+class CompactFormatter(logging.Formatter):
+    # One logfmt style line per record, e.g.
+    # ts=2022-05-01T10:00:00.123 level=info thread=CameraThread msg="..."
+    def format(self, record):
+        ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+        line = 'ts=%s.%03d level=%s thread=%s msg=%s' % (ts, record.msecs, record.levelname.lower(),
+                                                        record.threadName, _quote(record.getMessage()))
+        if record.exc_info:
+            line += ' exc=%s' % _quote(self.formatException(record.exc_info))
+        return line
+
+class LogAggregator(object):
+    """
+    Counts repetitive messages by key and logs a single summary line at most
+    once per interval instead of one line per message.
+    """
+
+    def __init__(self, name: str, interval: float = 10.0, level: int = logging.INFO):
+        self.name = name
+        self.interval = interval
+        self.level = level
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def count(self, key: str):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if time.monotonic() - self._last_flush < self.interval:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._last_flush = time.monotonic()
+        if counts:
+            logging.log(self.level, '%s: %s', self.name,
+                        ' '.join('%s=%d' % (key, value) for key, value in sorted(counts.items())))
+
+def start_logging(level: str = 'INFO', stream=sys.stderr):
+    # Records are formatted and written on the listener thread; the caller
+    # must stop() the returned listener to flush the queue on exit
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(CompactFormatter())
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(ThreadQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
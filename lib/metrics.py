@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# metrics.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides process metrics in the Prometheus text format, served
+# on a localhost HTTP port. Counters and histograms are kept per thread so the
+# hot path only touches a dict owned by the calling thread; the per-thread
+# values are summed when the endpoint is scraped. The values of threads that
+# have exited are folded together when a new thread registers, so threads
+# recreated on every reconnect do not grow the list. Rates (reports/sec,
+# requests/sec) are derived from the counters by the scraper.
+################################################################################
+
+import bisect
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__all__ = [ 'Metrics', 'metrics' ]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, value) for key, value in labels) + '}'
+
+def _merge(totals, values):
+    # Adds one thread's (counters, histograms) to totals
+    for key, value in dict(values[0]).items():
+        totals[0][key] = totals[0].get(key, 0) + value
+    for name, data in dict(values[1]).items():
+        total = totals[1].setdefault(name, [0] * len(data))
+        for i, value in enumerate(list(data)):
+            total[i] += value
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class Metrics(object):
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_values = []
+        self._retired = ({}, {})
+        self._histograms = {}
+        self._gauges = {}
+        self._server = None
+
+    def _values(self):
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = self._local.values = ({}, {})
+            with self._lock:
+                live = []
+                for thread, thread_values in self._thread_values:
+                    if thread.is_alive():
+                        live.append((thread, thread_values))
+                    else:
+                        _merge(self._retired, thread_values)
+                live.append((threading.current_thread(), values))
+                self._thread_values = live
+        return values
+
+    def inc(self, name: str, amount: int = 1, **labels):
+        counters = self._values()[0]
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + amount
+
+    def histogram(self, name: str, buckets: tuple = DEFAULT_BUCKETS):
+        self._histograms[name] = tuple(buckets)
+
+    def observe(self, name: str, value: float):
+        histograms = self._values()[1]
+        data = histograms.get(name)
+        if data is None:
+            buckets = self._histograms.setdefault(name, DEFAULT_BUCKETS)
+            data = histograms[name] = [0] * (len(buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self._histograms[name], value)] += 1
+        data[-1] += value
+
+    def gauge(self, name: str, fn):
+        # fn is called on scrape and returns the current value
+        self._gauges[name] = fn
+
+    def render(self):
+        totals = ({}, {})
+        with self._lock:
+            _merge(totals, self._retired)
+            thread_values = [ values for _, values in self._thread_values ]
+        for values in thread_values:
+            _merge(totals, values)
+        counters, histograms = totals
+
+        lines = []
+        names = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in names:
+                lines.append('# TYPE %s counter' % name)
+                names.add(name)
+            lines.append('%s%s %d' % (name, _format_labels(labels), value))
+
+        for name, data in sorted(histograms.items()):
+            lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, count in zip(self._histograms[name], data):
+                cumulative += count
+                lines.append('%s_bucket{le="%g"} %d' % (name, bound, cumulative))
+            cumulative += data[-2]
+            lines.append('%s_bucket{le="+Inf"} %d' % (name, cumulative))
+            lines.append('%s_sum %f' % (name, data[-1]))
+            lines.append('%s_count %d' % (name, cumulative))
+
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logging.warning('Metrics: gauge "%s" failed: %s', name, repr(e))
+                continue
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %g' % (name, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        self._server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._server.metrics = self
+        threading.Thread(target=self._server.serve_forever, name='Metrics', daemon=True).start()
+        logging.info('Metrics: serving on http://%s:%d/metrics', host, port)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+metrics = Metrics()
@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# profiling.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides opt-in profiling of the running service. When enabled
+# (PTZ_PROFILE environment variable or SIGUSR1), threads that call sample() in
+# their loop are profiled with cProfile, tracemalloc is started, and stage
+# timers around HID reads, controller updates, event handling and HTTP requests
+# are collected. A report is written to disk every interval.
+################################################################################
+
+import os
+import time
+import pstats
+import signal
+import cProfile
+import logging
+import threading
+import tracemalloc
+import contextlib
+
+__all__ = [ 'Profiler', 'profiler' ]
+
+_NULL_STAGE = contextlib.nullcontext()
+
+class StageTimer(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, type, value, traceback):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+class Profiler(object):
+    def __init__(self, report_dir: str = 'profiles', interval: float = 60.0):
+        self.enabled = False
+        self.report_dir = report_dir
+        self.interval = interval
+
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._snapshot = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        logging.info('Profiler: enabled, writing reports to "%s" every %.0fs', self.report_dir, self.interval)
+        tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        logging.info('Profiler: disabled')
+        self.enabled = False
+        tracemalloc.stop()
+        self._snapshot = None
+
+    def toggle(self, signum=None, frame=None):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        signal.signal(signum, self.toggle)
+
+    def stage(self, name: str):
+        # Cheap no-op context manager while profiling is disabled
+        if not self.enabled:
+            return _NULL_STAGE
+        return StageTimer(self, name)
+
+    def record(self, name: str, elapsed: float):
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def sample(self):
+        # Called from the loop of each thread to be profiled. cProfile only
+        # sees the thread it was enabled on, so each thread owns its profile.
+        profile = getattr(self._local, 'profile', None)
+        if self.enabled and profile is None:
+            self._local.profile = cProfile.Profile()
+            self._local.next_report = time.monotonic() + self.interval
+            self._local.profile.enable()
+        elif profile is not None and (not self.enabled or time.monotonic() >= self._local.next_report):
+            profile.disable()
+            self._write_report(profile)
+            self._local.profile = None
+
+    def _write_stages(self, f):
+        with self._lock:
+            stages, self._stages = self._stages, {}
+
+        f.write('# Stage timers\n')
+        for name, (count, total, largest) in sorted(stages.items()):
+            f.write('%-20s count=%-8d avg=%8.3fms max=%8.3fms total=%8.3fs\n' %
+                    (name, count, 1000.0 * total / count, 1000.0 * largest, total))
+
+    def _write_memory(self, f):
+        if not tracemalloc.is_tracing():
+            return
+
+        snapshot = tracemalloc.take_snapshot()
+        if self._snapshot is None:
+            f.write('\n# Memory, top allocations\n')
+            statistics = snapshot.statistics('lineno')
+        else:
+            f.write('\n# Memory, growth since last report\n')
+            statistics = snapshot.compare_to(self._snapshot, 'lineno')
+        self._snapshot = snapshot
+
+        for stat in statistics[:25]:
+            f.write('%s\n' % stat)
+
+    def _write_report(self, profile):
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            name = 'profile-%d-%s-%s.txt' % (os.getpid(), threading.current_thread().name,
+                                              time.strftime('%Y%m%d-%H%M%S'))
+            path = os.path.join(self.report_dir, name)
+            with open(path, 'w') as f:
+                self._write_stages(f)
+                self._write_memory(f)
+                f.write('\n# CPU profile of thread "%s"\n' % threading.current_thread().name)
+                pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(40)
+            logging.info('Profiler: wrote "%s"', path)
+        except (OSError, TypeError) as e:
+            logging.error('Profiler: failed to write report: %s', repr(e))
+
+profiler = Profiler()
@@ -0,0 +1,333 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# transport.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides the HTTP transports used by CameraControl. The default
+# transport uses a requests.Session. The socket transport is a minimal HTTP/1.1
+# client over a single persistent socket with digest authentication, which
+# costs far less CPU per request on a Raspberry Pi.
+################################################################################
+
+import os
+import re
+import socket
+import hashlib
+import threading
+
+from urllib.parse import urlsplit, quote
+
+import requests
+
+__all__ = [ 'Response', 'RequestsTransport', 'SocketTransport', 'make_transport' ]
+
+# Time (s) close() waits for a request in progress
+CLOSE_TIMEOUT = 1.0
+
+# Digest algorithms by their hashlib names, and the qop options in order of
+# preference
+DIGEST_ALGORITHMS = { 'MD5' : 'md5', 'SHA-256' : 'sha256' }
+DIGEST_QOPS = ( 'auth', 'auth-int' )
+
+
+_CHALLENGE_FIELD = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s,]*))')
+
+def _parse_challenge(header: str):
+    return { key.lower() : value or token for key, value, token in _CHALLENGE_FIELD.findall(header) }
+
+
+class DigestState:
+    """
+    Client side of HTTP digest authentication for one server, computing the
+    Authorization header from the last challenge so it can be sent up front.
+    Supports the MD5 and SHA-256 algorithms, with or without -sess, and the
+    auth and auth-int qop options as well as servers offering no qop.
+    """
+
+    def __init__(self, user, password):
+        self.__user = user
+        self.__password = password
+        self.__lock = threading.Lock()
+        self.__challenge = None
+        self.__hash = None
+        self.__qop = None
+        self.__ha1 = None
+        self.__nonce_count = 0
+        self.__cnonce = None
+
+    @property
+    def ready(self):
+        return self.__challenge is not None
+
+    def update(self, header: str):
+        # Takes a WWW-Authenticate header, returns False if it is not a
+        # digest challenge this class can answer
+        if not header.lower().startswith('digest '):
+            return False
+        fields = _parse_challenge(header[len('digest '):])
+        algorithm = fields.get('algorithm', 'MD5').upper()
+        name = DIGEST_ALGORITHMS.get(algorithm[:-5] if algorithm.endswith('-SESS') else algorithm)
+        offered = [ qop.strip().lower() for qop in fields.get('qop', '').split(',') if qop.strip() ]
+        qop = next((qop for qop in DIGEST_QOPS if qop in offered), None)
+        if name is None or 'nonce' not in fields or (offered and qop is None):
+            return False
+
+        with self.__lock:
+            self.__hash = lambda text: hashlib.new(name, text.encode('utf-8')).hexdigest()
+            self.__challenge = fields
+            self.__qop = qop
+            self.__cnonce = os.urandom(8).hex()
+            self.__nonce_count = 0
+            self.__ha1 = self.__hash('%s:%s:%s' % (self.__user, fields.get('realm', ''), self.__password))
+            if algorithm.endswith('-SESS'):
+                self.__ha1 = self.__hash('%s:%s:%s' % (self.__ha1, fields['nonce'], self.__cnonce))
+        return True
+
+    def authorization(self, method: str, uri: str):
+        # Authorization header value for a request without a body
+        with self.__lock:
+            challenge = self.__challenge
+            nonce = challenge['nonce']
+            if self.__qop == 'auth-int':
+                ha2 = self.__hash('%s:%s:%s' % (method, uri, self.__hash('')))
+            else:
+                ha2 = self.__hash('%s:%s' % (method, uri))
+
+            header = 'Digest username="%s", realm="%s", nonce="%s", uri="%s"' % \
+                (self.__user, challenge.get('realm', ''), nonce, uri)
+            if self.__qop is None:
+                response = self.__hash('%s:%s:%s' % (self.__ha1, nonce, ha2))
+            else:
+                self.__nonce_count += 1
+                nc = '%08x' % self.__nonce_count
+                response = self.__hash('%s:%s:%s:%s:%s:%s' % (self.__ha1, nonce, nc, self.__cnonce,
+                                                             self.__qop, ha2))
+                header += ', qop=%s, nc=%s, cnonce="%s"' % (self.__qop, nc, self.__cnonce)
+            header += ', response="%s"' % response
+            if 'algorithm' in challenge:
+                header += ', algorithm=%s' % challenge['algorithm']
+            if 'opaque' in challenge:
+                header += ', opaque="%s"' % challenge['opaque']
+        return header
+
+
+class SharedDigestAuth(requests.auth.AuthBase):
+    """
+    Digest authentication for a requests.Session that keeps the server nonce
+    between requests and threads, so every request after the first carries an
+    Authorization header up front instead of waiting for a 401 challenge.
+    """
+
+    def __init__(self, username, password):
+        self.digest = DigestState(username, password)
+
+    def __call__(self, request):
+        if self.digest.ready:
+            request.headers['Authorization'] = self.digest.authorization(request.method, request.path_url)
+        request.register_hook('response', self.__handle_401)
+        return request
+
+    def __handle_401(self, resp, **kwargs):
+        # Answer a new challenge, e.g. for an expired nonce, once per request
+        if resp.status_code != 401 or getattr(resp.request, 'digest_retry', False):
+            return resp
+        if not self.digest.update(resp.headers.get('www-authenticate', '')):
+            return resp
+
+        resp.content
+        resp.close()
+        request = resp.request.copy()
+        request.digest_retry = True
+        request.headers['Authorization'] = self.digest.authorization(request.method, request.path_url)
+        retry = resp.connection.send(request, **kwargs)
+        retry.history.append(resp)
+        retry.request = request
+        return retry
+
+
+class RequestsTransport:
+    """
+    Transport sending requests through a requests.Session
+    """
+
+    def __init__(self, user, password):
+        self.__session = requests.Session()
+        self.__session.auth = SharedDigestAuth(user, password)
+
+    def get(self, url: str, params: dict, timeout: float):
+        return self.__session.get(url, params=params, timeout=timeout)
+
+    def close(self):
+        self.__session.close()
+
+
+class Response:
+    """
+    Minimal response object with the attributes CameraControl uses
+    """
+
+    def __init__(self, status_code: int, headers: dict, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+class SocketTransport:
+    """
+    Minimal HTTP/1.1 transport over one persistent socket per camera. Request
+    lines are built from templates cached per URL and parameter names, and
+    digest credentials are computed locally from the last server nonce.
+    Replies may be delimited by length, chunks or the connection closing.
+    """
+
+    def __init__(self, user, password):
+        self.__digest = DigestState(user, password)
+        self.__sock = None
+        self.__reader = None
+        self.__address = None
+        self.__lock = threading.Lock()
+
+        self.__templates = {}
+
+    def __connect(self, timeout):
+        self.__disconnect()
+        self.__sock = socket.create_connection(self.__address, timeout=timeout)
+        self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.__reader = self.__sock.makefile('rb')
+
+    def __disconnect(self):
+        if self.__reader is not None:
+            self.__reader.close()
+        if self.__sock is not None:
+            self.__sock.close()
+        self.__reader = None
+        self.__sock = None
+
+    def __template(self, url, keys):
+        template = self.__templates.get((url, keys))
+        if template is None:
+            parts = urlsplit(url)
+            address = (parts.hostname, parts.port or 80)
+            path = parts.path.replace('%', '%%')
+            prefix = path + '?' + '&'.join('%s=%%s' % quote(key).replace('%', '%%') for key in keys)
+            header = 'Host: %s\r\nConnection: keep-alive\r\n' % parts.netloc
+            template = (address, prefix, header)
+            self.__templates[(url, keys)] = template
+        return template
+
+    def __authorization(self, uri):
+        if not self.__digest.ready:
+            return ''
+        return 'Authorization: %s\r\n' % self.__digest.authorization('GET', uri)
+
+    def __read_response(self):
+        status_line = self.__reader.readline(65537)
+        if not status_line:
+            raise ConnectionResetError('connection closed by camera')
+        status_code = int(status_line.split(None, 2)[1])
+
+        headers = {}
+        while True:
+            line = self.__reader.readline(65537)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, value = line.decode('latin-1').split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+
+        close = headers.get('connection', '').lower() == 'close'
+        if status_code in (204, 304) or status_code < 200:
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.__reader.readline(65537).split(b';')[0], 16)
+                if size == 0:
+                    break
+                chunks.append(self.__read_exactly(size))
+                self.__reader.readline(65537)
+            # Skip any trailer fields up to the blank line
+            while self.__reader.readline(65537) not in (b'\r\n', b'\n', b''):
+                pass
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = self.__read_exactly(int(headers['content-length']))
+        else:
+            # Neither length nor chunks, the body runs until the camera
+            # closes the connection
+            content = self.__reader.read()
+            close = True
+
+        if close:
+            self.__disconnect()
+
+        return Response(status_code, headers, content)
+
+    def __read_exactly(self, size):
+        data = self.__reader.read(size)
+        if len(data) != size:
+            raise ConnectionResetError('connection closed by camera mid-reply')
+        return data
+
+    def __request(self, uri, header, timeout):
+        # A kept-alive socket may have been closed by the camera while idle,
+        # so reconnect and retry once on a fresh connection
+        for attempt in range(2):
+            try:
+                if self.__sock is None:
+                    self.__connect(timeout)
+                else:
+                    self.__sock.settimeout(timeout)
+                request = 'GET %s HTTP/1.1\r\n%s%s\r\n' % (uri, header, self.__authorization(uri))
+                self.__sock.sendall(request.encode('latin-1'))
+                return self.__read_response()
+            except socket.timeout as e:
+                self.__disconnect()
+                raise requests.Timeout(e)
+            except OSError as e:
+                self.__disconnect()
+                if attempt != 0:
+                    raise requests.ConnectionError(e)
+
+    def get(self, url: str, params: dict, timeout: float):
+        params = { key : value for key, value in params.items() if value is not None }
+        address, prefix, header = self.__template(url, tuple(params))
+        uri = prefix % tuple(quote(str(value), safe='') for value in params.values())
+
+        with self.__lock:
+            self.__address = address
+            resp = self.__request(uri, header, timeout)
+            if resp.status_code == 401 and self.__digest.update(resp.headers.get('www-authenticate', '')):
+                resp = self.__request(uri, header, timeout)
+        return resp
+
+    def close(self):
+        # A request stuck on a dribbling camera holds the lock, shutting the
+        # socket down makes it fail
+        if not self.__lock.acquire(timeout=CLOSE_TIMEOUT):
+            sock = self.__sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return
+        try:
+            self.__disconnect()
+        finally:
+            self.__lock.release()
+
+
+TRANSPORTS = {
+    'requests' : RequestsTransport,
+    'socket' : SocketTransport,
+}
+
+def make_transport(name: str, user: str, password: str):
+    if name not in TRANSPORTS:
+        raise ValueError('unknown transport "%s"' % name)
+    return TRANSPORTS[name](user, password)
@@ -13,28 +13,81 @@ Library for control AXIS PTZ cameras using Vapix
 """
 import time
 import logging
-import sys
+import threading
 import requests
-from requests.auth import HTTPDigestAuth
 from bs4 import BeautifulSoup
 
+from .log import LogAggregator
+from .profiling import profiler
+from .metrics import metrics
+from .SessionRecorder import recorder
+from .backend import CameraAuthError, CameraBackend
+from .CameraCapabilities import CameraCapabilities, parse_ptz_info
+from .RttEstimator import RequestPolicy, RttEstimator
+from .transport import make_transport
+
 # pylint: disable=R0904
 
-class CameraControl:
+# Request timeouts by kind of request, as a multiple of the estimated
+# retransmission timeout. Motion updates are superseded by the next one, so
+# they fail fast and are never repeated. Stops and presets are repeated by the
+# CommandDispatcher until its deadline. Queries and settings are idempotent
+# and repeated here; requests that move relative to the current position are
+# not.
+POLICY_MOTION = RequestPolicy('motion', 1.0, 0.05, 0.5, 0, True)
+POLICY_STOP = RequestPolicy('stop', 1.0, 0.1, 1.0, 0, True)
+POLICY_CONTROL = RequestPolicy('control', 2.0, 0.2, 2.0, 1, True)
+POLICY_PRESET = RequestPolicy('preset', 4.0, 1.0, 5.0, 0, False)
+POLICY_ONCE = RequestPolicy('once', 2.0, 0.5, 2.0, 0, True)
+POLICIES = ( POLICY_MOTION, POLICY_STOP, POLICY_CONTROL, POLICY_PRESET, POLICY_ONCE )
+
+# Times the transport may send one attempt of a request: again on a fresh
+# connection when a kept-alive one turns out to be closed, and each of those
+# again to answer a digest challenge
+SENDS_PER_ATTEMPT = 4
+
+# Time (s) close() waits for the keep-alive thread
+CLOSE_TIMEOUT = 1.0
+
+# param.cgi groups holding the model and firmware, and the server presets
+DEVICE_INFO_PARAMS = 'root.Brand.ProdNbr,root.Properties.Firmware.Version'
+PRESET_PARAMS = 'root.PTZ.Preset.P0.Position'
+
+class CameraControl(CameraBackend):
     """
     Module for control cameras AXIS using Vapix
     """
 
-    def __init__(self, ip, user, password):
+    def __init__(self, ip, user, password, keepalive: float = None, transport: str = 'requests',
+                 request_timeout: float = None):
         self.__cam_ip = ip
         self.__cam_user = user
         self.__cam_password = password
 
         self.__ptz_url = 'http://' + self.__cam_ip + '/axis-cgi/com/ptz.cgi'
         self.__config_url = 'http://' + self.__cam_ip + '/axis-cgi/com/ptzconfig.cgi'
-
-        self.__session = requests.Session()
-        self.__session.auth = HTTPDigestAuth(self.__cam_user, self.__cam_password)
+        self.__param_url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+
+        self.__transport = make_transport(transport, self.__cam_user, self.__cam_password)
+        # request_timeout fixes the timeout of every request instead
+        self.rtt = RttEstimator(fixed=request_timeout)
+        self.__lock = threading.Lock()
+        self.__last_request = 0.0
+        self.__command_log = LogAggregator('camera_commands')
+
+        # Open and authenticate the connection up front so the first real
+        # command doesn't pay for the TCP handshake and digest challenge. The
+        # speed is kept for get_capabilities.
+        self.__speed = None
+        self.get_speed()
+
+        self.__keepalive = keepalive
+        self.__keepalive_thread = None
+        self.__shutdown_event = threading.Event()
+        if keepalive:
+            self.__keepalive_thread = threading.Thread(target=self.__keepalive_loop,
+                                                       name='CameraKeepalive', daemon=True)
+            self.__keepalive_thread.start()
 
     @staticmethod
     def __merge_dicts(*dict_args) -> dict:
@@ -53,44 +106,103 @@ class CameraControl:
             result.update(dictionary)
         return result
 
-    def _gen_camera_command(self, url: str, payload: dict):
+    def _gen_camera_command(self, url: str, command: str, payload: dict, ptz: bool = True,
+                            policy: RequestPolicy = POLICY_CONTROL):
         """
         Function used to send commands to the camera
         Args:
+            command: name the request is counted and recorded under
             payload: argument dictionary for camera control
+            ptz: add the camera and html arguments of the PTZ interface
+            policy: timeout and retries for this kind of request
 
         Returns:
             Returns the response from the device to the command sent
 
         """
-        logging.info('camera_command(%s)', payload)
+        # Individual commands are only logged at debug level, otherwise they
+        # are summarised periodically
+        self.__command_log.count(command)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug('camera_command(%s)', payload)
 
         base_q_args = {
             'camera': 1,
-            'html': 'no',
-            'timestamp': int(time.time())
+            'html': 'no'
         }
 
-        payload2 = CameraControl.__merge_dicts(payload, base_q_args)
-
-        resp = self.__session.get(url, params=payload2, timeout=2)
+        payload2 = CameraControl.__merge_dicts(payload, base_q_args) if ptz else payload
+
+        with self.__lock, profiler.stage('http'):
+            retries = 0 if self.rtt.fixed is not None else policy.retries
+            for attempt in range(retries + 1):
+                start = time.monotonic()
+                try:
+                    resp = self.__transport.get(url, payload2, self.rtt.timeout(policy))
+                    break
+                except requests.RequestException as e:
+                    metrics.inc('ptz_vapix_errors_total', error=type(e).__name__)
+                    recorder.command(command, start, time.monotonic() - start, 0)
+                    if isinstance(e, requests.Timeout):
+                        self.rtt.timed_out()
+                    if attempt == retries or not isinstance(e, (requests.Timeout, requests.ConnectionError)):
+                        raise
+                    logging.debug('CameraControl: retrying %s request: %s', policy.name, repr(e))
+            self.__last_request = time.monotonic()
+            # Only the first attempt is a clean sample, as in Karn's algorithm
+            if attempt == 0 and policy.measure:
+                self.rtt.sample(self.__last_request - start)
+
+        metrics.inc('ptz_vapix_requests_total', status=resp.status_code)
+        metrics.observe('ptz_vapix_request_seconds', self.__last_request - start)
+        recorder.command(command, start, self.__last_request - start, resp.status_code)
 
         if (resp.status_code != 200) and (resp.status_code != 204):
             soup = BeautifulSoup(resp.text, features="lxml")
             logging.error('%s', soup.get_text())
             if resp.status_code == 401:
-                sys.exit(1)
+                raise CameraAuthError('camera %s rejected the credentials for user "%s"' %
+                                      (self.__cam_ip, self.__cam_user))
 
         return resp
 
-    def _camera_command(self, payload: dict):
-        return self._gen_camera_command(self.__ptz_url, payload)
-
-    def _camera_config(self, payload: dict):
-        return self._gen_camera_command(self.__config_url, payload)
+    def _camera_command(self, command: str, payload: dict, policy: RequestPolicy = POLICY_CONTROL):
+        return self._gen_camera_command(self.__ptz_url, command, payload, policy=policy)
+
+    def _camera_config(self, command: str, payload: dict, policy: RequestPolicy = POLICY_PRESET):
+        return self._gen_camera_command(self.__config_url, command, payload, policy=policy)
+
+    def __longest(self, policy: RequestPolicy):
+        if self.rtt.fixed is not None:
+            return self.rtt.fixed * SENDS_PER_ATTEMPT
+        return policy.max_timeout * (policy.retries + 1) * SENDS_PER_ATTEMPT
+
+    def longest_request(self):
+        # A request may first wait for a keep-alive query holding the
+        # connection
+        longest = max(self.__longest(policy) for policy in POLICIES)
+        if self.__keepalive:
+            longest += self.__longest(POLICY_CONTROL)
+        return longest
+
+    def __keepalive_loop(self):
+        # Send a cheap query whenever the connection has been idle, keeping the
+        # camera from closing it and the digest nonce from going stale
+        while not self.__shutdown_event.wait(self.__keepalive / 2):
+            if time.monotonic() - self.__last_request < self.__keepalive:
+                continue
+            try:
+                self.get_speed()
+            except (requests.RequestException, CameraAuthError) as e:
+                logging.warning('CameraControl: keep-alive failed: %s', repr(e))
 
     def close(self):
-        self.__session.close()
+        self.__shutdown_event.set()
+        if self.__keepalive_thread is not None:
+            # It waits on a request that may be stuck
+            self.__keepalive_thread.join(CLOSE_TIMEOUT)
+        self.__transport.close()
+        self.__command_log.flush()
 
     def absolute_focus(self, focus: int = None, speed: int = None):
         """
@@ -104,7 +216,7 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        return self._camera_command({'focus': focus, 'speed': speed})
+        return self._camera_command('focus', {'focus': focus, 'speed': speed}, POLICY_PRESET)
 
     def continuous_focus(self, focus: int = None):
         """
@@ -117,7 +229,7 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        return self._camera_command({'continuousfocusmove': focus})
+        return self._camera_command('continuousfocusmove', {'continuousfocusmove': focus}, POLICY_MOTION)
 
     def relative_focus(self, focus: int = None, speed: int = None):
         """
@@ -131,7 +243,7 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        return self._camera_command({'rfocus': focus, 'speed': speed})
+        return self._camera_command('rfocus', {'rfocus': focus, 'speed': speed}, POLICY_ONCE)
         pass
 
     def stop_focus(self):
@@ -143,7 +255,7 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'continuousfocusmove': '0,0'})
+        return self._camera_command('stopfocus', {'continuousfocusmove': '0,0'}, POLICY_STOP)
 
     def absolute_move(self, pan: float = None, tilt: float = None, zoom: int = None,
                       speed: int = None):
@@ -160,11 +272,13 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        return self._camera_command({'pan': pan, 'tilt': tilt, 'zoom': zoom, 'speed': speed})
+        return self._camera_command('absolutemove', {'pan': pan, 'tilt': tilt, 'zoom': zoom, 'speed': speed},
+                                    POLICY_PRESET)
 
     def continuous_move(self, pan: int = None, tilt: int = None, zoom: int = None):
         """
-        Operation for continuous Pan/Tilt and Zoom movements.
+        Operation for continuous Pan/Tilt and Zoom movements. Channels left
+        as None are omitted from the request and keep their current motion.
 
         Args:
             pan: speed of movement of Pan.
@@ -175,8 +289,13 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        pan_tilt = str(pan) + "," + str(tilt)
-        return self._camera_command({'continuouspantiltmove': pan_tilt, 'continuouszoommove': zoom})
+        pan_tilt = None
+        if (pan is not None) or (tilt is not None):
+            pan_tilt = str(pan) + "," + str(tilt)
+        # A zoom only move is recorded as such rather than as a pan / tilt move
+        command = 'continuouspantiltmove' if pan_tilt is not None else 'continuouszoommove'
+        return self._camera_command(command, {'continuouspantiltmove': pan_tilt, 'continuouszoommove': zoom},
+                                    POLICY_MOTION)
 
     def relative_move(self, pan: float = None, tilt: float = None, zoom: int = None,
                       speed: int = None):
@@ -193,7 +312,8 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        return self._camera_command({'rpan': pan, 'rtilt': tilt, 'rzoom': zoom, 'speed': speed})
+        return self._camera_command('relativemove', {'rpan': pan, 'rtilt': tilt, 'rzoom': zoom, 'speed': speed},
+                                    POLICY_ONCE)
 
     def stop_move(self):
         """
@@ -204,7 +324,8 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'continuouspantiltmove': '0,0', 'continuouszoommove': 0})
+        return self._camera_command('stopmove', {'continuouspantiltmove': '0,0', 'continuouszoommove': 0},
+                                    POLICY_STOP)
 
     def center_move(self, pos_x: int = None, pos_y: int = None, speed: int = None):
         """
@@ -222,7 +343,7 @@ class CameraControl:
 
         """
         pan_tilt = str(pos_x) + "," + str(pos_y)
-        return self._camera_command({'center': pan_tilt, 'speed': speed})
+        return self._camera_command('center', {'center': pan_tilt, 'speed': speed}, POLICY_ONCE)
 
     def area_zoom(self, pos_x: int = None, pos_y: int = None, zoom: int = None,
                   speed: int = None):
@@ -240,7 +361,7 @@ class CameraControl:
 
         """
         xyzoom = str(pos_x) + "," + str(pos_y) + "," + str(zoom)
-        return self._camera_command({'areazoom': xyzoom, 'speed': speed})
+        return self._camera_command('areazoom', {'areazoom': xyzoom, 'speed': speed}, POLICY_ONCE)
 
     def move(self, position: str = None, speed: float = None):
         """
@@ -254,7 +375,7 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'move': str(position), 'speed': speed})
+        return self._camera_command('move', {'move': str(position), 'speed': speed}, POLICY_ONCE)
 
     def go_home_position(self, speed: int = None):
         """
@@ -267,7 +388,7 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'move': 'home', 'speed': speed})
+        return self._camera_command('move', {'move': 'home', 'speed': speed}, POLICY_PRESET)
 
     def get_ptz(self):
         """
@@ -277,7 +398,7 @@ class CameraControl:
             Returns a tuple with the position of the camera (P, T, Z)
 
         """
-        resp = self._camera_command({'query': 'position'})
+        resp = self._camera_command('query', {'query': 'position'})
         pan = float(resp.text.split()[0].split('=')[1])
         tilt = float(resp.text.split()[1].split('=')[1])
         zoom = float(resp.text.split()[2].split('=')[1])
@@ -297,7 +418,8 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'gotoserverpresetname': name, 'speed': speed})
+        return self._camera_command('gotoserverpresetname', {'gotoserverpresetname': name, 'speed': speed},
+                                    POLICY_PRESET)
 
     def go_to_server_preset_no(self, number: int = None, speed: int = None):
         """
@@ -311,7 +433,8 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'gotoserverpresetno': number, 'speed': speed})
+        return self._camera_command('gotoserverpresetno', {'gotoserverpresetno': number, 'speed': speed},
+                                    POLICY_PRESET)
 
     def go_to_device_preset(self, preset_pos: int = None, speed: int = None):
         """
@@ -326,7 +449,8 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_command({'gotodevicepreset': preset_pos, 'speed': speed})
+        return self._camera_command('gotodevicepreset', {'gotodevicepreset': preset_pos, 'speed': speed},
+                                    POLICY_PRESET)
 
     def list_preset_device(self):
         """
@@ -336,7 +460,7 @@ class CameraControl:
             Returns the list of presets positions stored on the device.
 
         """
-        return self._camera_command({'query': 'presetposcam'})
+        return self._camera_command('query', {'query': 'presetposcam'})
 
     def list_all_preset(self):
         """
@@ -346,17 +470,43 @@ class CameraControl:
             Returns the list of all presets positions.
 
         """
-        resp = self._camera_command({'query': 'presetposall'})
+        resp = self._camera_command('query', {'query': 'presetposall'})
         soup = BeautifulSoup(resp.text, features="lxml")
         resp_presets = soup.text.split('\n')
         presets = []
 
         for i in range(1, len(resp_presets)-1):
             preset = resp_presets[i].split("=")
+            if len(preset) != 2:
+                continue
             presets.append((int(preset[0].split('presetposno')[1]), preset[1].rstrip('\r')))
 
         return presets
 
+    def list_preset_positions(self):
+        """
+        Lists the position of every preset from the camera's preset
+        parameters, in one request rather than by moving to each preset.
+
+        Returns:
+            Returns a dict of preset name to position (P, T, Z).
+
+        """
+        params = self._list_params(PRESET_PARAMS)
+
+        positions = {}
+        for key, name in params.items():
+            if not key.endswith('.Name'):
+                continue
+            # e.g. Data=tilt=-10.000000:focus=...:pan=25.500000:iris=...:zoom=1.000000
+            data = params.get(key[:-len('.Name')] + '.Data', '')
+            fields = dict(field.split('=', 1) for field in data.split(':') if '=' in field)
+            try:
+                positions[name] = (float(fields['pan']), float(fields['tilt']), float(fields['zoom']))
+            except (KeyError, ValueError):
+                logging.warning('CameraControl: no position for preset "%s"', name)
+        return positions
+
     def set_speed(self, speed: int = None):
         """
         Sets the head speed of the device that is connected to the specified camera.
@@ -367,7 +517,10 @@ class CameraControl:
             Returns the response from the device to the command sent.
 
         """
-        return self._camera_command({'speed': speed})
+        resp = self._camera_command('speed', {'speed': speed})
+        if resp.status_code in [200, 204]:
+            self.__speed = speed
+        return resp
 
     def get_speed(self):
         """
@@ -377,8 +530,60 @@ class CameraControl:
             Returns the camera's move value.
 
         """
-        resp = self._camera_command({'query': 'speed'})
-        return int(resp.text.split()[0].split('=')[1])
+        resp = self._camera_command('query', {'query': 'speed'})
+        self.__speed = int(resp.text.split()[0].split('=')[1])
+        return self.__speed
+
+    def get_device_info(self):
+        """
+        Requests the camera's model and firmware version.
+
+        Returns:
+            Returns a tuple of (model, firmware version).
+
+        """
+        params = self._list_params(DEVICE_INFO_PARAMS)
+        return (params.get('root.Brand.ProdNbr', ''), params.get('root.Properties.Firmware.Version', ''))
+
+    def _list_params(self, *groups):
+        # Returns the parameters in the given param.cgi groups as a dict
+        resp = self._gen_camera_command(self.__param_url, 'action', {
+            'action': 'list',
+            'group': ','.join(groups)
+        }, ptz=False)
+        return dict(line.split('=', 1) for line in resp.text.splitlines() if '=' in line)
+
+    def get_capabilities(self, cache=None):
+        """
+        Discovers the commands, value ranges and presets of the camera. The
+        command description is only requested for a model and firmware not
+        already in the cache.
+
+        Returns:
+            Returns the CameraCapabilities of the camera.
+
+        """
+        # Model, firmware and preset names come in one param.cgi request, and
+        # the speed was read on connecting
+        params = self._list_params(DEVICE_INFO_PARAMS, PRESET_PARAMS)
+        capabilities = CameraCapabilities(params.get('root.Brand.ProdNbr', ''),
+                                          params.get('root.Properties.Firmware.Version', ''))
+
+        cached = cache.get(capabilities.key) if cache is not None else None
+        if cached is not None:
+            capabilities.commands, capabilities.limits = cached
+        else:
+            capabilities.commands, capabilities.limits = parse_ptz_info(self.info_ptz_comands())
+            if cache is not None:
+                cache.put(capabilities)
+
+        capabilities.presets = [ name for key, name in params.items()
+                                 if key.startswith(PRESET_PARAMS + '.') and key.endswith('.Name') ]
+        if not capabilities.presets:
+            # Cameras that keep no preset parameters are asked for the list
+            capabilities.presets = [ name for _, name in self.list_all_preset() ]
+        capabilities.speed = self.__speed if self.__speed is not None else self.get_speed()
+        return capabilities
 
     def info_ptz_comands(self):
         """
@@ -388,7 +593,7 @@ class CameraControl:
             Success (OK and system log content text) or Failure (error and description).
 
         """
-        resp = self._camera_command({'info': '1'})
+        resp = self._camera_command('info', {'info': '1'})
         return resp.text
 
     def set_server_preset_name(self, name: str = None):
@@ -402,7 +607,7 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_config({'setserverpresetname': name})
+        return self._camera_config('setserverpresetname', {'setserverpresetname': name})
 
     def set_server_preset_no(self, number: int = None):
         """
@@ -415,7 +620,7 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_config({'setserverpresetno': number})
+        return self._camera_config('setserverpresetno', {'setserverpresetno': number})
 
     def set_device_preset(self, preset_pos: int = None):
         """
@@ -430,7 +635,7 @@ class CameraControl:
             Returns the response from the device to the command sent
 
         """
-        return self._camera_config({'setdevicepreset': preset_pos})
+        return self._camera_config('setdevicepreset', {'setdevicepreset': preset_pos})
 
     def auto_focus(self, focus: str = None):  # on or off
         """
@@ -443,4 +648,4 @@ class CameraControl:
             Success (OK) or Failure (Error and description).
 
         """
-        return self._camera_command({'autofocus': focus})
+        return self._camera_command('autofocus', {'autofocus': focus})
@@ -0,0 +1,211 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# visca.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This module provides a VISCA over IP camera backend. Commands are sent as
+# UDP datagrams with the 8 byte VISCA over IP header, each tagged with a
+# sequence number that is used to match the camera's ACK / completion replies
+# and to discard stale ones. Unanswered commands are retransmitted.
+################################################################################
+
+import time
+import struct
+import socket
+import logging
+import threading
+
+from .backend import CameraError, CameraBackend
+from .CameraCapabilities import CameraCapabilities
+
+__all__ = [ 'ViscaControl' ]
+
+VISCA_PORT = 52381
+
+# VISCA over IP payload types
+VISCA_COMMAND = 0x0100
+VISCA_INQUIRY = 0x0110
+VISCA_REPLY = 0x0111
+CONTROL_COMMAND = 0x0200
+CONTROL_REPLY = 0x0201
+
+VISCA_HEADER = struct.Struct('>HHI')
+
+# Maximum pan / tilt / zoom / focus drive speeds
+PAN_SPEED_MAX = 0x18
+TILT_SPEED_MAX = 0x17
+ZOOM_SPEED_MAX = 0x07
+
+DEFAULT_PRESETS = { 'J1' : 0, 'J2' : 1, 'J3' : 2, 'J4' : 3 }
+
+
+def _scale(value, largest, speed=100):
+    # Map a speed of -100..100, as a percentage of the head speed (1..100),
+    # to a VISCA speed of 1..largest
+    return max(1, min(largest, (abs(value) * speed * largest + 9999) // 10000))
+
+
+class ViscaControl(CameraBackend):
+    """
+    Camera backend speaking VISCA over IP (UDP)
+    """
+
+    def __init__(self, ip, timeout: float = 0.2, retries: int = 3, presets: dict = None):
+        host, _, port = ip.partition(':')
+        self.__address = (host, int(port) if port else VISCA_PORT)
+        self.__timeout = timeout
+        self.__retries = retries
+        self.__presets = dict(DEFAULT_PRESETS if presets is None else presets)
+        self.__speed = 50
+        self.__seq = 0
+        self.__lock = threading.Lock()
+
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sock.connect(self.__address)
+
+        # Start the camera's sequence numbering from zero
+        self.__transact(CONTROL_COMMAND, b'\x01')
+        self.__seq = 0
+
+    def __receive(self, seq, deadline, wait_completion):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.__sock.settimeout(remaining)
+            try:
+                data = self.__sock.recv(64)
+            except socket.timeout:
+                return None
+            except OSError as e:
+                raise CameraError('VISCA receive failed: %s' % e)
+
+            if len(data) < VISCA_HEADER.size:
+                continue
+            payload_type, length, reply_seq = VISCA_HEADER.unpack_from(data)
+            payload = data[VISCA_HEADER.size:VISCA_HEADER.size + length]
+
+            # Replies to earlier (retransmitted or abandoned) commands
+            if reply_seq != seq:
+                continue
+
+            if payload_type == CONTROL_REPLY:
+                return payload
+            if payload_type != VISCA_REPLY or len(payload) < 3:
+                continue
+
+            kind = payload[1] & 0xF0
+            if kind == 0x40 and not wait_completion:
+                return payload
+            elif kind == 0x50:
+                return payload
+            elif kind == 0x60:
+                raise CameraError('VISCA error 0x%02x' % payload[2])
+
+    def __transact(self, payload_type, payload, wait_completion=False):
+        with self.__lock:
+            seq = self.__seq
+            self.__seq = (self.__seq + 1) & 0xFFFFFFFF
+            packet = VISCA_HEADER.pack(payload_type, len(payload), seq) + payload
+
+            for attempt in range(self.__retries + 1):
+                if attempt != 0:
+                    logging.warning('ViscaControl: retransmitting sequence %d', seq)
+                try:
+                    self.__sock.send(packet)
+                except OSError as e:
+                    raise CameraError('VISCA send failed: %s' % e)
+
+                reply = self.__receive(seq, time.monotonic() + self.__timeout, wait_completion)
+                if reply is not None:
+                    return reply
+
+        raise CameraError('no VISCA reply from %s:%d' % self.__address)
+
+    def _command(self, *payload):
+        return self.__transact(VISCA_COMMAND, bytes(payload))
+
+    def _inquiry(self, *payload):
+        return self.__transact(VISCA_INQUIRY, bytes(payload), wait_completion=True)
+
+    def _preset_number(self, name):
+        if name not in self.__presets:
+            raise CameraError('no VISCA preset number for "%s"' % name)
+        return self.__presets[name]
+
+    def close(self):
+        self.__sock.close()
+
+    def longest_request(self):
+        # stop_move and get_ptz send two commands, each retransmitted
+        return 2 * self.__timeout * (self.__retries + 1)
+
+    def continuous_move(self, pan: int = None, tilt: int = None, zoom: int = None):
+        if (pan is not None) or (tilt is not None):
+            pan = pan or 0
+            tilt = tilt or 0
+            pan_dir = 0x03 if pan == 0 else (0x02 if pan > 0 else 0x01)
+            tilt_dir = 0x03 if tilt == 0 else (0x01 if tilt > 0 else 0x02)
+            self._command(0x81, 0x01, 0x06, 0x01, _scale(pan, PAN_SPEED_MAX, self.__speed),
+                          _scale(tilt, TILT_SPEED_MAX, self.__speed), pan_dir, tilt_dir, 0xFF)
+
+        if zoom is not None:
+            if zoom == 0:
+                self._command(0x81, 0x01, 0x04, 0x07, 0x00, 0xFF)
+            else:
+                direction = 0x20 if zoom > 0 else 0x30
+                self._command(0x81, 0x01, 0x04, 0x07, direction | _scale(zoom, ZOOM_SPEED_MAX), 0xFF)
+
+    def stop_move(self):
+        self._command(0x81, 0x01, 0x06, 0x01, 0x01, 0x01, 0x03, 0x03, 0xFF)
+        self._command(0x81, 0x01, 0x04, 0x07, 0x00, 0xFF)
+
+    def continuous_focus(self, focus: int = None):
+        if not focus:
+            self.stop_focus()
+            return
+        direction = 0x20 if focus > 0 else 0x30
+        self._command(0x81, 0x01, 0x04, 0x08, direction | _scale(focus, ZOOM_SPEED_MAX), 0xFF)
+
+    def stop_focus(self):
+        self._command(0x81, 0x01, 0x04, 0x08, 0x00, 0xFF)
+
+    def auto_focus(self, focus: str = None):
+        self._command(0x81, 0x01, 0x04, 0x38, 0x02 if focus == 'on' else 0x03, 0xFF)
+
+    def go_home_position(self, speed: int = None):
+        self._command(0x81, 0x01, 0x06, 0x04, 0xFF)
+
+    def go_to_server_preset_name(self, name: str = None, speed: int = None):
+        self._command(0x81, 0x01, 0x04, 0x3F, 0x02, self._preset_number(name), 0xFF)
+
+    def set_server_preset_name(self, name: str = None):
+        self._command(0x81, 0x01, 0x04, 0x3F, 0x01, self._preset_number(name), 0xFF)
+
+    def set_speed(self, speed: int = None):
+        # VISCA has no default head speed, so it scales the pan / tilt speed
+        # of each continuous move instead
+        self.__speed = speed
+
+    def get_speed(self):
+        return self.__speed
+
+    def get_capabilities(self, cache=None):
+        # VISCA cannot list its commands, so all are assumed supported. Only
+        # presets with a VISCA preset number can be used.
+        return CameraCapabilities('VISCA', commands=None, presets=list(self.__presets), speed=self.__speed,
+                                  limits={ 'continuouspantiltmove' : [(-100, 100), (-100, 100)],
+                                           'continuouszoommove' : [(-100, 100)],
+                                           'continuousfocusmove' : [(-100, 100)],
+                                           'speed' : [(1, 100)] })
+
+    def get_ptz(self):
+        reply = self._inquiry(0x81, 0x09, 0x06, 0x12, 0xFF)
+        pan = struct.unpack('>h', bytes([(reply[2] << 4) | reply[3], (reply[4] << 4) | reply[5]]))[0]
+        tilt = struct.unpack('>h', bytes([(reply[6] << 4) | reply[7], (reply[8] << 4) | reply[9]]))[0]
+
+        reply = self._inquiry(0x81, 0x09, 0x04, 0x47, 0xFF)
+        zoom = (reply[2] << 12) | (reply[3] << 8) | (reply[4] << 4) | reply[5]
+
+        return (float(pan), float(tilt), float(zoom))
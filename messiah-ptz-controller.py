@@ -5,115 +5,123 @@
 # Copyright (c) 2022 Mark Whiting
 #
 # This program reads data from the AXIS T8311 Joystick and based on the inputs
-# sends network commands to an AXIS V5914 PTZ camera.
+# sends network commands to an AXIS V5914 PTZ camera. Camera discovery, joystick
+# input and the camera sessions run on a single asyncio event loop, which is
+# watched for stalls along with each camera's command dispatcher.
 ################################################################################
 
+import os
 import sys
-import time
+import signal
+import asyncio
 import logging
-import threading
 
 import netifaces
 import ipaddress
-import requests
 
-from zeroconf import ServiceBrowser, Zeroconf
-from ping3 import ping
+from zeroconf import ServiceStateChange
+from zeroconf.asyncio import AsyncZeroconf, AsyncServiceBrowser
 
-from lib.PtzController import *
-from lib.PtzCamera import *
+from lib.CameraSession import CameraSession
+from lib.log import start_logging
+from lib.profiling import profiler
+from lib.metrics import metrics
+from lib.SessionRecorder import recorder
+from lib.EventBus import EventBus, EventSocketServer
+from lib.NetworkInput import NetworkInput
+from lib.ConfigWatcher import ConfigWatcher
+from lib.Watchdog import watchdog
 
+import config
 from config import *
 
+# Settings that are only read at start-up. All others are applied in place or
+# by reopening the camera session.
+RESTART_SETTINGS = { 'METRICS_PORT', 'EVENT_SOCKET', 'REMOTE_INPUT_PORT', 'REMOTE_INPUT_HOST', 'REMOTE_INPUT_SECRET',
+                     'WATCHDOG_TIMEOUT', 'WATCHDOG_GRACE' }
+
+AXIS_SERVICE = '_axis-video._tcp.local.'
+
 
 ################################################################################
 # 
 ################################################################################
-class CameraThread(threading.Thread):
-    def __init__(self, ip):
-        threading.Thread.__init__(self)
-        self._ip = ip
-        self._camera = None
-        self._controller = None
-        self._shutdownEvent = threading.Event()
-
-    def shutdown(self):
-        self._shutdownEvent.set()
-
-    def _cleanup_hid(self):
-        if self._controller is not None:
-            self._controller.close()
-        self._controller = None
-
-    def _cleanup_camera(self):
-        if self._camera is not None:
-            self._camera.close()
-        self._camera = None
-
-    def _update(self):
-        try:
-            if self._controller is None:
-                self._controller = PtzController(HID_VID, HID_PID, BUTTON_HOLD_TIME)
-
-            if self._camera is None:
-                self._camera = PtzCamera(self._ip, CAM_USER, CAM_PW)
-
-            if None not in [self._controller, self._camera]:
-                events = self._controller.update()
-                if len(events) != 0:
-                    for event in events:
-                        self._camera.handle_event(event)
-
-        except HIDException as e:
-            logging.error('Failed to open HID device: "%s"', repr(e))
-            self._cleanup_hid()
-            time.sleep(1)
-
-        except (requests.RequestException, requests.ConnectionError, requests.HTTPError, requests.Timeout) as e:
-            logging.error('Error communicating with Camera on network: "%s"', repr(e))
-            self._cleanup_camera()
-            time.sleep(1)
-
-        except Exception as e:
-            logging.error('Unhandled exception: "%s"', repr(e))
-            return False
-
-        if ping(self._ip, timeout=1) == None:
-            logging.error('Failed to locate Camera on network')
-            self._cleanup_camera()
-            time.sleep(1)
-
-        return True
-
-    def run(self):
-        while True:
-            if self._shutdownEvent.wait(0.0):
-                break
-            if not self._update():
-                break
-
-        logging.info('CameraThread: exiting')
+class AxisDiscovery:
+    """
+    Browses for the camera with CAM_MAC and runs a CameraSession for it on the
+    event loop while it is on the network.
+    """
+
+    def __init__(self, aiozc, config, event_bus, remote_input):
+        self._aiozc = aiozc
+        self._config = config
+        self._event_bus = event_bus
+        self._remote_input = remote_input
+        self._browser = None
+        self._lookups = set()
+        self._sessions = {}
+        self.camera_ip = None
+
+        metrics.gauge('ptz_camera_discovered', lambda: self.camera_ip is not None)
+        metrics.gauge('ptz_camera_thread_alive', lambda: len(self._sessions) != 0)
+
+    def start(self):
+        self._browser = AsyncServiceBrowser(self._aiozc.zeroconf, AXIS_SERVICE, handlers=[self._on_service])
+
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.async_cancel()
+            self._browser = None
+        for task in list(self._lookups):
+            task.cancel()
+        await asyncio.gather(*(self._stop_session(name) for name in list(self._sessions)))
+
+    async def apply_config(self, config, changed):
+        self._config = config
+        if 'CAM_MAC' in changed:
+            # Browse again so a camera already on the network is reported
+            logging.info('AxisDiscovery: Camera MAC address changed, stopping camera session')
+            await self.close()
+            self.start()
+            return
 
-        self._cleanup_hid()
-        self._cleanup_camera()
+        for session, _ in self._sessions.values():
+            session.apply_config(config, changed)
+
+    def _on_service(self, zeroconf, service_type, name, state_change):
+        # Called on the event loop by the browser, lookups run as tasks
+        task = asyncio.ensure_future(self._service_changed(service_type, name, state_change))
+        self._lookups.add(task)
+        task.add_done_callback(self._lookups.discard)
+
+    async def _service_changed(self, service_type, name, state_change):
+        logging.debug('AxisDiscovery: %s %s', state_change.name, name)
+        if state_change is ServiceStateChange.Removed:
+            if name in self._sessions:
+                logging.info('AxisDiscovery: Stopping camera session')
+                await self._stop_session(name)
+            return
 
+        # Only one camera is controlled, a running session keeps it
+        if self._sessions:
+            return
 
-################################################################################
-# 
-################################################################################
-class AxisZeroconfListener:
-    def __init__(self):
-        self._camera_control_thread = None
+        info = await self._aiozc.async_get_service_info(service_type, name)
+        logging.debug('AxisDiscovery: info=%s', str(info))
+        cam_ip = self._match_camera(info) if info is not None else None
+        if cam_ip is not None and not self._sessions:
+            logging.info('AxisDiscovery: Starting camera session for ip "%s"', cam_ip)
+            self._start_session(name, cam_ip)
 
-    def _start_stop_camera(self, info, action):
+    def _match_camera(self, info):
         # Check if this is the specific camera we are looking for via MAC address
         if b'macaddress' not in info.properties:
-            log.debug('AxisZeroconfListener: Failed to find MAC address')
-            return
+            logging.debug('AxisDiscovery: Failed to find MAC address')
+            return None
 
-        if info.properties[b'macaddress'] != CAM_MAC:
-            log.debug('AxisZeroconfListener: MAC address mismatch')
-            return
+        if info.properties[b'macaddress'] != self._config['CAM_MAC']:
+            logging.debug('AxisDiscovery: MAC address mismatch')
+            return None
 
         # Get our network info
         host_addr = netifaces.ifaddresses('eth0')[netifaces.AF_INET][0]
@@ -121,67 +129,160 @@ class AxisZeroconfListener:
         host_netmask = host_addr['netmask']
 
         host_iface = ipaddress.IPv4Interface('%s/%s' % (host_ip, host_netmask))
-        logging.debug('AxisZeroconfListener: Host interface %s', repr(host_iface))
+        logging.debug('AxisDiscovery: Host interface %s', repr(host_iface))
 
-        # Get the ip addresses for this camera
+        # Get the ip address of this camera on our network
         for cam_address in info.parsed_scoped_addresses():
             cam_ip = ipaddress.ip_address(cam_address)
             if cam_ip in host_iface.network:
-                if action == 'start':
-                    logging.info('AxisZeroconfListener: Starting camera thread for ip "%s"', cam_ip)
-                    self._camera_control_thread = CameraThread(str(cam_ip))
-                    self._camera_control_thread.start()
-                elif action == 'stop':
-                    logging.info('AxisZeroconfListener: Stopping camera thread')
-                    self._camera_control_thread.shutdown()
-                    self._camera_control_thread.join()
-                    self._camera_control_thread = None
-                else:
-                    logging.error('AxisZeroconfListener: Unknown action "%s"', action);
-
-    def remove_service(self, zeroconf, type, name):
-        if self._camera_control_thread is not None:
-            info = zeroconf.get_service_info(type, name)
-            logging.debug('AxisZeroconfListener: remove_service(), info=%s', str(info))
-            self._start_stop_camera(info, 'stop')
-
-    def add_service(self, zeroconf, type, name):
-        if self._camera_control_thread is None:
-            info = zeroconf.get_service_info(type, name)
-            logging.debug('AxisZeroconfListener: add_service(), info=%s', str(info))
-            self._start_stop_camera(info, 'start')
-
-    def update_service(self, zeroconf, type, name):
-        if not self._camera_control_thread.is_alive():
-            info = zeroconf.get_service_info(type, name)
-            logging.debug('AxisZeroconfListener: update_service(), info=%s', str(info))
-            self._start_stop_camera(info, 'start')
+                return str(cam_ip)
+        return None
+
+    def _start_session(self, name, cam_ip):
+        session = CameraSession(cam_ip, self._config, self._event_bus, self._remote_input)
+        task = asyncio.ensure_future(session.run())
+        task.add_done_callback(lambda task: self._session_done(name, task))
+        self._sessions[name] = (session, task)
+        self.camera_ip = cam_ip
+
+    def _session_done(self, name, task):
+        # A session only ends by itself on a bug, it is started again when the
+        # camera is next announced
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('AxisDiscovery: camera session failed: %s', repr(task.exception()))
+        if self._sessions.get(name, (None, None))[1] is task:
+            del self._sessions[name]
+            self.camera_ip = None
+
+    async def _stop_session(self, name):
+        session, task = self._sessions[name]
+        session.shutdown()
+        await asyncio.gather(task, return_exceptions=True)
 
 
 ################################################################################
 # Main
 ################################################################################
+async def run(settings, watcher, event_bus, remote_input):
+    loop = asyncio.get_running_loop()
+
+    stop = asyncio.Event()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            # Not available on Windows, KeyboardInterrupt still ends asyncio.run()
+            pass
+
+    # Discovery callbacks and fd based joystick reads run on the loop, so its
+    # heartbeat covers them
+    heartbeat = asyncio.ensure_future(watchdog.watch_loop())
+
+    aiozc = AsyncZeroconf()
+    discovery = AxisDiscovery(aiozc, settings, event_bus, remote_input)
+    discovery.start()
+
+    async def apply_config(settings, changed):
+        logging.getLogger().setLevel(settings['LOG_LEVEL'])
+        profiler.report_dir = settings['PROFILE_DIR']
+        profiler.interval = settings['PROFILE_INTERVAL']
+        if remote_input is not None:
+            remote_input.timeout = settings['REMOTE_INPUT_TIMEOUT']
+        if 'RECORD_DIR' in changed:
+            recorder.stop()
+            if settings['RECORD_DIR'] is not None:
+                recorder.start(settings['RECORD_DIR'])
+        for key in sorted(changed & RESTART_SETTINGS):
+            logging.warning('Setting %s takes effect on restart', key)
+        await discovery.apply_config(settings, changed)
+
+    def applied(future):
+        # Nothing else waits on the future, so errors are logged here
+        if not future.cancelled() and future.exception() is not None:
+            logging.error('Failed to apply settings: %s', repr(future.exception()))
+
+    # The watcher calls back on its own thread
+    watcher.callback = lambda settings, changed: \
+        asyncio.run_coroutine_threadsafe(apply_config(settings, changed), loop).add_done_callback(applied)
+    watcher.start()
+
+    try:
+        await stop.wait()
+        logging.info('Caught signal, exiting...')
+    finally:
+        watcher.shutdown()
+        await discovery.close()
+        await aiozc.async_close()
+        heartbeat.cancel()
+
 def main():
-    logging.basicConfig(level=logging.DEBUG)
+    log_listener = start_logging(LOG_LEVEL)
     logging.info('Started')
 
-    zeroconf = Zeroconf()
-    listener = AxisZeroconfListener()
-    browser = ServiceBrowser(zeroconf, "_axis-video._tcp.local.", listener)
+    # Settings from config.py, overridden by the watched CONFIG_FILE
+    defaults = { key : getattr(config, key) for key in config.__all__
+                 if key not in ['CONFIG_FILE', 'OPTIONAL_SETTINGS', 'POSITIVE_SETTINGS'] }
+    watcher = ConfigWatcher(CONFIG_FILE, defaults, None, OPTIONAL_SETTINGS, POSITIVE_SETTINGS)
+    settings = watcher.config
+    logging.getLogger().setLevel(settings['LOG_LEVEL'])
+
+    # Profiling can be enabled at start-up or toggled on the live process
+    profiler.report_dir = settings['PROFILE_DIR']
+    profiler.interval = settings['PROFILE_INTERVAL']
+    profiler.install_signal_handler()
+    if os.environ.get('PTZ_PROFILE'):
+        profiler.enable()
+
+    if settings['RECORD_DIR'] is not None:
+        recorder.start(settings['RECORD_DIR'])
+
+    # A stalled component is restarted, or the process exits for supervisor
+    # to start it again, with the log flushed first
+    if settings['WATCHDOG_TIMEOUT'] is not None:
+        watchdog.before_exit = log_listener.stop
+        watchdog.install_signal_handler()
+        watchdog.start(settings['WATCHDOG_TIMEOUT'], settings['WATCHDOG_GRACE'])
+
+    if settings['METRICS_PORT'] is not None:
+        metrics.histogram('ptz_vapix_request_seconds')
+        metrics.serve(settings['METRICS_PORT'])
+
+    event_bus = EventBus()
+    event_server = None
+    if settings['EVENT_SOCKET'] is not None:
+        try:
+            event_server = EventSocketServer(event_bus, settings['EVENT_SOCKET'])
+            event_server.start()
+        except OSError as e:
+            logging.error('Event socket disabled: %s', str(e))
 
+    remote_input = None
+    if settings['REMOTE_INPUT_PORT'] is not None:
+        try:
+            remote_input = NetworkInput(settings['REMOTE_INPUT_PORT'], settings['REMOTE_INPUT_HOST'],
+                                        settings['REMOTE_INPUT_TIMEOUT'], settings['REMOTE_INPUT_SECRET'])
+        except (ValueError, OSError) as e:
+            logging.error('Remote input disabled: %s', str(e))
+
+    # Discovery, joystick input and camera sessions all run on one event loop
     try:
-        while True:
-            time.sleep(0.1)
+        asyncio.run(run(settings, watcher, event_bus, remote_input))
     except KeyboardInterrupt:
         logging.info('Caught keyboard interrupt, exiting...')
-        pass
     finally:
-        zeroconf.close()
+        watchdog.stop()
+        watcher.shutdown()
+        recorder.stop()
+        metrics.close()
+        if event_server is not None:
+            event_server.close()
+        if remote_input is not None:
+            remote_input.close()
 
     logging.info('Finished')
+    log_listener.stop()
     sys.exit(0)
 
 
 if __name__ == '__main__':
     main()
-
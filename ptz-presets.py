@@ -0,0 +1,133 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# ptz-presets.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# This program exports the server presets of an AXIS camera with their
+# positions to a JSON file, and restores them to one or many cameras at once,
+# e.g. to move a production to a new camera or to clone a rig:
+#
+#   python ptz-presets.py export 192.168.0.90 presets.json
+#   python ptz-presets.py import presets.json 192.168.0.91 192.168.0.92
+#   python ptz-presets.py copy 192.168.0.90 192.168.0.91 192.168.0.92
+#
+# Restoring drives each camera to every preset, so do not run it on a camera
+# that is live. Presets already set at the same position are left alone, so an
+# interrupted restore can simply be run again.
+################################################################################
+
+import sys
+import time
+import logging
+import argparse
+
+import requests
+
+from lib.backend import CameraError
+from lib.vapix import CameraControl
+from lib.PresetTransfer import PresetTransfer, snapshot, load_presets, save_presets
+
+from config import CAM_USER, CAM_PW, CAM_TRANSPORT
+
+
+def open_camera(args, ip):
+    return CameraControl(ip, args.user, args.password, transport=args.transport)
+
+def print_progress(camera, done, total, preset, error):
+    if preset is None:
+        print('%s: [%d/%d] already set' % (camera, done, total))
+    elif error is not None:
+        print('%s: [%d/%d] %s failed: %s' % (camera, done, total, preset, error))
+    else:
+        print('%s: [%d/%d] %s' % (camera, done, total, preset))
+    sys.stdout.flush()
+
+def export_presets(args):
+    camera = open_camera(args, args.camera)
+    try:
+        presets = snapshot(camera, args.visit)
+    finally:
+        camera.close()
+    save_presets(args.file, args.camera, presets)
+    print('%s: saved %d presets to %s' % (args.camera, len(presets), args.file))
+    return presets
+
+def restore_presets(args, presets):
+    transfer = PresetTransfer(lambda ip: open_camera(args, ip), args.jobs, args.speed, args.force,
+                              print_progress)
+    start = time.monotonic()
+    results = transfer.restore(args.cameras, presets)
+
+    failed = False
+    print('restored %d presets to %d cameras in %.1f s' % (len(presets), len(args.cameras),
+                                                           time.monotonic() - start))
+    for ip, result in results.items():
+        print('  %-20s written %4d  already set %4d  failed %4d' % (ip, len(result.written),
+                                                                  len(result.skipped), len(result.errors)))
+        if None in result.errors:
+            print('  %-20s %s' % ('', result.errors[None]))
+        failed = failed or bool(result.errors)
+    if failed:
+        sys.exit(1)
+
+def import_presets(args):
+    source, presets = load_presets(args.file)
+    if args.only:
+        presets = [ p for p in presets if p.name in args.only ]
+    print('%s: %d presets from %s' % (args.file, len(presets), source or 'unknown camera'))
+    restore_presets(args, presets)
+
+def copy_presets(args):
+    camera = open_camera(args, args.camera)
+    try:
+        presets = snapshot(camera, args.visit)
+    finally:
+        camera.close()
+    if args.only:
+        presets = [ p for p in presets if p.name in args.only ]
+    print('%s: %d presets' % (args.camera, len(presets)))
+    restore_presets(args, presets)
+
+def main():
+    parser = argparse.ArgumentParser(description='Export, import and copy AXIS camera presets')
+    parser.add_argument('--user', default=CAM_USER, help='camera user name')
+    parser.add_argument('--password', default=CAM_PW, help='camera password')
+    parser.add_argument('--transport', default=CAM_TRANSPORT, choices=['requests', 'socket'])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='save the presets of a camera to a file')
+    export.add_argument('camera', help='camera address')
+    export.add_argument('file', help='preset file to write')
+    export.set_defaults(run=export_presets)
+
+    restore = commands.add_parser('import', help='restore the presets in a file to cameras')
+    restore.add_argument('file', help='preset file written by export')
+    restore.add_argument('cameras', nargs='+', help='camera addresses')
+    restore.set_defaults(run=import_presets)
+
+    copy = commands.add_parser('copy', help='copy the presets of a camera to other cameras')
+    copy.add_argument('camera', help='camera to copy from')
+    copy.add_argument('cameras', nargs='+', help='camera addresses to copy to')
+    copy.set_defaults(run=copy_presets)
+
+    for command in [ export, copy ]:
+        command.add_argument('--visit', action='store_true',
+                             help='drive to presets the camera does not report a position for')
+    for command in [ restore, copy ]:
+        command.add_argument('--jobs', type=int, default=8, help='cameras restored at once')
+        command.add_argument('--speed', type=int, default=100, help='head speed for moving to presets')
+        command.add_argument('--force', action='store_true', help='also rewrite presets already set')
+        command.add_argument('--only', nargs='+', metavar='NAME', help='only these presets')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        args.run(args)
+    except (CameraError, requests.RequestException, OSError, ValueError) as e:
+        sys.exit('ptz-presets.py: %s' % str(e))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_command_dispatcher.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of CommandDispatcher's retries of stops until the camera acknowledges
+# them.
+################################################################################
+
+import pytest
+
+from lib.CommandDispatcher import CommandClass, CommandDispatcher
+from lib.backend import CameraError
+from lib.transport import Response
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = CommandDispatcher(retry_deadline=0.1, retry_interval=0.01)
+    dispatcher.start()
+    yield dispatcher
+    dispatcher.shutdown()
+    dispatcher.join()
+
+def replies(*status_codes):
+    # A camera command answering with each status in turn, then the last
+    calls = []
+    def command():
+        calls.append(None)
+        return Response(status_codes[min(len(calls), len(status_codes)) - 1], {}, b'')
+    return command, calls
+
+def test_stop_is_retried_until_acknowledged(dispatcher):
+    command, calls = replies(503, 503, 204)
+    future = dispatcher.submit(CommandClass.STOP, 'move', command)
+
+    assert future.result(1.0).status_code == 204
+    assert len(calls) == 3
+    assert dispatcher.stats['STOP']['count'] == 1
+    dispatcher.check()
+
+def test_stop_never_acknowledged_fails(dispatcher):
+    command, calls = replies(503)
+    future = dispatcher.submit(CommandClass.STOP, 'move', command)
+
+    with pytest.raises(CameraError):
+        future.result(1.0)
+    assert len(calls) > 1
+    assert dispatcher.stats['STOP']['count'] == 0
+    assert dispatcher.stats['STOP']['errors'] == 1
+    with pytest.raises(CameraError):
+        dispatcher.check()
@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_config.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of the validation of settings in the watched JSON config file.
+################################################################################
+
+import json
+
+import pytest
+
+import config
+from lib.ConfigWatcher import ConfigError, load_config
+
+DEFAULTS = { key : getattr(config, key) for key in config.__all__
+             if key not in ['CONFIG_FILE', 'OPTIONAL_SETTINGS', 'POSITIVE_SETTINGS'] }
+
+def load(tmp_path, settings):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps(settings))
+    return load_config(str(path), DEFAULTS, config.OPTIONAL_SETTINGS, config.POSITIVE_SETTINGS)
+
+def test_missing_file_gives_the_defaults(tmp_path):
+    assert load_config(str(tmp_path / 'missing.json'), DEFAULTS) == DEFAULTS
+
+def test_defaults_are_valid(tmp_path):
+    settings = { key : list(value) if isinstance(value, tuple) else value for key, value in DEFAULTS.items()
+                 if not isinstance(value, bytes) }
+    assert load(tmp_path, settings) == DEFAULTS
+
+def test_settings_are_applied(tmp_path):
+    settings = load(tmp_path, { 'MOTION_TICK_RATE' : 10, 'JOYSTICK_DEADZONE' : [0.2, 0.2, 0.2] })
+    assert settings['MOTION_TICK_RATE'] == 10.0
+    assert isinstance(settings['MOTION_TICK_RATE'], float)
+    assert settings['JOYSTICK_DEADZONE'] == (0.2, 0.2, 0.2)
+
+@pytest.mark.parametrize('settings', [
+    { 'NO_SUCH_SETTING' : 1 },
+    { 'MOTION_TICK_RATE' : 'fast' },
+    { 'MOTION_TICK_RATE' : True },
+    { 'HID_PROCESS' : 1 },
+    { 'MOTION_MAX_ACCEL' : -1.0 },
+    { 'JOYSTICK_DEADZONE' : [0.1, 0.1] },
+    { 'JOYSTICK_DEADZONE' : [0.1, 0.1, -0.1] },
+    { 'CAM_USER' : None },
+])
+def test_invalid_settings_are_rejected(tmp_path, settings):
+    with pytest.raises(ConfigError):
+        load(tmp_path, settings)
+
+@pytest.mark.parametrize('key', config.POSITIVE_SETTINGS)
+def test_zero_rates_and_timeouts_are_rejected(tmp_path, key):
+    with pytest.raises(ConfigError):
+        load(tmp_path, { key : 0 })
+
+def test_zero_is_allowed_where_it_disables(tmp_path):
+    settings = load(tmp_path, { 'MOTION_LEAD' : 0, 'MOTION_SMOOTHING' : 0, 'MOTION_MAX_ACCEL' : 0 })
+    assert settings['MOTION_LEAD'] == 0.0
+
+def test_optional_settings_may_be_null(tmp_path):
+    assert load(tmp_path, { 'CAM_KEEPALIVE' : None })['CAM_KEEPALIVE'] is None
+
+def test_unreadable_file_is_rejected(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text('{ not json')
+    with pytest.raises(ConfigError):
+        load_config(str(path), DEFAULTS)
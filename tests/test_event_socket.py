@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_event_socket.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of the permissions of EventSocketServer's Unix socket.
+################################################################################
+
+import os
+import stat
+import socket
+
+import pytest
+
+from lib.EventBus import EventBus, EventSocketServer
+
+def test_socket_is_private(tmp_path):
+    path = str(tmp_path / 'events.sock')
+    server = EventSocketServer(EventBus(), path)
+    try:
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    finally:
+        server.close()
+    assert not os.path.exists(path)
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / 'events.sock')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+    server = EventSocketServer(EventBus(), path)
+    server.close()
+
+def test_other_file_is_left_alone(tmp_path):
+    path = tmp_path / 'events.sock'
+    path.write_text('not a socket')
+    with pytest.raises(FileExistsError):
+        EventSocketServer(EventBus(), str(path))
+    assert path.read_text() == 'not a socket'
@@ -0,0 +1,29 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_log.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of the one line per record log format.
+################################################################################
+
+import logging
+
+from lib.log import CompactFormatter
+
+def record(message, *args, exc_info=None):
+    return logging.LogRecord('test', logging.ERROR, __file__, 1, message, args, exc_info)
+
+def test_message_is_one_quoted_field():
+    line = CompactFormatter().format(record('camera "%s" said:\n%s', 'a\\b', 'Error: "preset"\r\n'))
+    assert '\n' not in line and '\r' not in line
+    assert line.endswith(r' msg="camera \"a\\b\" said:\nError: \"preset\"\r\n"')
+
+def test_exception_is_one_quoted_field():
+    try:
+        raise ValueError('bad "value"')
+    except ValueError as e:
+        line = CompactFormatter().format(record('failed', exc_info=(type(e), e, e.__traceback__)))
+    assert '\n' not in line
+    assert ' exc="Traceback' in line
+    assert r'ValueError: bad \"value\""' in line
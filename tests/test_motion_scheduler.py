@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_motion_scheduler.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of MotionScheduler's smoothing and limiting of targets into the
+# commands sent each tick, driving its ticks directly.
+################################################################################
+
+from concurrent.futures import Future
+
+import pytest
+
+from lib.MotionScheduler import MotionScheduler
+from lib.backend import CameraError
+
+DT = 0.05
+
+class Sender(object):
+    # A channel's send, recording each output and completing its command
+    def __init__(self):
+        self.outputs = []
+        self.error = None
+
+    def __call__(self, output):
+        self.outputs.append(output)
+        future = Future()
+        if self.error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(self.error)
+        return [future]
+
+def scheduler_with(sender, **limits):
+    scheduler = MotionScheduler(**limits)
+    scheduler.add_channel('move', 2, sender)
+    return scheduler
+
+def run(scheduler, ticks):
+    # Returns the channel's velocity and acceleration after each tick
+    channel = scheduler._channels['move']
+    steps = []
+    for _ in range(ticks):
+        scheduler._tick(DT)
+        steps.append((list(channel.velocity), list(channel.accel)))
+    return steps
+
+def test_unchanged_output_is_sent_once():
+    sender = Sender()
+    scheduler = scheduler_with(sender, smoothing=0, max_accel=0, max_jerk=0)
+    scheduler.set_target('move', (0.5, -0.5))
+    run(scheduler, 5)
+    assert sender.outputs == [(0.5, -0.5)]
+
+def test_nothing_is_sent_until_a_target_is_set():
+    sender = Sender()
+    run(scheduler_with(sender), 5)
+    assert sender.outputs == []
+
+def test_acceleration_is_limited():
+    sender = Sender()
+    scheduler = scheduler_with(sender, smoothing=0, max_accel=4.0, max_jerk=0)
+    scheduler.set_target('move', (1.0, -1.0))
+    velocities = [ velocity for velocity, accel in run(scheduler, 20) ]
+    for before, after in zip([[0.0, 0.0]] + velocities, velocities):
+        for v0, v1 in zip(before, after):
+            assert abs(v1 - v0) <= 4.0 * DT + 1e-9
+    assert velocities[-1] == [1.0, -1.0]
+
+def test_jerk_is_limited_without_overshoot():
+    sender = Sender()
+    scheduler = scheduler_with(sender, smoothing=0, max_accel=4.0, max_jerk=40.0)
+    scheduler.set_target('move', (0.8, -0.3))
+    steps = run(scheduler, 40)
+    for (_, before), (velocity, after) in zip([(None, [0.0, 0.0])] + steps, steps):
+        for a0, a1, v, target in zip(before, after, velocity, (0.8, -0.3)):
+            # Except for settling on the target when reaching it
+            if (v, a1) != (target, 0.0):
+                assert abs(a1 - a0) <= 40.0 * DT + 1e-9
+    for velocity, accel in steps:
+        assert 0.0 <= velocity[0] <= 0.8 + 1e-9
+        assert -0.3 - 1e-9 <= velocity[1] <= 0.0
+    assert steps[-1][0] == [0.8, -0.3]
+
+def test_smoothing_eases_towards_the_target():
+    sender = Sender()
+    scheduler = scheduler_with(sender, smoothing=0.1, max_accel=0, max_jerk=0)
+    scheduler.set_target('move', (1.0, 0.0))
+    velocities = [ velocity[0] for velocity, accel in run(scheduler, 40) ]
+    assert 0.0 < velocities[0] < 0.5
+    assert velocities == sorted(velocities)
+    assert velocities[-1] == 1.0
+
+def test_stop_resets_the_channel():
+    sender = Sender()
+    scheduler = scheduler_with(sender)
+    scheduler.set_target('move', (1.0, 1.0))
+    run(scheduler, 5)
+    sent = len(sender.outputs)
+
+    scheduler.stop('move')
+    steps = run(scheduler, 5)
+    assert len(sender.outputs) == sent
+    assert steps[-1] == ([0.0, 0.0], [0.0, 0.0])
+
+def test_failed_output_is_sent_again():
+    sender = Sender()
+    sender.error = CameraError('refused')
+    scheduler = scheduler_with(sender, smoothing=0, max_accel=0, max_jerk=0)
+    scheduler.set_target('move', (0.5, 0.5))
+    run(scheduler, 1)
+    sender.error = None
+    run(scheduler, 3)
+    assert sender.outputs == [(0.5, 0.5), (0.5, 0.5)]
+
+def test_send_error_is_raised_by_check():
+    def send(output):
+        raise CameraError('unreachable')
+    scheduler = MotionScheduler(smoothing=0, max_accel=0, max_jerk=0)
+    scheduler.add_channel('move', 2, send)
+    scheduler.set_target('move', (0.5, 0.5))
+    scheduler._tick(DT)
+
+    with pytest.raises(CameraError):
+        scheduler.check()
+    scheduler.check()
+    # Nothing more is sent until a new target is set
+    assert not scheduler._channels['move'].active
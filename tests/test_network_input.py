@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_network_input.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of NetworkInput's checks on signed remote input packets.
+################################################################################
+
+import time
+import socket
+
+import pytest
+
+from lib.NetworkInput import NetworkInput, NetworkInputSender, FRESHNESS_WINDOW
+
+SECRET = 'not very secret'
+REPORT = bytes([0xFF, 0x80, 0x80, 0x00])
+
+@pytest.fixture
+def remote():
+    remote = NetworkInput(0, timeout=0.05, secret=SECRET)
+    yield remote
+    remote.close()
+
+def receive(remote):
+    time.sleep(0.02)
+    return remote.receive()
+
+def capture(report):
+    # A signed packet as seen on the network
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sender = NetworkInputSender(*sock.getsockname(), secret=SECRET)
+        sender.send(report)
+        sender.close()
+        return sock.recv(64)
+
+def replay(remote, packet):
+    # Sent from a new address, as another host would
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(packet, remote.address)
+
+def test_signed_report_is_accepted(remote):
+    sender = NetworkInputSender(*remote.address, secret=SECRET)
+    sender.send(REPORT)
+    assert receive(remote) == REPORT
+    sender.close()
+
+def test_wrong_secret_is_rejected(remote):
+    sender = NetworkInputSender(*remote.address, secret='guess')
+    sender.send(REPORT)
+    assert receive(remote) is None
+    assert remote.stats['invalid'] == 1
+    sender.close()
+
+def test_replay_after_sender_goes_quiet_is_rejected(remote):
+    packet = capture(REPORT)
+    replay(remote, packet)
+    assert receive(remote) == REPORT
+
+    # The sender has gone quiet, so another address may take over, but not
+    # with the captured packet
+    time.sleep(0.1)
+    replay(remote, packet)
+    assert receive(remote) is None
+    assert remote.stats['stale'] == 1
+
+def test_old_packet_is_rejected(remote, monkeypatch):
+    clock = time.time()
+    monkeypatch.setattr(time, 'time', lambda: clock - 2 * FRESHNESS_WINDOW)
+    packet = capture(REPORT)
+    monkeypatch.undo()
+
+    replay(remote, packet)
+    assert receive(remote) is None
+    assert remote.stats['stale'] == 1
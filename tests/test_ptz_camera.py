@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_ptz_camera.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of PtzCamera's connection setup and commands against the local
+# VapixSimulator.
+################################################################################
+
+import time
+import threading
+
+import pytest
+
+from lib.PtzCamera import PtzCamera
+from lib.PtzController import Buttons, Events, Event
+from lib.vapix import CameraControl
+from lib.backend import CameraError
+from lib.CameraSimulator import VapixSimulator
+
+@pytest.fixture
+def simulator():
+    with VapixSimulator() as simulator:
+        yield simulator
+
+@pytest.fixture
+def camera(simulator, monkeypatch, tmp_path):
+    # Away from any PtzCameraSettings.json in the working directory
+    monkeypatch.chdir(tmp_path)
+    camera = PtzCamera(simulator.address, 'root', 'pass')
+    yield camera
+    camera.close()
+
+def wait_until(condition, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def keepalive_threads():
+    return [ thread for thread in threading.enumerate() if thread.name == 'CameraKeepalive' ]
+
+def test_failed_connect_closes_the_camera(simulator, monkeypatch, tmp_path):
+    def fail(self, cache=None):
+        raise CameraError('capabilities unavailable')
+    monkeypatch.setattr(CameraControl, 'get_capabilities', fail)
+    monkeypatch.chdir(tmp_path)
+
+    for _ in range(3):
+        with pytest.raises(CameraError):
+            PtzCamera(simulator.address, 'root', 'pass', keepalive=0.1)
+    assert keepalive_threads() == []
+
+    # Nothing keeps polling the camera
+    requests = simulator.stats['requests']
+    time.sleep(0.3)
+    assert simulator.stats['requests'] == requests
+
+def test_preset_set_after_connect_is_recalled(simulator, camera):
+    # As if set on the camera's web page after PtzCamera connected
+    simulator.presets['J1'] = (10.0, 20.0, 30.0)
+    camera.handle_event(Event(Events.BTN_PRESS, Buttons.J1, None, None, None))
+
+    assert wait_until(lambda: simulator.position == [10.0, 20.0, 30.0])
@@ -0,0 +1,172 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_ptz_camera_commands.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of which commands PtzCamera sends to the camera, against a NullCamera
+# that records them.
+################################################################################
+
+import sys
+
+import pytest
+
+from lib.PtzCamera import PtzCamera
+from lib.NullCamera import NullCamera
+from lib.PtzController import Events, Event
+from lib.CommandDispatcher import CommandClass
+from lib.backend import CameraError
+
+class RecordingCamera(NullCamera):
+    # Records the commands PtzCamera sends, in order
+    def __init__(self, name: str = 'null'):
+        NullCamera.__init__(self, name)
+        self.commands = []
+        # Makes the mode commands fail, as if the camera refused them
+        self.fail = False
+
+    def continuous_move(self, pan: int = None, tilt: int = None, zoom: int = None):
+        self.commands.append(('continuous_move', pan, tilt, zoom))
+
+    def stop_move(self):
+        self.commands.append(('stop_move',))
+
+    def continuous_focus(self, focus: int = None):
+        self.commands.append(('continuous_focus', focus))
+
+    def stop_focus(self):
+        self.commands.append(('stop_focus',))
+
+    def auto_focus(self, focus: str = None):
+        self.commands.append(('auto_focus', focus))
+        if self.fail:
+            raise CameraError('auto_focus refused')
+
+    def set_speed(self, speed: int = None):
+        self.commands.append(('set_speed', speed))
+        if self.fail:
+            raise CameraError('set_speed refused')
+
+@pytest.fixture
+def camera(monkeypatch, tmp_path):
+    # Away from any PtzCameraSettings.json in the working directory
+    monkeypatch.chdir(tmp_path)
+    # lib re-exports the PtzCamera class under its module's name
+    monkeypatch.setattr(sys.modules[PtzCamera.__module__], 'NullCamera', RecordingCamera)
+    camera = PtzCamera('null', None, None, protocol='null', hysteresis=2)
+    yield camera
+    camera.close()
+
+def drain(camera):
+    # Waits for every command submitted so far, as motion updates go last
+    camera.dispatcher.submit(CommandClass.MOTION, 'drain', lambda: None).result(1.0)
+    return camera.camera.commands
+
+def stick(camera, *reports):
+    # Moves the stick through (timestamp, (pan, tilt, zoom)) reports
+    for timestamp, joystick in reports:
+        camera.handle_event(Event(Events.MOVE_UPDATE, None, None, joystick, timestamp))
+
+def target(camera):
+    return camera.scheduler._channels['move'].target
+
+def stops(camera):
+    return drain(camera).count(('stop_move',))
+
+def test_first_move_is_sent(camera):
+    camera._send_move((0.5, 0.0, 0.0))
+    assert drain(camera) == [('continuous_move', 50, 0, None), ('continuous_move', None, None, 0)]
+
+def test_flicker_within_hysteresis_is_suppressed(camera):
+    camera._send_move((0.5, -0.5, 0.5))
+    sent = len(drain(camera))
+    for velocity in [(0.51, -0.49, 0.52), (0.49, -0.51, 0.48), (0.52, -0.5, 0.5)]:
+        camera._send_move(velocity)
+    assert len(drain(camera)) == sent
+    assert camera.stats['suppressed'] == 3
+
+def test_change_beyond_hysteresis_is_sent(camera):
+    camera._send_move((0.5, 0.0, 0.0))
+    drain(camera)
+    camera._send_move((0.53, 0.0, 0.0))
+    # Only the channel that changed
+    assert drain(camera)[-1] == ('continuous_move', 53, 0, None)
+
+def test_stopping_or_reversing_an_axis_is_always_sent(camera):
+    camera._send_move((0.01, 0.0, 0.01))
+    drain(camera)
+    camera._send_move((-0.01, 0.0, 0.0))
+    assert drain(camera)[-2:] == [('continuous_move', -1, 0, None), ('continuous_move', None, None, 0)]
+
+def test_move_is_resent_once_its_command_failed(camera):
+    camera._send_move((0.5, 0.0, 0.0))
+    drain(camera)
+    camera.state.invalidate('pantilt')
+    camera._send_move((0.5, 0.0, 0.0))
+    assert drain(camera)[-1] == ('continuous_move', 50, 0, None)
+
+def move(camera, *reports):
+    camera.handle_event(Event(Events.MOVE_START, None, None, None, None))
+    stick(camera, *reports)
+
+def test_stick_is_followed_until_the_latency_is_known(camera):
+    move(camera, (0.0, (0.8, 0.0, 0.0)), (0.1, (0.3, 0.0, 0.0)))
+    assert target(camera) == (0.3, 0.0, 0.0)
+    assert camera.stats['early_stops'] == 0
+
+def test_slow_return_is_projected_ahead(camera, monkeypatch):
+    monkeypatch.setattr(camera.dispatcher, 'expected_latency', lambda cmd_class: 0.1)
+    move(camera, (0.0, (0.8, 0.4, 0.0)), (0.1, (0.7, 0.4, 0.0)))
+    assert target(camera) == pytest.approx((0.6, 0.4, 0.0))
+
+def test_release_stops_early_once(camera, monkeypatch):
+    monkeypatch.setattr(camera.dispatcher, 'expected_latency', lambda cmd_class: 0.1)
+    move(camera, (0.0, (0.8, 0.0, 0.0)), (0.1, (0.3, 0.0, 0.0)))
+    assert camera.stats['early_stops'] == 1
+    assert stops(camera) == 1
+
+    # Nor again as the stick settles or is let go
+    stick(camera, (0.15, (0.1, 0.0, 0.0)), (0.2, (0.0, 0.0, 0.0)))
+    camera.handle_event(Event(Events.MOVE_END, None, None, None, None))
+    assert camera.stats['early_stops'] == 1
+    assert stops(camera) == 1
+
+def test_easing_back_does_not_stop_early(camera, monkeypatch):
+    monkeypatch.setattr(camera.dispatcher, 'expected_latency', lambda cmd_class: 0.1)
+    move(camera, (0.0, (0.1, 0.0, 0.0)), (0.1, (0.05, 0.0, 0.0)))
+    assert target(camera) == (0.0, 0.0, 0.0)
+    assert camera.stats['early_stops'] == 0
+    assert stops(camera) == 0
+
+def test_mode_already_set_is_not_sent_again(camera):
+    camera._start_focus()
+    camera._start_focus()
+    assert drain(camera).count(('auto_focus', 'off')) == 1
+    assert camera.stats['unchanged'] == 1
+
+    camera._reset_focus()
+    assert drain(camera)[-1] == ('auto_focus', 'on')
+
+def test_mode_is_sent_again_after_it_failed(camera):
+    camera.camera.fail = True
+    camera._start_focus()
+    drain(camera)
+    assert camera.state.get('autofocus') is None
+
+    camera.camera.fail = False
+    camera._start_focus()
+    assert drain(camera).count(('auto_focus', 'off')) == 2
+    assert camera.stats['unchanged'] == 0
+
+def test_error_forgets_every_mode(camera):
+    camera._start_focus()
+    drain(camera)
+    camera.camera.fail = True
+    camera._set_speed(10)
+    drain(camera)
+
+    with pytest.raises(CameraError):
+        camera.poll()
+    assert camera.state.get('autofocus') is None
+    assert camera.state.get('speed') is None
@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: MIT
+################################################################################
+# test_visca.py
+#
+# Copyright (c) 2022 Mark Whiting
+#
+# Tests of ViscaControl's acknowledgements, sequence numbers and retransmits
+# against the local ViscaSimulator.
+################################################################################
+
+import pytest
+
+from lib.visca import ViscaControl, PAN_SPEED_MAX
+from lib.backend import CameraError
+from lib.CameraSimulator import ViscaSimulator
+
+# Reply timeout (s) short enough to keep retransmits quick
+TIMEOUT = 0.05
+
+@pytest.fixture
+def simulator():
+    with ViscaSimulator() as simulator:
+        yield simulator
+
+@pytest.fixture
+def camera(simulator):
+    camera = ViscaControl(simulator.address, timeout=TIMEOUT, retries=3)
+    yield camera
+    camera.close()
+
+def sequences(simulator):
+    # Sequence numbers of the VISCA commands and inquiries the simulator got
+    return [ entry[3] for entry in simulator.log if entry[1] != 0x0200 ]
+
+def test_lost_ack_is_retransmitted(simulator, camera):
+    simulator.drop_replies = 1
+    camera.continuous_move(100, 0, None)
+
+    assert simulator.drive[0] > 0
+    assert simulator.stats['dropped'] == 1
+    # The retransmit reuses the sequence number of the lost command
+    assert sequences(simulator) == [0, 0]
+
+def test_every_ack_lost_raises(simulator, camera):
+    simulator.drop_replies = 4
+    with pytest.raises(CameraError):
+        camera.stop_move()
+    assert sequences(simulator) == [0, 0, 0, 0]
+
+def test_late_duplicate_reply_is_discarded(simulator, camera):
+    # The replies to the first command arrive late, along with the replies to
+    # its retransmit, and must not be taken for the inquiry's reply
+    simulator.hold_replies = 1
+    camera.continuous_move(100, 0, None)
+    simulator.position = [123, -45, 678]
+
+    assert camera.get_ptz() == (123.0, -45.0, 678.0)
+    assert simulator.stats['held'] == 1
+
+def test_error_reply_raises(simulator, camera):
+    with pytest.raises(CameraError):
+        camera._inquiry(0x81, 0x09, 0x7F, 0x7F, 0xFF)
+    # The camera is still in step afterwards
+    assert camera.get_ptz() == (0.0, 0.0, 0.0)
+
+def test_sequence_wraparound(simulator, camera):
+    camera._ViscaControl__seq = 0xFFFFFFFE
+    simulator.drop_replies = 1
+    simulator.position = [10, -20, 300]
+    for i in range(3):
+        camera.continuous_move(50, 0, None)
+    assert camera.get_ptz() == (10.0, -20.0, 300.0)
+
+    # The sequence number wraps to zero, and the retransmit reuses it
+    assert sequences(simulator) == [0xFFFFFFFE, 0xFFFFFFFE, 0xFFFFFFFF, 0, 1, 2]
+
+def test_speed_scales_pan_tilt(simulator, camera):
+    camera.set_speed(100)
+    camera.continuous_move(100, 0, None)
+    assert simulator.drive[0] == PAN_SPEED_MAX
+
+    camera.set_speed(50)
+    camera.continuous_move(100, 0, None)
+    assert simulator.drive[0] == PAN_SPEED_MAX // 2